@@ -0,0 +1,61 @@
+"""
+    Compare the cost of serializing typical API payloads to bytes with
+    each JSON library installed, and with the naive json.dumps().encode().
+
+    Run it with: python benchmarks/json_encoding.py
+"""
+
+import json
+import time
+
+from tygs import serializers
+
+
+def make_record(i):
+    return {'id': i,
+            'name': 'User number {}'.format(i),
+            'email': 'user{}@example.com'.format(i),
+            'active': i % 2 == 0,
+            'score': i * 1.5,
+            'tags': ['tag1', 'tag2', 'élève'],
+            'address': {'city': 'Paris', 'zip': '75001'}}
+
+
+PAYLOADS = (
+    ('small (1 record)', make_record(1), 20000),
+    ('medium (100 records)', [make_record(i) for i in range(100)], 500),
+    ('large (10k records)', [make_record(i) for i in range(10000)], 5),
+)
+
+
+def get_encoders():
+    encoders = [('json.dumps().encode()', lambda d: json.dumps(d).encode()),
+                ('json', serializers.stdlib_dumps)]
+    if serializers.ujson is not None:
+        encoders.append(('ujson', serializers.ujson_dumps))
+    if serializers.orjson is not None:
+        encoders.append(('orjson', serializers.orjson.dumps))
+    return encoders
+
+
+def measure(dumps, data, iterations):
+    timer = time.perf_counter
+    start = timer()
+    for _ in range(iterations):
+        dumps(data)
+    return (timer() - start) / iterations * 1e6
+
+
+def main():
+    print('Default backend: {}'.format(serializers.JSON_BACKEND))
+    print('(microseconds per call)')
+    for name, data, iterations in PAYLOADS:
+        size = len(serializers.dumps(data))
+        print('\n{} - {} bytes'.format(name, size))
+        for encoder_name, dumps in get_encoders():
+            duration = measure(dumps, data, iterations)
+            print('{:>25} {:>12.1f}'.format(encoder_name, duration))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,67 @@
+"""
+    Measure the memory allocated for each request by the request and
+    response controllers, with tracemalloc, and the time it takes to create
+    them and render a text response.
+
+    Run it with: python benchmarks/request_allocations.py
+"""
+
+import time
+import tracemalloc
+
+from multidict import CIMultiDict, MultiDict
+
+from tygs.webapp import WebApp
+from tygs.http.server import HttpRequestController
+
+
+REQUESTS = 10000
+
+
+class FakeAiohttpRequest:
+    """ Just the attributes the controllers read from aiohttp's Request """
+
+    def __init__(self):
+        self.host = 'localhost:8080'
+        self.method = 'GET'
+        self.headers = CIMultiDict({'Host': 'localhost:8080'})
+        self.cookies = MultiDict()
+        self.scheme = 'http'
+        self.path = '/users/42'
+        self.GET = MultiDict()
+
+
+def handle(app, aiohttp_request):
+    req = HttpRequestController(app, aiohttp_request)
+    req.url_args = {'id': 42}
+    req.response.text('Hello')
+    req.response.render_response()
+    return req
+
+
+def main():
+    app = WebApp('benchmark')
+    aiohttp_requests = [FakeAiohttpRequest() for _ in range(REQUESTS)]
+
+    tracemalloc.start()
+    before = tracemalloc.take_snapshot()
+    kept = [handle(app, r) for r in aiohttp_requests]
+    after = tracemalloc.take_snapshot()
+    tracemalloc.stop()
+
+    stats = after.compare_to(before, 'filename')
+    size = sum(stat.size_diff for stat in stats)
+    blocks = sum(stat.count_diff for stat in stats)
+    print('Memory per request: {:.0f} bytes in {:.1f} blocks'.format(
+        size / REQUESTS, blocks / REQUESTS))
+    del kept
+
+    start = time.perf_counter()
+    for r in aiohttp_requests:
+        handle(app, r)
+    duration = (time.perf_counter() - start) / REQUESTS
+    print('Time per request: {:.2f} microseconds'.format(duration * 1e6))
+
+
+if __name__ == '__main__':
+    main()
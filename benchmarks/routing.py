@@ -0,0 +1,100 @@
+"""
+    Compare the time it takes to match a URL with werkzeug's
+    Map.bind().match() and with the compiled route matcher used by
+    tygs.http.server.Router.
+
+    Run it with: python benchmarks/routing.py
+"""
+
+import random
+import time
+
+from werkzeug.exceptions import HTTPException
+
+from tygs.http.server import Router
+
+
+ROUTE_COUNTS = (10, 100, 1000)
+MATCHES = 20000
+
+
+def make_router(count):
+    router = Router()
+    paths = []
+    for i in range(count):
+        # Mix of static and parametrized routes, like a real app
+        kind = i % 4
+        if kind == 0:
+            url = path = '/static{}/page'.format(i)
+        elif kind == 1:
+            url = '/users{}/<int:id>'.format(i)
+            path = '/users{}/42'.format(i)
+        elif kind == 2:
+            url = '/blog{}/<slug>/comments/'.format(i)
+            path = '/blog{}/hello-world/comments/'.format(i)
+        else:
+            url = '/<lang>/docs{}/<page>'.format(i)
+            path = '/en/docs{}/intro'.format(i)
+        router.add_route(url, 'endpoint{}'.format(i), None, methods=['GET'])
+        paths.append(path)
+
+    # Some 404 too
+    paths.extend('/not/found/{}'.format(i) for i in range(count // 10 + 1))
+    return router, paths
+
+
+def werkzeug_match(router, path):
+    adapter = router.url_map.bind(server_name='localhost',
+                                  script_name=None,
+                                  subdomain=None,
+                                  url_scheme='http',
+                                  default_method='GET',
+                                  path_info=path,
+                                  query_args={})
+    try:
+        return adapter.match()
+    except HTTPException:
+        pass
+
+
+def compiled_match(router, path):
+    try:
+        return router.matcher.match(path, 'GET')
+    except HTTPException:
+        pass
+
+
+def measure(match, router, paths):
+    timer = time.perf_counter
+    durations = []
+    for path in paths:
+        start = timer()
+        match(router, path)
+        durations.append(timer() - start)
+    durations.sort()
+    p50 = durations[len(durations) // 2]
+    p99 = durations[int(len(durations) * 0.99)]
+    return p50 * 1e6, p99 * 1e6
+
+
+def main():
+    print('{:>7} {:>10} {:>10} {:>10} {:>10}'.format(
+        'routes', 'wz p50', 'wz p99', 'tygs p50', 'tygs p99'))
+    print('(microseconds)')
+    for count in ROUTE_COUNTS:
+        router, paths = make_router(count)
+        paths = [random.choice(paths) for _ in range(MATCHES)]
+
+        # Check both give the same result, and compile the matcher
+        for path in set(paths):
+            assert werkzeug_match(router, path) == \
+                compiled_match(router, path)
+
+        wz_p50, wz_p99 = measure(werkzeug_match, router, paths)
+        tygs_p50, tygs_p99 = measure(compiled_match, router, paths)
+        print('{:>7} {:>10.1f} {:>10.1f} {:>10.1f} {:>10.1f}'.format(
+            count, wz_p50, wz_p99, tygs_p50, tygs_p99))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,74 @@
+"""
+    Measure the round-trip latency of sequential RPC calls, and the number
+    of calls per second with many concurrent calls on the same connection.
+
+    The server and the client run in the same process and loop, so the
+    numbers include both sides.
+
+    Run it with: python benchmarks/rpc.py
+"""
+
+import time
+import asyncio
+import tempfile
+
+from tygs.app import App
+from tygs.rpc import RpcComponent, CODEC
+
+
+SEQUENTIAL_CALLS = 5000
+CONCURRENCY = (1, 10, 100)
+CONCURRENT_CALLS = 20000
+
+
+async def measure_latency(rpc):
+    timer = time.perf_counter
+    durations = []
+    for i in range(SEQUENTIAL_CALLS):
+        start = timer()
+        await rpc.call(rpc.path, 'echo', i)
+        durations.append(timer() - start)
+    durations.sort()
+    p50 = durations[len(durations) // 2]
+    p99 = durations[int(len(durations) * 0.99)]
+    return p50 * 1e6, p99 * 1e6
+
+
+async def measure_throughput(rpc, concurrency):
+    per_client = CONCURRENT_CALLS // concurrency
+
+    async def client():
+        for i in range(per_client):
+            await rpc.call(rpc.path, 'echo', i)
+
+    start = time.perf_counter()
+    await asyncio.gather(*[client() for _ in range(concurrency)])
+    return per_client * concurrency / (time.perf_counter() - start)
+
+
+async def run():
+    rpc = RpcComponent(App('bench'), directory=tempfile.mkdtemp())
+
+    @rpc.expose
+    def echo(value):
+        return value
+
+    await rpc.start()
+    try:
+        print('Codec: {}'.format(CODEC))
+        p50, p99 = await measure_latency(rpc)
+        print('Latency: p50 {:.1f}us, p99 {:.1f}us'.format(p50, p99))
+        for concurrency in CONCURRENCY:
+            rate = await measure_throughput(rpc, concurrency)
+            print('{:>4} concurrent calls: {:>8.0f} calls/s'.format(
+                concurrency, rate))
+    finally:
+        await rpc.stop()
+
+
+def main():
+    asyncio.get_event_loop().run_until_complete(run())
+
+
+if __name__ == '__main__':
+    main()
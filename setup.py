@@ -62,6 +62,9 @@ setuptools.setup(name='tygs',
                  setup_requires=['pytest-runner'],
                  tests_require=dev_requirements,
                  include_package_data=True,
+                 entry_points={
+                     'console_scripts': ['tygs-bench = tygs.bench:main'],
+                 },
                  license='WTFPL',
                  zip_safe=False,
                  keywords='tygs async rpc pubsub http websocket',
@@ -0,0 +1,181 @@
+import os
+import sys
+import time
+import logging
+import threading
+
+from collections import deque
+
+from path import Path
+
+from .components import Component
+from .utils import inline
+
+
+log = logging.getLogger(__name__)
+
+
+def format_record(record):
+    """ Format a record in the Combined Log Format, plus the duration """
+    (timestamp, remote, method, path, version, status, size, duration,
+     referer, user_agent) = record
+    date = time.strftime('%d/%b/%Y:%H:%M:%S +0000', time.gmtime(timestamp))
+    return '{} - - [{}] "{} {} HTTP/{}.{}" {} {} "{}" "{}" {:.6f}\n'.format(
+        remote or '-', date, method, path, version[0], version[1], status,
+        size, referer or '-', user_agent or '-', duration)
+
+
+class AccessLogComponent(Component):
+    """
+    Write one line per request, without blocking the loop.
+
+    The loop only appends a tuple to a buffer. A thread formats and writes
+    the lines every flush_interval seconds, in one write() per batch. If
+    the buffer already holds buffer_size records, the new ones are dropped
+    and counted in "dropped" rather than slowing down the requests. The
+    records that can't be written are counted there too.
+
+    path is a file, or None for stderr. "{worker}" in the path is replaced
+    by the worker id, so the workers don't share a file. When the file
+    reaches max_bytes, it's renamed to "<path>.1", "<path>.1" to "<path>.2"
+    and so on, and only backup_count of them are kept.
+
+    It's off unless enabled, with WebApp(access_log=path or True) or
+    enable().
+    """
+
+    def __init__(self, app, path=None, buffer_size=10000, flush_interval=1.0,
+                 max_bytes=None, backup_count=5, formatter=format_record):
+        super().__init__(app)
+        self.path = path
+        self.buffer_size = buffer_size
+        self.flush_interval = flush_interval
+        self.max_bytes = max_bytes
+        self.backup_count = backup_count
+        self.formatter = formatter
+        self.enabled = False
+        self.buffer = deque()
+        self.dropped = 0
+        self.written = 0
+        self.thread = None
+        self.stopping = threading.Event()
+        self.file = None
+        self.size = 0
+
+    @inline
+    def setup(self):
+        self.app.register('ready', self.start, inline=True)
+        self.app.register('stop', self.stop, inline=True)
+
+    def enable(self, path=None):
+        self.enabled = True
+        if path is not None:
+            self.path = path
+
+    def record(self, transport, message, status, size, duration):
+        """ Called on the loop for each request: only keep the data """
+        if len(self.buffer) >= self.buffer_size:
+            self.dropped += 1
+            return
+        peername = transport.get_extra_info('peername')
+        headers = message.headers
+        # deque.append() is thread safe
+        self.buffer.append((
+            time.time(),
+            peername[0] if isinstance(peername, tuple) else peername,
+            message.method, message.path, message.version, status, size,
+            duration, headers.get('REFERER'), headers.get('USER-AGENT')))
+
+    def get_path(self):
+        if self.path is None or self.path is True:
+            return None
+        worker = '' if self.app.worker_id is None else self.app.worker_id
+        return Path(str(self.path).format(worker=worker))
+
+    def start(self):
+        if not self.enabled or self.thread is not None:
+            return
+        self.stopping.clear()
+        self.open()
+        self.thread = threading.Thread(target=self.run,
+                                       name='tygs-access-log', daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        if self.thread is None:
+            return
+        # The thread writes what's left, then exits
+        self.stopping.set()
+        self.thread.join()
+        self.thread = None
+        # Requests that ended since then
+        self.flush()
+        self.close()
+        if self.dropped:
+            log.warning('%s access log records dropped', self.dropped)
+
+    def open(self):
+        path = self.get_path()
+        if path is None:
+            self.file = sys.stderr
+            return
+        path.parent.makedirs_p()
+        self.file = open(path, 'a', encoding='utf8')
+        self.size = self.file.tell()
+
+    def close(self):
+        if self.file is not None and self.file is not sys.stderr:
+            self.file.close()
+        self.file = None
+
+    def run(self):
+        while not self.stopping.wait(self.flush_interval):
+            self.flush()
+        self.flush()
+
+    def flush(self):
+        """ Write the buffered records. Called in the writer thread. """
+        buffer = self.buffer
+        lines = []
+        try:
+            while True:
+                lines.append(self.formatter(buffer.popleft()))
+        except IndexError:
+            pass
+        if not lines:
+            return
+
+        data = ''.join(lines)
+        # max_bytes is in bytes, not characters
+        size = len(data.encode('utf8'))
+        try:
+            if self.file is None:
+                self.open()
+            if self.max_bytes and self.size + size > self.max_bytes:
+                self.rotate()
+            self.file.write(data)
+            self.file.flush()
+        except Exception:
+            log.exception("Can't write the access log")
+            self.dropped += len(lines)
+            return
+        self.size += size
+        self.written += len(lines)
+
+    def rotate(self):
+        path = self.get_path()
+        if path is None:
+            return
+        self.close()
+        try:
+            for i in range(self.backup_count - 1, 0, -1):
+                source = '{}.{}'.format(path, i)
+                if os.path.exists(source):
+                    os.replace(source, '{}.{}'.format(path, i + 1))
+            if self.backup_count:
+                os.replace(str(path), '{}.1'.format(path))
+            else:
+                os.remove(str(path))
+        finally:
+            # The original file if the rotation failed
+            self.open()
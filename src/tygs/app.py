@@ -7,20 +7,43 @@ from textwrap import dedent
 from path import Path
 
 from .components import SignalDispatcher
+from .cache import CacheComponent
+from .tasks import TaskComponent
+from .pubsub import PubSubComponent
+from .rpc import RpcComponent
+from .threads import ThreadPoolComponent
+from .monitor import LoopMonitor
 from .utils import (get_project_dir, ensure_awaitable, DebugException,
                     silence_loop_error_log, aioloop)
 
 
 class App:
 
-    def __init__(self, ns):
+    def __init__(self, ns, threads=None, max_queued_calls=None, loop=None,
+                 monitor=False):
         self.ns = ns
-        self.components = {'signals': SignalDispatcher(self)}
+        self.components = {'signals': SignalDispatcher(self),
+                           'cache': CacheComponent(self),
+                           'tasks': TaskComponent(self),
+                           'pubsub': PubSubComponent(self),
+                           'rpc': RpcComponent(self),
+                           'threads': ThreadPoolComponent(
+                               self, max_workers=threads,
+                               max_queued=max_queued_calls),
+                           'monitor': LoopMonitor(self)}
+        if monitor:
+            self.components['monitor'].enable()
         self.project_dir = None
         self.state = "pristine"
         self.main_future = None
-        self.loop = asyncio.get_event_loop()
+        # "asyncio", "uvloop" or "auto". None keeps the current loop.
+        if loop is None:
+            self.loop = asyncio.get_event_loop()
+        else:
+            self.loop = aioloop(loop)
         self.fail_fast_mode = False
+        # Set in each process when running several workers
+        self.worker_id = None
 
     def fail_fast(self, on=False):
         if on:
@@ -34,14 +57,20 @@ class App:
                 DebugException.fail_fast_mode = False
             self.fail_fast_mode = False
 
-    def on(self, event):
-        return self.components['signals'].on(event)
+    def on(self, event, **options):
+        return self.components['signals'].on(event, **options)
+
+    def register(self, event, handler, **options):
+        return self.components['signals'].register(event, handler, **options)
+
+    def trigger(self, event, *args, **kwargs):
+        return self.components['signals'].trigger(event, *args, **kwargs)
 
-    def register(self, event, handler):
-        return self.components['signals'].register(event, handler)
+    def task(self, func=None, **options):
+        return self.components['tasks'].task(func, **options)
 
-    def trigger(self, event):
-        return self.components['signals'].trigger(event)
+    def enqueue(self, task, *args, **kwargs):
+        return self.components['tasks'].enqueue(task, *args, **kwargs)
 
     def change_state(self, value):
         self.state = value
@@ -54,10 +83,14 @@ class App:
         self.project_dir = Path(cwd)
 
     async def setup_components(self):
-        components = self.components.values()
-        futures = [ensure_awaitable(c.setup) for c in components]
-        # waiting for answer for BDFL
-        return await asyncio.gather(*futures)
+        # One at a time: the setups register handlers, which is not thread
+        # safe, and the regular ones run in the thread pool
+        threads = self.components['threads']
+        results = []
+        for component in list(self.components.values()):
+            setup = threads.wrap(component.setup)
+            results.append(await ensure_awaitable(setup))
+        return results
 
     async def setup(self, cwd=None):
 
@@ -72,15 +105,14 @@ class App:
 
         # TODO: create a namespace for the events. We will want more details
         # like project.init, project.ready, app_name.init, app_name.ready, etc.
-        # TODO: allow to pass arguments in events.
-        # TODO: allow synchronous events
 
         await self.change_state('init')
 
         await self.change_state('ready')
 
         # Not awaiting so all callbacks from here are not blocking.
-        return self.change_state('running')
+        self.state = 'running'
+        return self.trigger('running', mode='background')
 
     async def async_ready(self, cwd=None):
         task = asyncio.ensure_future(self.setup(cwd))
@@ -96,10 +128,17 @@ class App:
 
         return task
 
-    def ready(self, cwd=None, force_new_loop=False):
+    def ready(self, cwd=None, force_new_loop=False, loop=None):
+        """
+        Run the app until it's stopped. With force_new_loop, or if loop is
+        set to "asyncio", "uvloop" or "auto", start a new event loop.
+        """
 
-        if force_new_loop:
-            self.loop = aioloop()
+        if force_new_loop or loop is not None:
+            self.loop = aioloop(loop)
+            # The task factory was set on the previous loop
+            if self.fail_fast_mode:
+                self.fail_fast(True)
 
         # If we are killed, try to gracefully exit
         if self.loop.is_running():
@@ -127,6 +166,10 @@ class App:
         # changing the event loop once it's set
 
         self._add_signal_handlers(('SIGINT', 'SIGTERM'), self.stop)
+        # Turn the request profiler on and off at runtime
+        profiler = self.components.get('profiler')
+        if profiler is not None and hasattr(signal, 'SIGUSR2'):
+            self._add_signal_handlers(('SIGUSR2',), profiler.toggle)
 
         clean = False  # do not stop cleanly if the user made a mistake
         try:
@@ -161,7 +204,10 @@ class App:
                 self._finish()
 
     async def async_stop(self):
-        return await self.change_state('stop')
+        results = await self.change_state('stop')
+        # Last, since the "stop" handlers may use the thread pool
+        await self.components['threads'].shutdown()
+        return results
 
     def stop(self):
         """
@@ -171,8 +217,9 @@ class App:
         self.state = 'stopping'
         if self.loop.is_running():
             # This stops the loop, and activate ready()'s finally which
-            # will enventually call self._stop().
-            self.loop.stop()
+            # will enventually call self._stop(). Handlers may call us
+            # from the thread pool.
+            self.loop.call_soon_threadsafe(self.loop.stop)
 
     def break_loop_with_error(self, msg, exception=RuntimeError):
         # Silence other exception handlers, since we want to break
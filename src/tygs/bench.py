@@ -0,0 +1,339 @@
+"""
+HTTP load benchmark of a reference WebApp.
+
+Start the app in a separate process, send requests to each route at a fixed
+concurrency, and optionally a fixed rate, then report the requests per
+second, the latency percentiles and the memory used by the server:
+
+    python -m tygs.bench --duration 10 --concurrency 50 --output run.json
+
+With a fixed rate, latencies are measured from the time each request was
+scheduled, so a slow server can't hide its delays by slowing the client
+down. Compare with a previous run with "--baseline run.json": the exit code
+is 1 if a scenario is slower than the tolerance allows.
+"""
+
+import sys
+import json
+import time
+import socket
+import shutil
+import asyncio
+import argparse
+import platform
+import itertools
+import tempfile
+
+from multiprocessing import Process
+
+import aiohttp
+
+from path import Path
+
+
+# name => (method, path, form data, expected status)
+SCENARIOS = {
+    'text': ('GET', '/text', None, 200),
+    'template': ('GET', '/template', None, 200),
+    'json': ('GET', '/json', None, 200),
+    'url_args': ('GET', '/users/42/posts/hello-world', None, 200),
+    'form': ('POST', '/form', {'name': 'tygs', 'message': 'hello'}, 200),
+    'not_found': ('GET', '/not/found', None, 404),
+    'error': ('GET', '/error', None, 500),
+}
+
+TEMPLATE = """<!DOCTYPE html>
+<html>
+<head><title>{{ title }}</title></head>
+<body>
+<ul>
+{% for item in items %}<li>{{ item.name }}: {{ item.value }}</li>
+{% endfor %}
+</ul>
+</body>
+</html>
+"""
+
+
+def make_app(host='127.0.0.1', port=8765, loop=None):
+    """ Return the reference app with one route for each scenario """
+    from .webapp import WebApp
+
+    app = WebApp('bench', host=host, port=port, loop=loop)
+    http = app.components['http']
+    items = [{'name': 'item{}'.format(i), 'value': i} for i in range(20)]
+
+    @http.get('/text', inline=True)
+    def text(req, res):
+        return res.text('Hello, World!')
+
+    @http.get('/template', inline=True)
+    def template(req, res):
+        return res.template('bench.html', {'title': 'Bench', 'items': items})
+
+    @http.get('/json', inline=True)
+    def json_(req, res):
+        return res.json({'message': 'Hello, World!', 'items': items})
+
+    @http.get('/users/<int:user_id>/posts/<slug>', inline=True)
+    def url_args(req, res):
+        return res.text('{} {}'.format(req.url_args['user_id'],
+                                       req.url_args['slug']))
+
+    @http.post('/form', inline=True)
+    def form(req, res):
+        return res.text('{}: {}'.format(req['name'], req['message']))
+
+    @http.get('/error', inline=True)
+    def error(req, res):
+        raise ValueError('Expected error')
+
+    return app
+
+
+def run_server(host, port, project_dir, loop, workers):
+    app = make_app(host, port, loop)
+    if workers:
+        app.ready(project_dir, workers=workers)
+    else:
+        app.ready(project_dir)
+
+
+def wait_for_port(host, port, timeout=10):
+    deadline = time.monotonic() + timeout
+    while True:
+        try:
+            socket.create_connection((host, port), 0.1).close()
+            return
+        except OSError:
+            if time.monotonic() > deadline:
+                raise RuntimeError("The server didn't start in time")
+            time.sleep(0.05)
+
+
+def get_rss(pid):
+    """ Resident memory of the process and its children in kB, if known """
+    pids = [pid]
+    try:
+        with open('/proc/{}/task/{}/children'.format(pid, pid)) as f:
+            pids.extend(int(child) for child in f.read().split())
+    except OSError:
+        pass
+
+    total = 0
+    for pid in pids:
+        try:
+            with open('/proc/{}/status'.format(pid)) as f:
+                for line in f:
+                    if line.startswith('VmRSS:'):
+                        total += int(line.split()[1])
+        except OSError:
+            return None
+    return total
+
+
+def percentile(values, q):
+    """ values must be sorted """
+    if not values:
+        return None
+    index = min(int(len(values) * q), len(values) - 1)
+    return values[index]
+
+
+async def send(session, method, url, data):
+    """ Send a request and return the response status, None on error """
+    try:
+        async with session.request(method, url, data=data) as response:
+            await response.read()
+            return response.status
+    except aiohttp.ClientError:
+        return None
+
+
+async def run_client(session, scenario, url, start, deadline, rate,
+                     counter, stats):
+    method, path, data, expected_status = scenario
+    loop = asyncio.get_event_loop()
+    while True:
+        if rate:
+            scheduled = start + next(counter) / rate
+            delay = scheduled - loop.time()
+            if delay > 0:
+                await asyncio.sleep(delay)
+        else:
+            scheduled = loop.time()
+        if scheduled >= deadline:
+            return
+
+        status = await send(session, method, url + path, data)
+        stats['latencies'].append(loop.time() - scheduled)
+        if status != expected_status:
+            stats['errors'] += 1
+
+
+async def run_scenario(session, url, scenario, concurrency, duration,
+                       rate=None, warmup=10):
+    method, path, data, expected_status = scenario
+    for _ in range(warmup):
+        await send(session, method, url + path, data)
+
+    loop = asyncio.get_event_loop()
+    stats = {'latencies': [], 'errors': 0}
+    counter = itertools.count()
+    start = loop.time()
+    deadline = start + duration
+    await asyncio.gather(*[run_client(session, scenario, url, start,
+                                      deadline, rate, counter, stats)
+                           for _ in range(concurrency)])
+    elapsed = loop.time() - start
+
+    latencies = sorted(stats['latencies'])
+    result = {'requests': len(latencies), 'errors': stats['errors'],
+              'rps': len(latencies) / elapsed}
+    for name, q in (('p50', 0.5), ('p95', 0.95), ('p99', 0.99)):
+        value = percentile(latencies, q)
+        result[name + '_ms'] = None if value is None else value * 1000
+    return result
+
+
+async def drive(url, scenarios, concurrency, duration, rate, server_pid):
+    results = {}
+    connector = aiohttp.TCPConnector(limit=concurrency)
+    with aiohttp.ClientSession(connector=connector) as session:
+        for name in scenarios:
+            result = await run_scenario(session, url, SCENARIOS[name],
+                                        concurrency, duration, rate)
+            result['rss_kb'] = get_rss(server_pid)
+            results[name] = result
+    return results
+
+
+def run_benchmark(scenarios=None, concurrency=10, duration=5.0, rate=None,
+                  host='127.0.0.1', port=8765, loop=None, workers=0):
+    """ Start the reference app, benchmark it and return the results """
+    scenarios = scenarios or sorted(SCENARIOS)
+    unknown = set(scenarios) - set(SCENARIOS)
+    if unknown:
+        raise ValueError('Unknown scenarios: {}'.format(
+            ', '.join(sorted(unknown))))
+
+    project_dir = Path(tempfile.mkdtemp(prefix='tygs-bench-'))
+    (project_dir / 'templates').makedirs_p()
+    (project_dir / 'templates' / 'bench.html').write_text(TEMPLATE)
+
+    server = Process(target=run_server,
+                     args=(host, port, project_dir, loop, workers))
+    server.start()
+    try:
+        wait_for_port(host, port)
+        client_loop = asyncio.new_event_loop()
+        try:
+            results = client_loop.run_until_complete(drive(
+                'http://{}:{}'.format(host, port), scenarios, concurrency,
+                duration, rate, server.pid))
+        finally:
+            client_loop.close()
+    finally:
+        server.terminate()
+        server.join(10)
+        shutil.rmtree(project_dir, ignore_errors=True)
+
+    from . import __version__
+    return {'tygs': __version__,
+            'python': platform.python_version(),
+            'loop': loop or 'asyncio',
+            'workers': workers,
+            'concurrency': concurrency,
+            'rate': rate,
+            'duration': duration,
+            'date': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            'scenarios': results}
+
+
+def compare(results, baseline, tolerance=0.1):
+    """
+    Return [(scenario, rps change, p99 change, regression)] for the
+    scenarios in both runs, the changes being ratios: 0.1 is 10% more.
+    """
+    comparison = []
+    for name, result in sorted(results['scenarios'].items()):
+        base = baseline['scenarios'].get(name)
+        if not base or not base['rps'] or not base['p99_ms'] or \
+           result['p99_ms'] is None:
+            continue
+        rps_change = result['rps'] / base['rps'] - 1
+        p99_change = result['p99_ms'] / base['p99_ms'] - 1
+        regression = rps_change < -tolerance or p99_change > tolerance
+        comparison.append((name, rps_change, p99_change, regression))
+    return comparison
+
+
+def format_ms(value):
+    return '-' if value is None else '{:.2f}'.format(value)
+
+
+def print_results(results, out=sys.stdout):
+    out.write('{:<10} {:>9} {:>7} {:>9} {:>9} {:>9} {:>9}\n'.format(
+        'scenario', 'req/s', 'errors', 'p50 ms', 'p95 ms', 'p99 ms',
+        'rss kB'))
+    for name, result in sorted(results['scenarios'].items()):
+        out.write('{:<10} {:>9.0f} {:>7} {:>9} {:>9} {:>9} {:>9}\n'.format(
+            name, result['rps'], result['errors'],
+            format_ms(result['p50_ms']), format_ms(result['p95_ms']),
+            format_ms(result['p99_ms']), result['rss_kb'] or '-'))
+
+
+def print_comparison(comparison, out=sys.stdout):
+    out.write('\n{:<10} {:>9} {:>9}\n'.format('scenario', 'req/s', 'p99'))
+    for name, rps_change, p99_change, regression in comparison:
+        flag = '  REGRESSION' if regression else ''
+        out.write('{:<10} {:>+8.1%} {:>+8.1%}{}\n'.format(
+            name, rps_change, p99_change, flag))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        prog='tygs-bench', description='Benchmark a reference tygs WebApp')
+    parser.add_argument('--scenarios', default=','.join(sorted(SCENARIOS)),
+                        help='comma separated list, among: %(default)s')
+    parser.add_argument('--concurrency', type=int, default=10)
+    parser.add_argument('--rate', type=float, default=None,
+                        help='requests per second, as fast as possible if '
+                             'not set')
+    parser.add_argument('--duration', type=float, default=5.0,
+                        help='seconds per scenario')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--loop', choices=('asyncio', 'uvloop', 'auto'))
+    parser.add_argument('--workers', type=int, default=0)
+    parser.add_argument('--output', help='save the results in this JSON file')
+    parser.add_argument('--baseline', help='JSON file of a previous run')
+    parser.add_argument('--tolerance', type=float, default=0.1,
+                        help='accepted slow down compared to the baseline')
+    args = parser.parse_args(argv)
+
+    results = run_benchmark(args.scenarios.split(','), args.concurrency,
+                            args.duration, args.rate, args.host, args.port,
+                            args.loop, args.workers)
+    print_results(results)
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2, sort_keys=True)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        for option in ('concurrency', 'rate', 'workers', 'loop'):
+            if baseline.get(option) != results[option]:
+                print('Warning: the baseline {} was {!r}, not {!r}'.format(
+                    option, baseline.get(option), results[option]))
+        comparison = compare(results, baseline, args.tolerance)
+        print_comparison(comparison)
+        if any(regression for *_, regression in comparison):
+            return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,231 @@
+import sys
+import time
+import heapq
+import asyncio
+import itertools
+
+from collections import OrderedDict
+
+from .components import Component
+from .utils import inline
+
+
+def sizeof(value):
+    """
+    Estimate how many bytes a cached value uses. It's exact for bytes-like
+    objects, but only shallow for containers: pass the size to set() if you
+    know better.
+    """
+    if isinstance(value, (bytes, bytearray)):
+        return len(value)
+    if isinstance(value, memoryview):
+        return value.nbytes
+    return sys.getsizeof(value)
+
+
+class CacheEntry:
+
+    __slots__ = ('value', 'size', 'expires')
+
+    def __init__(self, value, size, expires):
+        self.value = value
+        self.size = size
+        # time.monotonic() value after which the entry is stale, or None
+        self.expires = expires
+
+
+class CacheComponent(Component):
+    """
+    In memory key/value store, shared by all the code of the app.
+
+    Keys can have a TTL, in seconds. When the values use more than
+    max_memory bytes, the least recently used keys are evicted. Expired
+    keys are removed when they are read, and by a sweep that runs on the
+    loop every sweep_interval seconds while the app is running.
+
+    The API is asynchronous so the store can be moved out of the process
+    later without changing the code using it.
+    """
+
+    def __init__(self, app, max_memory=64 * 1024 * 1024, default_ttl=None,
+                 sweep_interval=60):
+        super().__init__(app)
+        self.max_memory = max_memory
+        self.default_ttl = default_ttl
+        self.sweep_interval = sweep_interval
+        self.entries = OrderedDict()
+        self.memory = 0
+        # (expiration time, counter, key), to find expired keys without a
+        # full scan. The counter avoids comparing keys of different types
+        # when the times are equal. Items can be outdated, they are checked
+        # against the entries.
+        self.expirations = []
+        self.counter = itertools.count()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expired = 0
+        self.sweeper = None
+        # Called with the key and the value of each removed entry
+        self.removal_callbacks = []
+
+    @inline
+    def setup(self):
+        self.app.register('ready', self.start_sweeper)
+        self.app.register('stop', self.stop_sweeper)
+
+    @inline
+    def start_sweeper(self):
+        if self.sweep_interval:
+            loop = asyncio.get_event_loop()
+            self.sweeper = loop.call_later(self.sweep_interval,
+                                           self.periodic_sweep)
+
+    @inline
+    def stop_sweeper(self):
+        if self.sweeper is not None:
+            self.sweeper.cancel()
+            self.sweeper = None
+
+    def periodic_sweep(self):
+        self.sweep()
+        self.start_sweeper()
+
+    def sweep(self):
+        """ Remove all the expired entries. Return how many there were. """
+        now = time.monotonic()
+        expirations = self.expirations
+        removed = 0
+        while expirations and expirations[0][0] <= now:
+            expires, _, key = heapq.heappop(expirations)
+            entry = self.entries.get(key)
+            # The key may have been deleted or set again since
+            if entry is not None and entry.expires == expires:
+                self._remove(key)
+                self.expired += 1
+                removed += 1
+
+        # Drop the outdated items if they pile up
+        if len(expirations) > 2 * len(self.entries) + 64:
+            self.expirations = [(entry.expires, next(self.counter), key)
+                                for key, entry in self.entries.items()
+                                if entry.expires is not None]
+            heapq.heapify(self.expirations)
+
+        return removed
+
+    def on_remove(self, callback):
+        """
+        Call callback(key, value) when an entry is removed: deleted,
+        replaced, expired or evicted. It runs in the middle of the cache
+        operations, so it must be quick and not use the cache.
+        """
+        self.removal_callbacks.append(callback)
+        return callback
+
+    def _remove(self, key):
+        entry = self.entries.pop(key)
+        self.memory -= entry.size
+        for callback in self.removal_callbacks:
+            callback(key, entry.value)
+        return entry
+
+    def _get(self, key, default):
+        try:
+            entry = self.entries[key]
+        except KeyError:
+            self.misses += 1
+            return default
+
+        if entry.expires is not None and entry.expires <= time.monotonic():
+            self._remove(key)
+            self.expired += 1
+            self.misses += 1
+            return default
+
+        self.entries.move_to_end(key)
+        self.hits += 1
+        return entry.value
+
+    async def get(self, key, default=None):
+        return self._get(key, default)
+
+    async def get_many(self, keys):
+        """ Return a dict with the keys found in the cache """
+        missing = object()
+        found = {}
+        for key in keys:
+            value = self._get(key, missing)
+            if value is not missing:
+                found[key] = value
+        return found
+
+    async def set(self, key, value, ttl=None, size=None):
+        """
+        Store the value for ttl seconds (default_ttl if None, forever if
+        default_ttl is None too).
+
+        Return False if the value is bigger than the whole cache.
+        """
+        if size is None:
+            size = sizeof(value)
+
+        if key in self.entries:
+            self._remove(key)
+
+        if size > self.max_memory:
+            return False
+
+        ttl = self.default_ttl if ttl is None else ttl
+        expires = None
+        if ttl is not None:
+            expires = time.monotonic() + ttl
+            heapq.heappush(self.expirations,
+                           (expires, next(self.counter), key))
+
+        self.entries[key] = CacheEntry(value, size, expires)
+        self.memory += size
+
+        while self.memory > self.max_memory:
+            oldest = next(iter(self.entries))
+            self._remove(oldest)
+            self.evictions += 1
+
+        return True
+
+    async def set_many(self, mapping, ttl=None):
+        for key, value in mapping.items():
+            await self.set(key, value, ttl)
+
+    async def delete(self, key):
+        """ Return True if the key was in the cache """
+        if key not in self.entries:
+            return False
+        self._remove(key)
+        return True
+
+    async def clear(self):
+        for callback in self.removal_callbacks:
+            for key, entry in self.entries.items():
+                callback(key, entry.value)
+        self.entries.clear()
+        self.expirations = []
+        self.memory = 0
+
+    def __len__(self):
+        return len(self.entries)
+
+    def __contains__(self, key):
+        entry = self.entries.get(key)
+        if entry is None:
+            return False
+        return entry.expires is None or entry.expires > time.monotonic()
+
+    def stats(self):
+        return {'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'expired': self.expired,
+                'keys': len(self.entries),
+                'memory': self.memory,
+                'max_memory': self.max_memory}
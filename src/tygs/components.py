@@ -1,18 +1,26 @@
-import asyncio
-
+import os
 import sys
+import time
+import bisect
+import asyncio
+import inspect
 import traceback
 
 from functools import partial, wraps
+from operator import itemgetter
 from textwrap import dedent
 
 import jinja2
 
+from path import Path
 from aiohttp.web_reqrep import Request
 from aiohttp.web import RequestHandlerFactory, RequestHandler
 import werkzeug
 
-from .utils import ensure_coroutine, HTTP_VERBS
+from .utils import (ensure_coroutine, is_coroutine_function, inline,
+                    HTTP_VERBS)
+from .events import TopicTrie
+from .http.cache import CachePolicy, ResponseCache
 from .http.server import HttpRequestController, Router
 from .exceptions import HttpResponseControllerError
 
@@ -22,63 +30,407 @@ class Component:
     def __init__(self, app):
         self.app = app
 
+    @inline
     def setup(self):
-        pass
+        """
+        Hook the component to the app events. The components are set up
+        one at a time. Unless it's a coroutine function or marked @inline,
+        setup() runs in the thread pool, where there is no event loop:
+        asyncio.get_event_loop(), ensure_future() and the other functions
+        using the current loop can't be called there.
+        """
 
 
 class SignalDispatcher(Component):
-
-    def __init__(self, app):
+    """
+    Call the handlers registered for an event when it's triggered.
+
+    Handlers can be regular functions or coroutine functions, and receive
+    the arguments passed to trigger(). Handlers are called by decreasing
+    priority, then in the order they were registered.
+
+    Regular functions are called in the thread pool of the app (see
+    ThreadPoolComponent), unless they are registered with inline=True or
+    decorated with @tygs.utils.inline, for the ones cheap enough to be
+    called on the loop.
+
+    trigger() returns a future with the list of the handlers results. How
+    the handlers are called depends on the mode:
+
+    - "concurrent" (default): inline functions are called right away, in
+      trigger(), and a task is only created for the awaitables returned by
+      the coroutine functions, which then run concurrently. Triggering an
+      event with only inline handlers is cheap enough to be done for each
+      request.
+    - "sequential": same, but each handler is awaited before the next one
+      is called, and an error stops the chain.
+    - "background": nothing is called in trigger(). Inline functions are
+      called by the loop on its next iteration, and each coroutine runs in
+      its own task.
+
+    Event names can be namespaced with dots, like "http.request.done", and
+    handlers can be registered for patterns with "*" (one segment) and
+    "**" (zero or more segments) wildcards, like "http.*.done" or "http.**".
+    See TopicTrie. The handlers matching an event name are resolved once and
+    cached until the next registration, so triggering an event is a dict
+    lookup no matter how many patterns are registered.
+    """
+
+    def __init__(self, app, cache_size=1024):
         super().__init__(app)
+        # event name or pattern => handlers, sorted by priority
         self.signals = {}
+        # event => (-priority, registration number) for each handler, to
+        # keep the handlers sorted
+        self.sort_keys = {}
+        self.registered = 0
+        self.topics = TopicTrie()
+        # event name => handlers of all the matching patterns. Cleared when
+        # full, in case event names are generated dynamically.
+        self.cache = {}
+        self.cache_size = cache_size
+        # LoopMonitor, set when it's enabled
+        self.monitor = None
+
+    def register(self, event, handler, priority=0, inline=False):
+        """
+        Call handler when event is triggered. The priority orders the calls,
+        so for the coroutine functions and the regular functions running in
+        the thread pool, it only orders when they start, not when they end.
+        """
+        if not callable(handler):
+            raise TypeError("handler must be a coroutine function or a "
+                            "callable. Did you call it by mistake?")
+        if not inline:
+            handler = self.app.components['threads'].wrap(handler)
+        self.topics.add(event)
+        self.registered += 1
+        key = (-priority, self.registered)
+        keys = self.sort_keys.setdefault(event, [])
+        position = bisect.bisect(keys, key)
+        keys.insert(position, key)
+        self.signals.setdefault(event, []).insert(position, handler)
+        self.cache.clear()
+
+    def get_handlers(self, event):
+        """ Return the handlers for this event name, sorted by priority """
+        try:
+            return self.cache[event]
+        except KeyError:
+            pass
+
+        if not self.topics.wildcards:
+            return self.signals.get(event, ())
+
+        patterns = self.topics.match(event)
+        if len(patterns) == 1:
+            handlers = self.signals[patterns.pop()]
+        else:
+            entries = []
+            for pattern in patterns:
+                entries.extend(zip(self.sort_keys[pattern],
+                                   self.signals[pattern]))
+            entries.sort(key=itemgetter(0))
+            handlers = [handler for key, handler in entries]
+
+        if len(self.cache) >= self.cache_size:
+            self.cache.clear()
+        self.cache[event] = handlers
+        return handlers
+
+    def trigger(self, event, *args, mode="concurrent", **kwargs):
+        handlers = self.get_handlers(event)
+        if self.monitor is not None:
+            handlers = self.monitor.watch_handlers(event, handlers,
+                                                   self.registered)
+        if mode == "concurrent":
+            return self.call_concurrently(handlers, args, kwargs)
+        if mode == "sequential":
+            return self.call_sequentially(handlers, args, kwargs)
+        if mode == "background":
+            return self.call_in_background(handlers, args, kwargs)
+        raise ValueError('Unknown dispatch mode: {!r}'.format(mode))
+
+    def call_concurrently(self, handlers, args, kwargs):
+        results = []
+        futures = {}  # position in results => future
+        error = None
+        for handler in handlers:
+            try:
+                result = handler(*args, **kwargs)
+            except Exception as e:
+                error = error or e
+                result = None
+            if inspect.isawaitable(result):
+                futures[len(results)] = asyncio.ensure_future(result)
+            results.append(result)
+
+        if error is not None:
+            # Let the other handlers finish, but report the error
+            for future in futures.values():
+                drain_exception(future)
+            return self.done_future(None, error)
+
+        if not futures:
+            return self.done_future(results)
+
+        gathering_future = asyncio.gather(*futures.values())
+
+        # Put the results of the coroutines in place of their awaitables
+        def get_results(fut):
+            for i, result in zip(futures, fut.result()):
+                results[i] = result
+            return results
+
+        return self.then(gathering_future, get_results)
+
+    def call_sequentially(self, handlers, args, kwargs):
+        results = []
+        for i, handler in enumerate(handlers):
+            try:
+                result = handler(*args, **kwargs)
+            except Exception as e:
+                return self.done_future(None, e)
+            if inspect.isawaitable(result):
+                # From now on we need a task to await each handler
+                rest = handlers[i + 1:]
+                coro = self.await_sequentially(results, result, rest,
+                                               args, kwargs)
+                return drain_exception(asyncio.ensure_future(coro))
+            results.append(result)
+        return self.done_future(results)
+
+    async def await_sequentially(self, results, awaitable, handlers,
+                                 args, kwargs):
+        results.append(await awaitable)
+        for handler in handlers:
+            result = handler(*args, **kwargs)
+            if inspect.isawaitable(result):
+                result = await result
+            results.append(result)
+        return results
+
+    def call_in_background(self, handlers, args, kwargs):
+        loop = asyncio.get_event_loop()
+        futures = []
+        for handler in handlers:
+            if is_coroutine_function(handler):
+                future = asyncio.ensure_future(handler(*args, **kwargs))
+            else:
+                future = asyncio.Future()
+                loop.call_soon(self.call_later, future, handler, args,
+                               kwargs)
+            futures.append(future)
+        return drain_exception(asyncio.gather(*futures))
+
+    def call_later(self, future, handler, args, kwargs):
+        try:
+            result = handler(*args, **kwargs)
+        except Exception as e:
+            future.set_exception(e)
+            return
+        if inspect.isawaitable(result):
+            self.then(asyncio.ensure_future(result), lambda fut: fut.result(),
+                      future)
+        else:
+            future.set_result(result)
+
+    def done_future(self, result, error=None):
+        future = asyncio.Future()
+        if error is not None:
+            future.set_exception(error)
+            return drain_exception(future)
+        future.set_result(result)
+        return future
+
+    def then(self, future, callback, new_future=None):
+        """
+        Return a future with the result of callback(future) once the
+        future is done, or its exception. A new future is created unless
+        one is passed.
+        """
+        new_future = drain_exception(new_future or asyncio.Future())
+
+        def on_done(fut):
+            if new_future.cancelled():
+                return
+            if fut.cancelled():
+                new_future.cancel()
+            elif fut.exception() is not None:
+                new_future.set_exception(fut.exception())
+            else:
+                new_future.set_result(callback(fut))
+
+        future.add_done_callback(on_done)
+        return new_future
+
+    def on(self, event, **options):
+        def decorator(func):
+            self.register(event, func, **options)
+            return func
+        return decorator
 
-    def register(self, event, handler):
-        handler = ensure_coroutine(handler)
-        self.signals.setdefault(event, []).append(handler)
-
-    def trigger(self, event):
-        handlers = self.signals.get(event, [])
-        futures = (asyncio.ensure_future(handler()) for handler in handlers)
-        gathering_future = asyncio.gather(*futures)
 
-        # Ensure we drain any exception raised during our setup that
-        # we didn't handle
-        def on_main_future_done(fut):
+def drain_exception(future):
+    """
+    Retrieve the exception of the future when it's done, so asyncio doesn't
+    complain that it was never retrieved if nobody awaits the future.
+    """
+    def on_done(fut):
+        if not fut.cancelled():
             fut.exception()
+    future.add_done_callback(on_done)
+    return future
 
-        gathering_future.add_done_callback(on_main_future_done)
 
-        return gathering_future
+class TemplateBytecodeCache(jinja2.FileSystemBytecodeCache):
+    """ Bytecode cache safe to share between worker processes """
 
-    def on(self, event):
-        def decorator(func):
-            self.register(event, func)
-            return func
-        return decorator
+    def __init__(self, renderer, directory):
+        super().__init__(str(directory))
+        self.renderer = renderer
+
+    def load_bytecode(self, bucket):
+        super().load_bytecode(bucket)
+        if bucket.code is not None:
+            self.renderer.stats['cache_hits'] += 1
+
+    def dump_bytecode(self, bucket):
+        # Write in a temporary file and rename it, so that another process
+        # never reads a half written cache file.
+        filename = self._get_cache_filename(bucket)
+        tmp_filename = '{}.{}.tmp'.format(filename, os.getpid())
+        with open(tmp_filename, 'wb') as f:
+            bucket.write_bytecode(f)
+        os.replace(tmp_filename, filename)
+
+
+class TemplateLoader(jinja2.FileSystemLoader):
+    """ Report to the renderer how long it took to load each template """
+
+    def __init__(self, renderer, searchpath):
+        super().__init__(searchpath)
+        self.renderer = renderer
+
+    def load(self, environment, name, globals=None):
+        stats = self.renderer.stats
+        cache_hits = stats['cache_hits']
+        start = time.perf_counter()
+
+        template = super().load(environment, name, globals)
+
+        duration = time.perf_counter() - start
+        cache_hit = stats['cache_hits'] != cache_hits
+        self.renderer.on_template_load(name, duration, cache_hit)
+
+        return template
 
 
 # TODO: make that a generic template renderer componnent
 class Jinja2Renderer(Component):
+    """
+    Render templates from the "templates" dir of the project.
+
+    Options, that can be changed until the "init" event:
+
+    - bytecode_cache: True to store the compiled templates in
+      "__pycache__/jinja2" in the project dir, or a path to another dir;
+    - precompile: compile all the templates during the "init" event
+      instead of on first use;
+    - auto_reload: check if the template files changed on each use. Set it
+      to False in production.
+
+    Each time a template is loaded, the hooks are called with the template
+    name, the time it took to load it, and whether it came from the
+    bytecode cache.
+    """
+
+    def __init__(self, app, bytecode_cache=False, precompile=False,
+                 auto_reload=True):
+        super().__init__(app)
+        self.bytecode_cache = bytecode_cache
+        self.precompile = precompile
+        self.auto_reload = auto_reload
+        self.hooks = []
+        self.stats = {'loaded': 0, 'load_time': 0.0, 'cache_hits': 0}
+
+    def get_bytecode_cache(self):
+        if not self.bytecode_cache:
+            return None
+
+        if self.bytecode_cache is True:
+            cache_dir = self.app.project_dir / "__pycache__" / "jinja2"
+        else:
+            cache_dir = Path(self.bytecode_cache)
+        cache_dir.makedirs_p()
+
+        return TemplateBytecodeCache(self, cache_dir)
 
     async def lazy_init(self):
         # TODO: make that configurable
         template_dir = self.app.project_dir / "templates"
-        file_loader = jinja2.FileSystemLoader(template_dir)
-        self.env = jinja2.Environment(loader=file_loader,
-                                      autoescape=True)
-
+        # Not a Path: marshal, used by the bytecode cache, would fail on the
+        # template file names
+        file_loader = TemplateLoader(self, str(template_dir))
+        self.env = jinja2.Environment(
+            loader=file_loader,
+            autoescape=True,
+            auto_reload=self.auto_reload,
+            bytecode_cache=self.get_bytecode_cache()
+        )
+
+        if self.precompile:
+            self.compile_templates()
+
+    @inline
     def setup(self):
         self.app.register('init', self.lazy_init)
 
+    def compile_templates(self):
+        """ Load all the templates in the cache so the first use is fast """
+        for name in self.env.list_templates():
+            self.env.get_template(name)
+
+    def on_template_load(self, name, duration, cache_hit):
+        self.stats['loaded'] += 1
+        self.stats['load_time'] += duration
+        for hook in self.hooks:
+            hook(name, duration, cache_hit)
+
     def render_to_string(self, template, context):
         # TODO : handle template not found
         template = self.env.get_template(template)
         return template.render(context)
 
-    def render_to_response_dict(self, response):
+    def render_to_chunks(self, template, context, charset='utf-8',
+                         chunk_size=8192):
+        """
+        Return a generator of encoded chunks of the rendered template.
 
+        Jinja2 yields very small strings, so they are grouped in chunks of
+        about chunk_size characters.
+        """
+        # Load the template now, so we get errors before sending headers
+        template = self.env.get_template(template)
+        return self._group_chunks(template.generate(context), charset,
+                                  chunk_size)
+
+    def _group_chunks(self, parts, charset, chunk_size):
+        buffer = []
+        size = 0
+        for part in parts:
+            buffer.append(part)
+            size += len(part)
+            if size >= chunk_size:
+                yield ''.join(buffer).encode(charset)
+                buffer = []
+                size = 0
+        if buffer:
+            yield ''.join(buffer).encode(charset)
+
+    def _get_template_name(self, response):
         try:
-            template_name = response.context['template_name']
+            return response.context['template_name']
 
         except KeyError:
             raise HttpResponseControllerError(dedent("""
@@ -88,6 +440,10 @@ class Jinja2Renderer(Component):
                     overrides this key after it.
                   """.format(response)))
 
+    def render_to_response_dict(self, response):
+
+        template_name = self._get_template_name(response)
+
         body = self.render_to_string(template_name, response._renderer_data)
         body = body.encode(response.charset)
 
@@ -100,12 +456,39 @@ class Jinja2Renderer(Component):
                 'body': body
                 }
 
+    def stream_to_response_dict(self, response):
+
+        template_name = self._get_template_name(response)
+
+        chunks = self.render_to_chunks(template_name,
+                                       response._renderer_data,
+                                       response.charset)
+
+        return {'status': response.status_code,
+                'reason': response.reason,
+                'content_type': response.content_type,
+                'charset': response.charset,
+                # TODO: update default heaers
+                'headers': response.headers,
+                'stream': chunks
+                }
+
 
 class HttpComponent(Component):
 
-    def __init__(self, app):
+    def __init__(self, app, route_cache_size=0, max_body_size=None):
         super().__init__(app)
-        self.router = Router()
+        self.router = Router(cache_size=route_cache_size)
+        # Default max size of the request bodies, in bytes
+        self.max_body_size = max_body_size
+        # Rendered responses of the routes using the "cache" option
+        self.response_cache = ResponseCache(app)
+        # (name, middleware), the first one is called first
+        self.middlewares = []
+        # endpoint => (handler, cache policy, middlewares to skip), to build
+        # the chain of each route again if the middlewares change
+        self.routes = {}
+        self.compiled = False
 
         # Create shortcut methods for HTTP verbs
         for meth in HTTP_VERBS:
@@ -113,11 +496,151 @@ class HttpComponent(Component):
 
         # TODO: figure out namespace cascading from the app tree architecture
 
+    @inline
+    def setup(self):
+        # Before the server starts
+        self.app.register('ready', self.compile, priority=100)
+        self.app.components['cache'].on_remove(self.response_cache.removed)
+
+    def add_middleware(self, middleware, name=None):
+        """
+        Add a middleware to all the routes. It's called with the request,
+        the response, and the handler to call next:
+
+            async def timing(req, res, handler):
+                start = time.time()
+                await handler(req, res)
+                res.headers['X-Time'] = str(time.time() - start)
+
+        Middlewares are called in the order they are added, the first one
+        being the outermost. Routes can skip them by name, which defaults
+        to the function name.
+        """
+        name = name or middleware.__name__
+        self.middlewares.append((name, ensure_coroutine(middleware)))
+        if self.compiled:
+            self.compile()
+        return middleware
+
+    def middleware(self, func=None, *, name=None):
+        """ Decorator version of add_middleware() """
+        if func is None:
+            return partial(self.add_middleware, name=name)
+        return self.add_middleware(func)
+
+    def build_chain(self, handler, cache=None, skip_middlewares=None,
+                    max_body_size=None):
+        """
+        Compose the middlewares and the handler of a route in a single
+        callable, so nothing has to walk the list of middlewares for each
+        request.
+        """
+        if cache is not None:
+            handler = self.cache_handler(handler, cache)
+
+        if skip_middlewares is not True:
+            skipped = skip_middlewares or ()
+            for name, middleware in reversed(self.middlewares):
+                if name not in skipped:
+                    handler = partial(middleware, handler=handler)
+
+        if max_body_size is not None:
+            # Outermost, so the middlewares reading the body use it too
+            handler = partial(self.limit_body, handler=handler,
+                              max_body_size=max_body_size)
+        return handler
+
+    @staticmethod
+    def limit_body(req, res, handler, max_body_size):
+        req.max_body_size = max_body_size
+        return handler(req, res)
+
+    @inline
+    def compile(self):
+        for endpoint, route in self.routes.items():
+            self.router.set_handler(endpoint, self.build_chain(*route))
+        self.compiled = True
+
+    def cache_handler(self, handler, policy):
+        """
+        Wrap the handler to send the response from the cache if we have
+        it, and store it otherwise. See CachePolicy.
+        """
+        response_cache = self.response_cache
+
+        async def cached_handler(req, res):
+            if not policy.applies(req):
+                return await handler(req, res)
+
+            key = policy.get_key(req)
+            if id(req) not in response_cache.refreshing:
+                cached = await response_cache.get(key)
+                if cached is not None:
+                    if cached.is_stale():
+                        self.refresh_cache(req, key)
+                    return res.cached(cached.rendered)
+
+            await handler(req, res)
+            rendered = res.render_response()
+            await response_cache.store(key, policy, rendered)
+            # Don't render it twice
+            return res.cached(rendered)
+
+        return cached_handler
+
+    def refresh_cache(self, req, key):
+        """
+        Render a fresh response in the background with a new request
+        controller, the current one being used to send the stale response.
+        """
+        response_cache = self.response_cache
+        chain = req.handler
+        fresh_req = HttpRequestController(self.app, req._aiohttp_request)
+        fresh_req.url_args = dict(req.url_args)
+        fresh_req.max_body_size = req.max_body_size
+        fresh_req.handler = chain
+
+        async def render():
+            response_cache.refreshing.add(id(fresh_req))
+            try:
+                await chain(fresh_req, fresh_req.response)
+            finally:
+                response_cache.refreshing.discard(id(fresh_req))
+
+        response_cache.revalidate(key, render)
+
+    def wrap_handler(self, func, inline=False):
+        if inline:
+            return ensure_coroutine(func)
+        return ensure_coroutine(self.app.components['threads'].wrap(func))
+
     # TODO: use explicit arguments
-    def route(self, url, *args, methods=None, lazy_body=False, **kwargs):
+    def route(self, url, *args, methods=None, lazy_body=False,
+              max_body_size=None, cache=None, skip_middlewares=None,
+              inline=False, endpoint=None, **kwargs):
+        """
+        Register func to handle the requests for this URL.
+
+        cache can be a number of seconds or a CachePolicy: the rendered
+        GET and HEAD responses are then stored in the cache component and
+        sent without calling func until they expire.
+
+        skip_middlewares can be a list of middleware names this route
+        doesn't use, or True to use none of them.
+
+        If func is a regular function, it's called in the thread pool,
+        unless inline is True.
+
+        endpoint is the name of the route, "<app ns>.<func name>" by
+        default. A route registered with the same endpoint replaces this
+        one.
+        """
+        if cache is not None and not isinstance(cache, CachePolicy):
+            cache = CachePolicy(cache)
+
         def decorator(func):
 
-            func = ensure_coroutine(func)
+            func = self.wrap_handler(func, inline)
 
             @wraps(func)
             async def handler_wrapper(req, res):
@@ -125,23 +648,41 @@ class HttpComponent(Component):
                     await req.load_body()
                 return await func(req, res)
 
-            # TODO: allow passing explicit endpoint
-            endpoint = "{}.{}".format(self.app.ns, func.__name__)
-            self.router.add_route(url, endpoint, handler_wrapper,
+            name = endpoint or "{}.{}".format(self.app.ns, func.__name__)
+            route = (handler_wrapper, cache, skip_middlewares, max_body_size)
+            self.routes[name] = route
+            self.router.add_route(url, name, self.build_chain(*route),
                                   methods=methods)
             return handler_wrapper
         return decorator
 
-    def on_error(self, code, lazy_body=False):
+    async def purge(self, path):
+        """
+        Remove the cached responses for this URL path. Return how many
+        there were.
+        """
+        return await self.response_cache.purge(path)
+
+    async def purge_all(self):
+        return await self.response_cache.purge_all()
+
+    def on_error(self, code, lazy_body=False, inline=False):
         def decorator(func):
 
-            func = ensure_coroutine(func)
+            func = self.wrap_handler(func, inline)
 
             @wraps(func)
             async def handler_wrapper(req, res):
 
+                if req.max_body_size is None:
+                    req.max_body_size = self.max_body_size
+
                 if not lazy_body and req._aiohttp_request.has_body:
-                    await req.load_body()
+                    try:
+                        await req.load_body()
+                    # E.G: we are handling a 413. The body stays unloaded.
+                    except werkzeug.exceptions.HTTPException:
+                        pass
                 return await func(req, res)
 
             # TODO: allow passing explicit endpoint
@@ -155,6 +696,7 @@ class AioHttpRequestHandlerAdapter(RequestHandler):
     def __init__(self, *args, tygs_app, **kwargs):
         super().__init__(*args, **kwargs)
         self.tygs_app = tygs_app
+        self.rendered_at = 0
 
     async def _tygs_request_from_message(self, message, payload):
         app = self._app
@@ -166,6 +708,10 @@ class AioHttpRequestHandlerAdapter(RequestHandler):
 
         # TODO: solve this issue with passing tygs app everywhere
         tygs_request = HttpRequestController(self.tygs_app, aiothttp_request)
+        # Set before the middlewares run, the route can override it, see
+        # HttpComponent.build_chain()
+        http = self.tygs_app.components['http']
+        tygs_request.max_body_size = http.max_body_size
 
         # for __repr__
         self._meth = aiothttp_request.method
@@ -178,7 +724,8 @@ class AioHttpRequestHandlerAdapter(RequestHandler):
         tygs_request = await self._tygs_request_from_message(message, payload)
         try:
             handler, arguments = await self._router.get_handler(tygs_request)
-            tygs_request.url_args.update(arguments)
+            # A new dict for each request, no need to copy it
+            tygs_request.url_args = arguments
         except werkzeug.exceptions.HTTPException as e:
             handler = await self._router.get_error_handler(e.code)
             resp = tygs_request.response
@@ -194,6 +741,13 @@ class AioHttpRequestHandlerAdapter(RequestHandler):
 
         try:
             await handler(req, req.response)
+        except werkzeug.exceptions.HTTPException as e:
+            handler = await self._router.get_error_handler(e.code)
+            resp = req.response
+            resp.status_code = e.code
+            resp.reason = e.name
+            resp.context['error_details'] = e.description
+            await handler(req, resp)
         except Exception:
             # TODO: provide a debug web page and disable this
             # on prod
@@ -211,6 +765,16 @@ class AioHttpRequestHandlerAdapter(RequestHandler):
     async def handle_request(self, message, payload):
         if self.access_log:
             now = self._loop.time()
+        metrics = self.tygs_app.components.get('metrics')
+        monitor = self.tygs_app.components.get('monitor')
+        if monitor is not None and not monitor.enabled:
+            monitor = None
+        profiler = self.tygs_app.components.get('profiler')
+        if profiler is not None and not profiler.enabled:
+            profiler = None
+        access_log = self.tygs_app.components.get('access_log')
+        timer = time.perf_counter
+        started = timer()
 
     # try:
 
@@ -218,6 +782,7 @@ class AioHttpRequestHandlerAdapter(RequestHandler):
         tygs_request, handler = await self._get_handler_and_tygs_req(message,
                                                                      payload)
         ############
+        routed = timer()
 
         ####################
         # TODO: find out what do to with 100-continue message
@@ -226,30 +791,63 @@ class AioHttpRequestHandlerAdapter(RequestHandler):
         #     co = match_info.route.handle_expect_header(request)
         #     resp = await co
         # if resp is None:
-        #    # TODO: add middlewares
         ############
 
         ###############
-        await self._call_request_handler(tygs_request, handler)
+        # The handler already includes the route middlewares, see
+        # HttpComponent.build_chain()
+        handling = self._call_request_handler(tygs_request, handler)
+        if monitor is not None or profiler is not None:
+            endpoint = self._router.endpoints.get(handler, 'none')
+            if profiler is not None and \
+               not profiler.should_profile(endpoint):
+                profiler = None
+            handling = self._watch(handling, endpoint, monitor, profiler)
+        await handling
 
         ###############
+        handled = timer()
 
     # except HTTPException as exc:
     #     resp = exc
 
         response = tygs_request.response
-        resp_msg = await self._write_response_to_client(tygs_request, response)
+        writing = self._write_response_to_client(tygs_request, response)
+        if monitor is not None or profiler is not None:
+            writing = self._watch(writing, endpoint, monitor, profiler)
+        resp_msg = await writing
+
+        if metrics is not None and metrics.enabled:
+            written = timer()
+            endpoint = self._router.endpoints.get(handler, 'none')
+            metrics.record(endpoint, response.status_code,
+                           routed - started, handled - routed,
+                           self.rendered_at - handled,
+                           written - self.rendered_at)
 
         # for repr
         self._meth = 'none'
         self._path = 'none'
 
         # log access
-        if self.access_log:
+        if access_log is not None and access_log.enabled:
+            access_log.record(self.transport, message, response.status_code,
+                              resp_msg.body_length, timer() - started)
+        elif self.access_log:
             self.log_access(message, None, resp_msg, self._loop.time() - now)
 
+    def _watch(self, awaitable, endpoint, monitor, profiler):
+        """ Let the LoopMonitor and the RequestProfiler time the steps """
+        if profiler is not None:
+            awaitable = profiler.watch(awaitable, endpoint)
+        if monitor is not None:
+            awaitable = monitor.watch(awaitable, endpoint)
+        return awaitable
+
     async def _write_response_to_client(self, request, response):
         aiohttp_reponse = response._build_aiohttp_response()
+        # For the metrics
+        self.rendered_at = time.perf_counter()
         resp_msg = await aiohttp_reponse.prepare(request._aiohttp_request)
         await aiohttp_reponse.write_eof()
         self.keep_alive(resp_msg.keep_alive())
@@ -0,0 +1,80 @@
+class TopicNode:
+    """ A level of the topic trie, one per segment of the event names """
+
+    def __init__(self):
+        self.children = {}
+        # Child nodes for the "*" and "**" segments
+        self.star = None
+        self.double_star = None
+        # The patterns ending at this node
+        self.patterns = []
+
+
+class TopicTrie:
+    """
+    Index event patterns so we can find all the patterns matching an event
+    name in one walk.
+
+    Event names are made of segments separated with dots, such as
+    "http.request.done". In a pattern, a "*" segment matches exactly one
+    segment and a "**" segment matches zero or more segments: "http.*.done"
+    and "http.**" both match "http.request.done", "**" matches everything.
+    """
+
+    def __init__(self):
+        self.root = TopicNode()
+        # Number of patterns with at least one wildcard
+        self.wildcards = 0
+
+    @staticmethod
+    def split(pattern):
+        segments = pattern.split('.')
+        for segment in segments:
+            if not segment:
+                raise ValueError(
+                    'Empty segment in the event name {!r}'.format(pattern))
+            if '*' in segment and segment not in ('*', '**'):
+                raise ValueError(
+                    'A wildcard must be a whole segment ("*" or "**") in '
+                    'the event name {!r}'.format(pattern))
+        return segments
+
+    def add(self, pattern):
+        node = self.root
+        segments = self.split(pattern)
+        for segment in segments:
+            if segment == '*':
+                node.star = node.star or TopicNode()
+                node = node.star
+            elif segment == '**':
+                node.double_star = node.double_star or TopicNode()
+                node = node.double_star
+            else:
+                node = node.children.setdefault(segment, TopicNode())
+
+        if pattern not in node.patterns:
+            node.patterns.append(pattern)
+            if '*' in pattern:
+                self.wildcards += 1
+
+    def match(self, event):
+        """ Return the set of the patterns matching this event name """
+        found = set()
+        self._match(self.root, event.split('.'), 0, found)
+        return found
+
+    def _match(self, node, segments, i, found):
+        if node.double_star is not None:
+            # Try to consume 0 to all the remaining segments
+            for j in range(i, len(segments) + 1):
+                self._match(node.double_star, segments, j, found)
+
+        if i == len(segments):
+            found.update(node.patterns)
+            return
+
+        child = node.children.get(segments[i])
+        if child is not None:
+            self._match(child, segments, i + 1, found)
+        if node.star is not None:
+            self._match(node.star, segments, i + 1, found)
@@ -0,0 +1,149 @@
+import time
+import asyncio
+import logging
+
+
+log = logging.getLogger(__name__)
+
+
+class CachePolicy:
+    """
+    How to cache the responses of a route.
+
+    - ttl: how long a response is fresh, in seconds;
+    - query: the names of the query string parameters that change the
+      response, None for all of them;
+    - vary: the request headers that change the response, like the Vary
+      response header;
+    - stale: how long, in seconds, a response can still be sent after it
+      expired while a fresh one is rendered in the background.
+    """
+
+    def __init__(self, ttl, query=None, vary=(), stale=0):
+        self.ttl = ttl
+        self.query = None if query is None else frozenset(query)
+        self.vary = tuple(vary)
+        self.stale = stale
+
+    def applies(self, request):
+        return request.method in ('GET', 'HEAD')
+
+    def get_key(self, request):
+        query = request.url_query
+        if self.query is None:
+            query_key = tuple(sorted(query.items()))
+        else:
+            query_key = tuple(sorted((name, value)
+                                     for name, value in query.items()
+                                     if name in self.query))
+        vary_key = tuple(request.headers.get(name) for name in self.vary)
+        return ('http', request.server_name, request.url_path, query_key,
+                vary_key)
+
+
+def is_cacheable(rendered):
+    """ Only cache complete 200 responses that don't set cookies """
+    if rendered.get('status') != 200 or 'body' not in rendered:
+        return False
+    headers = rendered.get('headers') or {}
+    return not any(name.lower() == 'set-cookie' for name in headers)
+
+
+class CachedResponse:
+
+    __slots__ = ('rendered', 'fresh_until')
+
+    def __init__(self, rendered, fresh_until):
+        # The dict returned by the renderer, status, headers and body
+        self.rendered = rendered
+        self.fresh_until = fresh_until
+
+    def is_stale(self):
+        return time.monotonic() > self.fresh_until
+
+
+class ResponseCache:
+    """
+    Store the rendered responses in the app cache component, and keep
+    track of the keys of each path so they can be purged. The keys are
+    forgotten when the cache component removes them, see removed().
+    """
+
+    def __init__(self, app):
+        self.app = app
+        self.keys_by_path = {}
+        # Keys of the responses being rendered again in the background
+        self.revalidating = set()
+        # id() of the requests used for that, which must skip the cache
+        self.refreshing = set()
+
+    @property
+    def storage(self):
+        return self.app.components['cache']
+
+    async def get(self, key):
+        cached = await self.storage.get(key)
+        if cached is None:
+            self._forget(key)
+        return cached
+
+    async def store(self, key, policy, rendered):
+        if not is_cacheable(rendered):
+            return False
+
+        # Copy the headers, the response can still be changed by the
+        # middlewares after this
+        rendered = dict(rendered, headers=dict(rendered.get('headers') or {}))
+        cached = CachedResponse(rendered, time.monotonic() + policy.ttl)
+        size = len(rendered['body']) + 512  # Rough size of the rest
+        stored = await self.storage.set(key, cached,
+                                        ttl=policy.ttl + policy.stale,
+                                        size=size)
+        if stored:
+            path = key[2]
+            self.keys_by_path.setdefault(path, set()).add(key)
+        return stored
+
+    def revalidate(self, key, render):
+        """
+        Run the render coroutine function in the background, unless it's
+        already running for this key.
+        """
+        if key in self.revalidating:
+            return None
+        self.revalidating.add(key)
+
+        async def run():
+            try:
+                await render()
+            except Exception:
+                log.exception('Error while rendering %r again', key)
+            finally:
+                self.revalidating.discard(key)
+
+        return asyncio.ensure_future(run())
+
+    async def purge(self, path):
+        """ Remove all the cached responses for this URL path """
+        keys = self.keys_by_path.pop(path, ())
+        for key in keys:
+            await self.storage.delete(key)
+        return len(keys)
+
+    async def purge_all(self):
+        count = 0
+        for path in list(self.keys_by_path):
+            count += await self.purge(path)
+        return count
+
+    def removed(self, key, value):
+        """ Removal callback of the cache component """
+        if isinstance(value, CachedResponse):
+            self._forget(key)
+
+    def _forget(self, key):
+        keys = self.keys_by_path.get(key[2])
+        if keys is not None:
+            keys.discard(key)
+            if not keys:
+                del self.keys_by_path[key[2]]
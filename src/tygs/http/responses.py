@@ -0,0 +1,292 @@
+import os
+import asyncio
+import logging
+import mimetypes
+
+from aiohttp import hdrs
+from aiohttp.web_reqrep import StreamResponse
+from aiohttp.protocol import HttpVersion11
+
+
+log = logging.getLogger(__name__)
+
+
+class ChunkedResponse(StreamResponse):
+    """
+    Send the body chunk by chunk as it's produced by an iterable or an
+    async iterable of bytes, using chunked transfer encoding.
+
+    Like aiohttp's Response, the body is written in write_eof(). We wait
+    for the transport to be drained after each chunk, so a slow client
+    slows down the producer instead of filling up the memory.
+    """
+
+    def __init__(self, *, stream, content_type=None, charset=None,
+                 **kwargs):
+        super().__init__(**kwargs)
+        self.stream = stream
+        if content_type:
+            self.content_type = content_type
+        if charset:
+            self.charset = charset
+
+    def _start(self, request):
+        if request.version == HttpVersion11:
+            self.enable_chunked_encoding()
+        else:
+            # No chunked encoding in HTTP/1.0: the end of the body is the
+            # end of the connection.
+            self.force_close()
+        return super()._start(request)
+
+    def should_send_body(self):
+        return (self._req.method != 'HEAD' and
+                self.status not in (204, 304))
+
+    async def write_stream(self):
+        if hasattr(self.stream, '__aiter__'):
+            async for chunk in self.stream:
+                self.write(chunk)
+                await self.drain()
+        else:
+            for chunk in self.stream:
+                self.write(chunk)
+                await self.drain()
+
+    async def write_eof(self):
+        if self.should_send_body():
+            try:
+                await self.write_stream()
+            except Exception:
+                # The headers are already sent, so the best we can do is
+                # closing the connection without sending the last chunk
+                # to let the client know the body is incomplete.
+                log.exception('Error while streaming %r', self)
+                self._req.transport.close()
+                return
+        await super().write_eof()
+
+
+class BytesResponse(StreamResponse):
+    """
+    Send a bytes-like object, such as a memoryview on a bigger buffer,
+    as is. Unlike aiohttp's Response, which only accepts bytes, it doesn't
+    copy the data.
+    """
+
+    def __init__(self, *, data, content_type=None, charset=None, **kwargs):
+        super().__init__(**kwargs)
+        self.data = memoryview(data).cast('B')
+        self.content_length = self.data.nbytes
+        if content_type:
+            self.content_type = content_type
+        if charset:
+            self.charset = charset
+
+    async def write_eof(self):
+        if self._req.method != 'HEAD':
+            # aiohttp's writer only takes bytes, but the headers have been
+            # written already, and transports accept memoryviews.
+            self._req.transport.write(self.data)
+            # The writer didn't see the body, count it for the access log
+            self._resp_impl.output_length += self.data.nbytes
+        await super().write_eof()
+
+
+def parse_range(header, size):
+    """
+    Parse a "Range: bytes=..." header for a resource of the given size.
+
+    Return (start, end) with end included, None if the header should be
+    ignored (invalid or several ranges) and raise ValueError if the range
+    can't be satisfied.
+    """
+    unit, _, ranges = header.partition('=')
+    if unit.strip() != 'bytes' or ',' in ranges:
+        return None
+
+    start, sep, end = ranges.strip().partition('-')
+    if not sep or not (start.isdigit() or end.isdigit()):
+        return None
+    if (start and not start.isdigit()) or (end and not end.isdigit()):
+        return None
+
+    if not start:
+        # Suffix range: the last N bytes
+        length = int(end)
+        if not length or not size:
+            raise ValueError('Empty suffix range')
+        return max(size - length, 0), size - 1
+
+    start = int(start)
+    end = int(end) if end else size - 1
+    if start >= size:
+        raise ValueError('Range starts after the end of the file')
+    if start > end:
+        return None
+    return start, min(end, size - 1)
+
+
+class FileResponse(StreamResponse):
+    """
+    Send a file with the sendfile() system call, so its content never goes
+    through Python.
+
+    Support ETag/If-None-Match, If-Modified-Since and single byte ranges.
+    The status is only changed to 206, 304 or 416 if it's still a 200 when
+    the response is started.
+    """
+
+    def __init__(self, *, file, stat, content_type=None, charset=None,
+                 chunk_size=256 * 1024, **kwargs):
+        super().__init__(**kwargs)
+        self.path = file
+        self.stat = stat
+        # Only used if we can't use sendfile(), e.g: with SSL
+        self.chunk_size = chunk_size
+
+        if not content_type:
+            content_type, encoding = mimetypes.guess_type(str(file))
+            if encoding:
+                self.headers[hdrs.CONTENT_ENCODING] = encoding
+        self.content_type = content_type or 'application/octet-stream'
+        if charset:
+            self.charset = charset
+
+        self.etag = '"{:x}-{:x}"'.format(stat.st_mtime_ns, stat.st_size)
+        self.headers[hdrs.ETAG] = self.etag
+        self.headers[hdrs.ACCEPT_RANGES] = 'bytes'
+        self.last_modified = stat.st_mtime
+
+        self.offset = 0
+        self.count = stat.st_size
+
+    def _start(self, request):
+        if self.status == 200:
+            self.evaluate_request_headers(request)
+        self.content_length = self.count
+        return super()._start(request)
+
+    def is_not_modified(self, request):
+        if_none_match = request.headers.get(hdrs.IF_NONE_MATCH)
+        if if_none_match is not None:
+            etags = {etag.strip() for etag in if_none_match.split(',')}
+            return '*' in etags or self.etag in etags
+
+        modified_since = request.if_modified_since
+        return (modified_since is not None and
+                int(self.stat.st_mtime) <= modified_since.timestamp())
+
+    def evaluate_request_headers(self, request):
+        size = self.stat.st_size
+
+        if self.is_not_modified(request):
+            self.set_status(304)
+            self.count = 0
+            return
+
+        range_header = request.headers.get(hdrs.RANGE)
+        if range_header is None:
+            return
+
+        # Send the whole file if it changed since the client got the
+        # first part
+        if_range = request.headers.get(hdrs.IF_RANGE)
+        if if_range is not None and if_range.strip() != self.etag:
+            return
+
+        try:
+            byte_range = parse_range(range_header, size)
+        except ValueError:
+            self.set_status(416)
+            self.headers[hdrs.CONTENT_RANGE] = 'bytes */{}'.format(size)
+            self.count = 0
+            return
+
+        if byte_range is not None:
+            start, end = byte_range
+            self.set_status(206)
+            self.headers[hdrs.CONTENT_RANGE] = 'bytes {}-{}/{}'.format(
+                start, end, size)
+            self.offset = start
+            self.count = end - start + 1
+
+    async def write_eof(self):
+        if self._req.method != 'HEAD' and self.count:
+            with open(self.path, 'rb') as f:
+                await self.sendfile(f)
+        await super().write_eof()
+
+    async def sendfile(self, fobj):
+        transport = self._req.transport
+        if transport.get_extra_info('sslcontext') or \
+           not hasattr(os, 'sendfile'):
+            await self.sendfile_fallback(fobj)
+            return
+
+        # The headers, and maybe the end of the previous response, must be
+        # sent before we write on the socket directly
+        await self.flush(transport)
+
+        loop = self._req.app.loop
+        if hasattr(loop, 'sendfile'):  # Python 3.7+
+            sent = await loop.sendfile(transport, fobj, self.offset,
+                                       self.count)
+        else:
+            # Don't let the transport close the socket under our feet
+            out_socket = transport.get_extra_info('socket').dup()
+            try:
+                sent = await self.os_sendfile(loop, out_socket.fileno(),
+                                              fobj.fileno())
+            finally:
+                out_socket.close()
+
+        # The writer didn't see the body, count it for the access log
+        self._resp_impl.output_length += sent
+
+    async def flush(self, transport):
+        """
+        Wait until the transport buffer is empty. drain() only waits while
+        the buffer is above the high-water mark, so we lower it to 0 in the
+        meantime.
+        """
+        if not transport.get_write_buffer_size():
+            return
+        low, high = transport.get_write_buffer_limits()
+        transport.set_write_buffer_limits(high=0)
+        try:
+            await self.drain()
+        finally:
+            transport.set_write_buffer_limits(high=high, low=low)
+
+    async def os_sendfile(self, loop, out_fd, in_fd):
+        """ Return how many bytes were sent """
+        offset, count = self.offset, self.count
+        while count:
+            try:
+                sent = os.sendfile(out_fd, in_fd, offset, count)
+            except (BlockingIOError, InterruptedError):
+                # The socket buffer is full: wait until it's writable
+                writable = asyncio.Future(loop=loop)
+                loop.add_writer(out_fd, writable.set_result, None)
+                try:
+                    await writable
+                finally:
+                    loop.remove_writer(out_fd)
+                continue
+            if not sent:  # The file has been truncated
+                break
+            offset += sent
+            count -= sent
+        return self.count - count
+
+    async def sendfile_fallback(self, fobj):
+        fobj.seek(self.offset)
+        count = self.count
+        while count:
+            chunk = fobj.read(min(self.chunk_size, count))
+            if not chunk:
+                break
+            self.write(chunk)
+            await self.drain()
+            count -= len(chunk)
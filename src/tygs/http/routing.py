@@ -0,0 +1,334 @@
+import re
+
+from collections import OrderedDict
+
+from werkzeug.exceptions import NotFound, MethodNotAllowed
+from werkzeug.routing import (ValidationError, UnicodeConverter,
+                              NumberConverter, UUIDConverter, AnyConverter)
+
+
+# Converters we know can't match a "/", and therefor can be matched segment
+# by segment. Other converters (path, custom ones...) are left to werkzeug.
+COMPILABLE_CONVERTERS = (UnicodeConverter, NumberConverter, UUIDConverter,
+                         AnyConverter)
+
+
+class RouteEntry:
+    """ One way a werkzeug rule can match a path """
+
+    def __init__(self, index, rule, variables=(), redirect=False):
+        # Position of the rule in the sorted werkzeug map. The lowest wins,
+        # like when werkzeug loops on its rules.
+        self.index = index
+        self.endpoint = rule.endpoint
+        self.methods = rule.methods
+        # (name, converter) for each dynamic segment, in order
+        self.variables = variables
+        # The path lacks the trailing slash of a strict rule: werkzeug
+        # would raise RequestRedirect, so we let it do it.
+        self.redirect = redirect
+
+    def convert(self, values):
+        arguments = {}
+        for (name, converter), value in zip(self.variables, values):
+            arguments[name] = converter.to_python(value)
+        return arguments
+
+
+class RouteNode:
+    """ A level of the prefix tree, one per URL segment """
+
+    def __init__(self):
+        self.static = {}
+        # (regex, regex.fullmatch, child node), one per converter regex
+        self.dynamic = []
+        self.entries = []
+
+    def child(self, segment):
+        if isinstance(segment, str):
+            return self.static.setdefault(segment, RouteNode())
+
+        regex = segment[1].regex
+        for known_regex, _, child in self.dynamic:
+            if known_regex == regex:
+                return child
+
+        child = RouteNode()
+        self.dynamic.append((regex, re.compile(regex).fullmatch, child))
+        return child
+
+    def collect(self, segments, depth, values, found):
+        """ Append all the (entry, values) matching the segments to found """
+        if depth == len(segments):
+            for entry in self.entries:
+                found.append((entry, tuple(values)))
+            return
+
+        segment = segments[depth]
+
+        child = self.static.get(segment)
+        if child is not None:
+            child.collect(segments, depth + 1, values, found)
+
+        for _, fullmatch, child in self.dynamic:
+            if fullmatch(segment):
+                values.append(segment)
+                child.collect(segments, depth + 1, values, found)
+                values.pop()
+
+
+class CompiledRouteMatcher:
+    """
+    Match a path and a method against a werkzeug Map without binding it.
+
+    Static rules are stored in a dict, rules with arguments in a prefix tree
+    with one level per URL segment. When several rules match, the one
+    werkzeug would have tried first wins, so the result is the same as
+    MapAdapter.match().
+
+    Rules that can't be compiled (custom converters, defaults, redirect_to,
+    subdomains...) are not matched here. If one of them may take
+    precedence, or if werkzeug would redirect, match() returns None and the
+    caller must fallback on werkzeug.
+    """
+
+    def __init__(self, url_map):
+        self.url_map = url_map
+        self.static = {}
+        self.tree = RouteNode()
+        self.fallback_rules = []
+
+        # Sort the rules in the order werkzeug tries them
+        url_map.update()
+
+        # A rule sharing its endpoint with a rule having defaults can
+        # trigger a redirect to the latter.
+        endpoints_with_defaults = {rule.endpoint
+                                   for rule in url_map.iter_rules()
+                                   if rule.defaults}
+
+        for index, rule in enumerate(url_map._rules):
+            # Those never match anything
+            if rule.build_only:
+                continue
+
+            if rule.endpoint in endpoints_with_defaults or \
+               not self.add_rule(index, rule):
+                self.fallback_rules.append((index, rule))
+
+    def can_compile(self, rule):
+        if rule.defaults or rule.redirect_to is not None or rule.alias or \
+           rule.subdomain or rule.host:
+            return False
+
+        trace = rule._trace
+        if not trace or trace[0] != (False, '|'):
+            return False
+
+        for converter in rule._converters.values():
+            if not isinstance(converter, COMPILABLE_CONVERTERS):
+                return False
+            if isinstance(converter, AnyConverter) and '/' in converter.regex:
+                return False
+
+        return True
+
+    def add_rule(self, index, rule):
+        """ Compile the rule, return False if it's not possible """
+
+        if not self.can_compile(rule):
+            return False
+
+        trace = rule._trace
+
+        # Werkzeug adds a trailing (False, '/') to the trace of rules
+        # ending with a slash.
+        full = trace[1:]
+        base = full if rule.is_leaf else full[:-1]
+
+        if rule.strict_slashes:
+            variants = [(full, False)]
+            if not rule.is_leaf:
+                variants.append((base, True))
+        else:
+            variants = [(base, False), (base + [(False, '/')], False)]
+
+        compiled = []
+        for trace_parts, redirect in variants:
+            segments = self.split_segments(rule, trace_parts)
+            if segments is None:
+                return False
+            compiled.append((segments, redirect))
+
+        for segments, redirect in compiled:
+            self.add_entry(index, rule, segments, redirect)
+
+        return True
+
+    def split_segments(self, rule, trace_parts):
+        """
+        Turn a part of a werkzeug rule trace into a list of URL segments.
+
+        Static segments are strings, dynamic ones are (name, converter).
+        Return None if a converter doesn't fill a whole segment
+        (e.g: "/<name>.html").
+        """
+        segments = [[]]
+        for is_dynamic, data in trace_parts:
+            if is_dynamic:
+                segments[-1].append((data, rule._converters[data]))
+                continue
+            pieces = data.split('/')
+            if pieces[0]:
+                segments[-1].append(pieces[0])
+            for piece in pieces[1:]:
+                segments.append([piece] if piece else [])
+
+        # Anything before the first "/" is not a segment
+        if segments[0]:
+            return None
+
+        result = []
+        for segment in segments[1:]:
+            if any(isinstance(piece, tuple) for piece in segment):
+                if len(segment) != 1:
+                    return None
+                result.append(segment[0])
+            else:
+                result.append(''.join(segment))
+
+        return result
+
+    def add_entry(self, index, rule, segments, redirect):
+        variables = tuple(s for s in segments if not isinstance(s, str))
+        entry = RouteEntry(index, rule, variables, redirect)
+
+        if not variables:
+            path = ''.join('/' + segment for segment in segments)
+            self.static.setdefault(path, []).append(entry)
+            return
+
+        node = self.tree
+        for segment in segments:
+            node = node.child(segment)
+        node.entries.append(entry)
+
+    def match(self, path, method):
+        """
+        Return (endpoint, arguments) for this path and method, or None if
+        werkzeug must be used instead.
+
+        Raise NotFound or MethodNotAllowed like werkzeug would.
+        """
+
+        # Same normalization as MapAdapter.match()
+        path = path and '/' + path.lstrip('/')
+        method = method.upper()
+
+        have_match_for = set()
+
+        # Static rules always come first in werkzeug and are already sorted
+        candidates = ((entry, ()) for entry in self.static.get(path, ()))
+        result = self.first_match(candidates, path, method, have_match_for)
+
+        if result is None:
+            found = []
+            self.tree.collect(path.split('/')[1:], 0, [], found)
+            if len(found) > 1:
+                found.sort(key=lambda candidate: candidate[0].index)
+            result = self.first_match(found, path, method, have_match_for)
+
+        if result is not None:
+            return result or None
+
+        if self.fallback_rules:
+            return None
+
+        if have_match_for:
+            raise MethodNotAllowed(valid_methods=list(have_match_for))
+
+        raise NotFound()
+
+    def first_match(self, candidates, path, method, have_match_for):
+        """
+        Return (endpoint, arguments) for the first matching candidate,
+        False if werkzeug must take over, or None if nothing matched.
+        """
+        for entry, values in candidates:
+
+            if self.fallback_rules and self.fallback_before(entry, path):
+                return False
+
+            if entry.redirect:
+                return False
+
+            try:
+                arguments = entry.convert(values)
+            except ValidationError:
+                continue
+
+            if entry.methods is not None and method not in entry.methods:
+                have_match_for.update(entry.methods)
+                continue
+
+            return entry.endpoint, arguments
+
+        return None
+
+    def fallback_before(self, entry, path):
+        """
+        Tell if a rule we couldn't compile would be tried before this entry
+        by werkzeug and matches the path.
+        """
+        path = '|' + path
+        for index, rule in self.fallback_rules:
+            if index > entry.index:
+                return False
+            if rule._regex.search(path):
+                return True
+        return False
+
+
+class RouteCache:
+    """
+    Bounded LRU cache of (method, host, path) => (endpoint, arguments).
+
+    Hits, misses and evictions are counted so you can size it.
+    """
+
+    def __init__(self, max_size):
+        self.max_size = max_size
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __len__(self):
+        return len(self.entries)
+
+    def get(self, key):
+        try:
+            match = self.entries[key]
+        except KeyError:
+            self.misses += 1
+            return None
+        self.entries.move_to_end(key)
+        self.hits += 1
+        return match
+
+    def set(self, key, match):
+        self.entries[key] = match
+        self.entries.move_to_end(key)
+        if len(self.entries) > self.max_size:
+            self.entries.popitem(last=False)
+            self.evictions += 1
+
+    def clear(self):
+        self.entries.clear()
+
+    def stats(self):
+        return {'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'size': len(self.entries),
+                'max_size': self.max_size}
@@ -1,18 +1,26 @@
 
+import os
 import re
+import stat
+import socket
 import asyncio
 
 from textwrap import dedent
 
 from aiohttp.web_reqrep import Response
-from aiohttp.helpers import reify
+from aiohttp.multipart import MultipartReader
 
 from werkzeug.routing import Map, Rule
+from werkzeug.exceptions import RequestEntityTooLarge, NotFound, BadRequest
 
 from tygs.exceptions import (HttpRequestControllerError,
                              HttpResponseControllerError,
                              RoutingError)
-from tygs.utils import HTTP_VERBS, removable_property
+from tygs.utils import HTTP_VERBS
+from tygs import serializers
+from tygs.http.routing import CompiledRouteMatcher, RouteCache
+from tygs.http.responses import ChunkedResponse, BytesResponse, FileResponse
+from tygs.http.streams import LimitedStream
 
 
 # TODO: move this function and other renderers to a dedicated module
@@ -24,11 +32,72 @@ def text_renderer(response):
             'content_type': 'text/plain',
             'charset': response.charset,
             # TODO: update default headers
-            'headers': response.headers,
+            'headers': response._headers,
             'body': body
             }
 
 
+def json_renderer(response):
+    data, dumps = response._renderer_data
+
+    return {'status': response.status_code,
+            'reason': response.reason,
+            'content_type': 'application/json',
+            'charset': 'utf-8',
+            'headers': response._headers,
+            'body': dumps(data)
+            }
+
+
+def cached_renderer(response):
+    rendered = dict(response._renderer_data)
+    # The headers set on this response, by a middleware for instance,
+    # override the cached ones
+    headers = dict(rendered.get('headers') or {})
+    headers.update(response._headers or {})
+    rendered['headers'] = headers
+    return rendered
+
+
+def stream_renderer(response):
+    return {'status': response.status_code,
+            'reason': response.reason,
+            'content_type': response.content_type,
+            'charset': response.charset,
+            'headers': response._headers,
+            'stream': response._renderer_data
+            }
+
+
+def bytes_renderer(response):
+    return {'status': response.status_code,
+            'reason': response.reason,
+            'content_type': response.content_type,
+            'headers': response._headers,
+            'data': response._renderer_data
+            }
+
+
+def file_renderer(response):
+    path, stat_result, content_type = response._renderer_data
+    return {'status': response.status_code,
+            'reason': response.reason,
+            'content_type': content_type,
+            'headers': response._headers,
+            'file': path,
+            'stat': stat_result
+            }
+
+
+# The key in the dict returned by the renderer tells which kind of aiohttp
+# response to build
+RESPONSE_TYPES = (
+    ('stream', ChunkedResponse),
+    ('data', BytesResponse),
+    ('file', FileResponse),
+)
+
+
 # TODO: allow the user to configure a default renderer for when no renderer
 # is set instead of getting this error. We'll need to update the exception
 # message though
@@ -42,6 +111,17 @@ def no_renderer(response):
 
 class HttpRequestController:
 
+    # One is created for each request, so keep them small and fast: the
+    # attributes are slots, without "__dict__", and everything that is not
+    # always needed is created lazily. Custom attributes can't be set: store
+    # the data of the request, like the current user set by a middleware,
+    # in res.context.
+    __slots__ = ('app', '_aiohttp_request', 'server_name', 'script_name',
+                 'subdomain', 'method', 'response', 'headers', 'handler',
+                 'url_scheme', 'url_path', 'max_body_size', '_raw_body',
+                 '_url_args', '_url_query', '_cookies', '_body',
+                 '_body_stream')
+
     # TODO: decouple aiothttp_request from HttpRequestController
     # TODO: decouple httprequestcontroller from httprequest
     def __init__(self, app, aiohttp_request):
@@ -58,17 +138,25 @@ class HttpRequestController:
         # API (avoid the confusion of when getting multiple values, etc)
         self.headers = aiohttp_request.headers
 
-        # aiohttp_request.cookies is also a Multidict
-        self.cookies = aiohttp_request.cookies
-
         self.handler = None
 
-        self.url_args = {}
         # TODO: self.url_params = {}
         # self.url_query_args = {}
         self.url_scheme = aiohttp_request.scheme
         self.url_path = aiohttp_request.path
 
+        # Max number of bytes we accept to read from the request body. None
+        # means no limit.
+        self.max_body_size = None
+        self._raw_body = None
+
+        # Created on first access, see the properties below
+        self._url_args = None
+        self._url_query = None
+        self._cookies = None
+        self._body = None
+        self._body_stream = None
+
     def __repr__(self):
         return "<{} {} {!r} >".format(self.__class__.__name__,
                                       self.method, self.url_path)
@@ -162,12 +250,33 @@ class HttpRequestController:
         # Do not try super().__getattr__ since the parent doesn't define it.
         return object.__getattribute__(self, name)
 
-    @reify
+    @property
+    def url_args(self):
+        if self._url_args is None:
+            self._url_args = {}
+        return self._url_args
+
+    @url_args.setter
+    def url_args(self, value):
+        self._url_args = value
+
+    @property
     def url_query(self):
-        return self._aiohttp_request.GET
+        if self._url_query is None:
+            self._url_query = self._aiohttp_request.GET
+        return self._url_query
+
+    @property
+    def cookies(self):
+        # aiohttp_request.cookies is also a Multidict
+        if self._cookies is None:
+            self._cookies = self._aiohttp_request.cookies
+        return self._cookies
 
-    @removable_property
+    @property
     def body(self):
+        if self._body is not None:
+            return self._body
         raise HttpRequestControllerError(dedent("""
             You must await "HttpRequestController.load_body()" before accessing
             "HttpRequestController.body".
@@ -180,7 +289,70 @@ class HttpRequestController:
             you used "lazy_body=True" in your routing code, so check it out.
         """))
 
+    @body.setter
+    def body(self, value):
+        self._body = value
+
+    @property
+    def body_stream(self):
+        """
+        The raw request body, as a stream enforcing max_body_size. Reading
+        it directly means you used "lazy_body=True" in your routing code.
+        """
+        if self._body_stream is not None:
+            return self._body_stream
+
+        max_size = self.max_body_size
+        content_length = self._aiohttp_request.content_length
+        # Don't even start reading if we know it's going to be too big
+        if max_size is not None and content_length is not None and \
+           content_length > max_size:
+            raise RequestEntityTooLarge()
+        self._body_stream = LimitedStream(self._aiohttp_request.content,
+                                          max_size)
+        return self._body_stream
+
+    def iter_body(self, chunk_size=None):
+        """
+        Async iterator on the raw request body chunks. Use it with
+        "async for" to process big uploads without loading them in memory.
+        """
+        return self.body_stream.iter_chunks(chunk_size)
+
+    async def read_body(self):
+        """ Return the whole raw request body as bytes """
+        if self._raw_body is None:
+            self._raw_body = await self.body_stream.read()
+        return self._raw_body
+
+    async def json(self, loads=None):
+        """
+        Parse the request body as JSON and return the result. Raise
+        BadRequest if it's not valid JSON.
+
+        loads default to the fastest decoder available, see
+        tygs.serializers.
+        """
+        loads = loads or serializers.loads
+        body = await self.read_body()
+        try:
+            return loads(body)
+        except ValueError as e:
+            raise BadRequest('Invalid JSON body: {}'.format(e))
+
+    def multipart(self):
+        """
+        Return an aiohttp MultipartReader to read a multipart body part by
+        part, each part being readable chunk by chunk.
+        """
+        return MultipartReader(self.headers, self.body_stream)
+
     async def load_body(self):
+        raw_body = await self.read_body()
+        # aiohttp.Request.post() parses what read() returns, and read()
+        # caches the body in _read_bytes. Set it so post() doesn't read
+        # the payload again without the size limit.
+        self._aiohttp_request._read_bytes = raw_body
         body = await self._aiohttp_request.post()
         self.body = body
         return body
@@ -192,12 +364,20 @@ class HttpRequestController:
 
 class HttpResponseController:
 
+    # See HttpRequestController.__slots__
+    __slots__ = ('request', '_renderer', 'template_engine', '_renderer_data',
+                 'status_code', 'content_type', 'reason', 'charset',
+                 '_context', '_headers')
+
     def __init__(self, request):
         self.request = request
         self._renderer = no_renderer
         self.template_engine = request.app.components.get('templates', None)
         self._renderer_data = None
-        self.context = {"req": request, "res": self}
+        # Only the template renderers and the error handlers need a context
+        # and most responses have no extra headers: create them on access
+        self._context = None
+        self._headers = None
 
         # TODO : set reason automatically when you set status
         # TODO: create a status NameSpace with embeded reason and code
@@ -207,7 +387,6 @@ class HttpResponseController:
         self.content_type = "text/html"
         self.reason = "OK"
         self.charset = "utf-8"
-        self.headers = {}
 
     def __repr__(self):
         req = self.request
@@ -224,13 +403,36 @@ class HttpResponseController:
         # Do not try super().__getattr__ since the parent doesn't define it.
         raise object.__getattribute__(self, name)
 
+    @property
+    def context(self):
+        if self._context is None:
+            self._context = {"req": self.request, "res": self}
+        return self._context
+
+    @context.setter
+    def context(self, value):
+        self._context = value
+
+    @property
+    def headers(self):
+        if self._headers is None:
+            self._headers = {}
+        return self._headers
+
+    @headers.setter
+    def headers(self, value):
+        self._headers = value
+
     # TODO: allow template engine to be passed here as a parameter, but
     # also be retrieved from the app configuration. And remove it as an
     # attribute of the HttpResponseController.
-    def template(self, template, data=None):
+    def template(self, template, data=None, stream=False):
         """
         Registers data variables and template name.
         This method does not actually render templates.
+
+        If stream is True, the template is sent to the client chunk by chunk
+        while it's rendered, instead of being rendered in memory first.
         """
 
         self.context['template_name'] = template
@@ -239,7 +441,10 @@ class HttpResponseController:
         self._renderer_data.update(data)
 
         # TODO make template engine pluggable
-        self._renderer = self.template_engine.render_to_response_dict
+        if stream:
+            self._renderer = self.template_engine.stream_to_response_dict
+        else:
+            self._renderer = self.template_engine.render_to_response_dict
 
         return self
 
@@ -248,18 +453,85 @@ class HttpResponseController:
         self._renderer = text_renderer
         return self
 
+    def json(self, data, dumps=None):
+        """
+        Send data encoded as JSON. dumps must return bytes and default to
+        the fastest encoder available, see tygs.serializers.
+        """
+        self._renderer_data = (data, dumps or serializers.dumps)
+        self._renderer = json_renderer
+        return self
+
+    def stream(self, iterable, content_type=None):
+        """
+        Send the chunks of bytes produced by an iterable or an async
+        iterable (E.G: an async generator) as they come, with chunked
+        transfer encoding.
+        """
+        if content_type:
+            self.content_type = content_type
+        self._renderer_data = iterable
+        self._renderer = stream_renderer
+        return self
+
+    def bytes(self, data, content_type='application/octet-stream'):
+        """
+        Send any bytes-like object (bytes, bytearray, memoryview...)
+        without copying it.
+        """
+        self.content_type = content_type
+        self._renderer_data = data
+        self._renderer = bytes_renderer
+        return self
+
+    def file(self, path, content_type=None):
+        """
+        Send a file using sendfile(). The content type is guessed from the
+        file name if not provided. ETag and Range requests are supported.
+
+        Raise NotFound if there is no such file.
+        """
+        try:
+            stat_result = os.stat(path)
+        except (FileNotFoundError, NotADirectoryError):
+            raise NotFound()
+        if not stat.S_ISREG(stat_result.st_mode):
+            raise NotFound()
+
+        self._renderer_data = (path, stat_result, content_type)
+        self._renderer = file_renderer
+        return self
+
+    def cached(self, rendered):
+        """
+        Send a response that has already been rendered, like the ones
+        stored in the response cache.
+        """
+        self._renderer_data = rendered
+        self._renderer = cached_renderer
+        return self
+
     def render_response(self):
         return self._renderer(self)
 
     def _build_aiohttp_response(self):
-        return Response(**self.render_response())
+        response = self.render_response()
+        for key, response_class in RESPONSE_TYPES:
+            if key in response:
+                return response_class(**response)
+        return Response(**response)
 
 
 class Router:
 
-    def __init__(self):
+    def __init__(self, cache_size=0):
         self.url_map = Map()
         self.handlers = {}
+        # handler => endpoint, to know which endpoint a request went to
+        self.endpoints = {}
+        self._matcher = None
+        # Optional LRU cache of the resolved routes, disabled if 0
+        self.cache = RouteCache(cache_size) if cache_size else None
         self.error_handlers = {
             "5**": self.default_error_handler,
             "4**": self.default_error_handler,
@@ -271,10 +543,54 @@ class Router:
     # TODO: add an async mechanisme to add routes and error handlers
     def add_route(self, url, endpoint, handler, methods=None, *args, **kwargs):
         rule = Rule(url, endpoint=endpoint, methods=methods, *args, **kwargs)
-        self.handlers[endpoint] = handler
+        self.set_handler(endpoint, handler)
         self.url_map.add(rule)
+        # The matcher will be compiled again on the next request
+        self._matcher = None
+        self.clear_cache()
+
+    def set_handler(self, endpoint, handler):
+        self.endpoints.pop(self.handlers.get(endpoint), None)
+        self.handlers[endpoint] = handler
+        self.endpoints[handler] = endpoint
+
+    def clear_cache(self):
+        if self.cache is not None:
+            self.cache.clear()
+
+    @property
+    def matcher(self):
+        if self._matcher is None or self.url_map._remap:
+            self._matcher = CompiledRouteMatcher(self.url_map)
+        return self._matcher
 
     async def get_handler(self, http_request):
+
+        if self.cache is None:
+            endpoint, arguments = self.match(http_request)
+            return self.handlers[endpoint], arguments
+
+        # Somebody added rules to the map directly
+        if self.url_map._remap:
+            self.cache.clear()
+
+        key = (http_request.method, http_request.server_name,
+               http_request.url_path)
+        match = self.cache.get(key)
+        if match is None:
+            match = self.match(http_request)
+            self.cache.set(key, match)
+
+        endpoint, arguments = match
+        # Don't let anybody mess with the cached arguments
+        return self.handlers[endpoint], dict(arguments)
+
+    def match(self, http_request):
+        match = self.matcher.match(http_request.url_path, http_request.method)
+        if match is not None:
+            return match
+
+        # Let werkzeug deal with redirects and the rules we can't compile
         map_adapter = self.url_map.bind(
             server_name=http_request.server_name,
             script_name=http_request.script_name,
@@ -286,8 +602,7 @@ class Router:
         )
 
         # TODO:  MethodNotAllowed, RequestRedirect exceptions
-        endpoint, arguments = map_adapter.match()
-        return self.handlers[endpoint], arguments
+        return map_adapter.match()
 
     async def default_error_handler(self, req, res):
         # Here we don't know what the error is, a 500 or 400, so by default
@@ -321,23 +636,135 @@ class Router:
             """))
 
         self.error_handlers[code] = handler
+        self.clear_cache()
+
+
+def as_list(value):
+    if value is None:
+        return []
+    if isinstance(value, (list, tuple)):
+        return list(value)
+    return [value]
+
+
+def bind_tcp_sockets(host, port, backlog=128, reuse_port=False):
+    """ Create one listening socket per address the host resolves to """
+
+    infos = socket.getaddrinfo(host, port, type=socket.SOCK_STREAM,
+                               flags=socket.AI_PASSIVE)
+    sockets = []
+    try:
+        for family, type_, proto, _, address in infos:
+            sock = socket.socket(family, type_, proto)
+            sockets.append(sock)
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+            if reuse_port:
+                if not hasattr(socket, 'SO_REUSEPORT'):
+                    raise ValueError('reuse_port is not supported on '
+                                     'this platform')
+                sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+            # Like asyncio, don't let IPV6 sockets listen on IPV4
+            if family == socket.AF_INET6:
+                sock.setsockopt(socket.IPPROTO_IPV6, socket.IPV6_V6ONLY, 1)
+            sock.bind(address)
+            sock.listen(backlog)
+            sock.setblocking(False)
+    except Exception:
+        for sock in sockets:
+            sock.close()
+        raise
+
+    return sockets
+
+
+def bind_unix_socket(path, backlog=128):
+    path = str(path)
+
+    # Remove the file left by a previous run
+    try:
+        if stat.S_ISSOCK(os.stat(path).st_mode):
+            os.remove(path)
+    except FileNotFoundError:
+        pass
+
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        sock.bind(path)
+        sock.listen(backlog)
+        sock.setblocking(False)
+    except Exception:
+        sock.close()
+        raise
+
+    return sock
+
+
+def remove_unix_sockets(paths):
+    for path in as_list(paths):
+        try:
+            os.remove(str(path))
+        except FileNotFoundError:
+            pass
 
 
 class Server:
+    """
+    Serve the app on several TCP addresses, unix sockets and already
+    bound sockets at once.
 
-    def __init__(self, app):
+    host, unix and sock can be a single value or a list. If nothing is
+    passed, listen on 0.0.0.0:8080.
+    """
+
+    def __init__(self, app, host=None, port=None, backlog=128,
+                 reuse_port=False, unix=None, sock=None):
         self.loop = asyncio.get_event_loop()
         self.app = app
         self.handler = self.app._aiohttp_app.make_handler()
-        self._server_factory = self.loop.create_server(self.handler, '0.0.0.0',
-                                                       8080)
+        self.options = {'host': host, 'port': port, 'backlog': backlog,
+                        'reuse_port': reuse_port, 'unix': unix, 'sock': sock}
+        self.sockets = []
+        self.servers = []
+
+    @staticmethod
+    def bind_sockets(host=None, port=None, backlog=128, reuse_port=False,
+                     unix=None, sock=None):
+        """ Create all the listening sockets for these options """
+
+        sockets = as_list(sock)
+        unix = as_list(unix)
+
+        if host is not None or port is not None or \
+           not (unix or sockets):
+            hosts = as_list(host) or ['0.0.0.0']
+            port = 8080 if port is None else port
+            for host in hosts:
+                sockets.extend(bind_tcp_sockets(host, port, backlog,
+                                                reuse_port))
+
+        for path in unix:
+            sockets.append(bind_unix_socket(path, backlog))
+
+        return sockets
 
     async def start(self):
-        self.server = await asyncio.ensure_future(self._server_factory)
+        self.sockets = self.bind_sockets(**self.options)
+        backlog = self.options['backlog']
+        for sock in self.sockets:
+            if sock.family == socket.AF_UNIX:
+                factory = self.loop.create_unix_server(self.handler,
+                                                       sock=sock,
+                                                       backlog=backlog)
+            else:
+                factory = self.loop.create_server(self.handler, sock=sock,
+                                                  backlog=backlog)
+            self.servers.append(await factory)
         self.app.register('stop', self.stop)
 
     async def stop(self):
         await self.handler.finish_connections(1.0)
-        self.server.close()
-        await self.server.wait_closed()
+        for server in self.servers:
+            server.close()
+            await server.wait_closed()
+        remove_unix_sockets(self.options['unix'])
         await self.app._aiohttp_app.finish()
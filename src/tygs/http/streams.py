@@ -0,0 +1,69 @@
+from werkzeug.exceptions import RequestEntityTooLarge
+
+
+class LimitedStream:
+    """
+    Proxy to an aiohttp StreamReader raising RequestEntityTooLarge as soon
+    as more than max_size bytes have been read from it.
+
+    It implements what the aiohttp multipart reader needs.
+    """
+
+    def __init__(self, stream, max_size=None):
+        self.stream = stream
+        self.max_size = max_size
+        self.size = 0
+
+    def _count(self, data):
+        self.size += len(data)
+        if self.max_size is not None and self.size > self.max_size:
+            raise RequestEntityTooLarge()
+        return data
+
+    async def read(self, n=-1):
+        if n >= 0:
+            return self._count(await self.stream.read(n))
+
+        # Read chunk by chunk so we never buffer more than the limit
+        body = bytearray()
+        while True:
+            chunk = await self.readany()
+            if not chunk:
+                return bytes(body)
+            body.extend(chunk)
+
+    async def readany(self):
+        return self._count(await self.stream.readany())
+
+    async def readline(self):
+        return self._count(await self.stream.readline())
+
+    async def readexactly(self, n):
+        return self._count(await self.stream.readexactly(n))
+
+    def unread_data(self, data):
+        self.size -= len(data)
+        self.stream.unread_data(data)
+
+    def at_eof(self):
+        return self.stream.at_eof()
+
+    def iter_chunks(self, chunk_size=None):
+        if chunk_size is None:
+            return StreamIterator(self.readany)
+        return StreamIterator(lambda: self.read(chunk_size))
+
+
+class StreamIterator:
+
+    def __init__(self, read):
+        self.read = read
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        chunk = await self.read()
+        if not chunk:
+            raise StopAsyncIteration
+        return chunk
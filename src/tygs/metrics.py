@@ -0,0 +1,177 @@
+"""
+Request metrics, served in the Prometheus text format.
+
+Recording a request only increments counters in storage allocated when the
+endpoint is first seen: the histograms are arrays with one counter per
+bucket, found with a bisection.
+"""
+
+from array import array
+from bisect import bisect_left
+
+from .components import Component
+
+
+def log_linear_bounds(start=-4, end=1, steps=(1, 2, 3, 4, 5, 6, 7, 8, 9)):
+    """
+    Bucket upper bounds growing linearly inside each power of ten, from
+    10 ** start to steps[-1] * 10 ** end: 0.0001, 0.0002... 0.0009, 0.001,
+    0.002... So the relative error stays the same for fast and slow
+    requests, with few buckets.
+    """
+    return tuple(round(step * 10 ** exponent, -exponent + 1)
+                 for exponent in range(start, end + 1)
+                 for step in steps)
+
+
+# 100 microseconds to 90 seconds
+DEFAULT_BOUNDS = log_linear_bounds()
+
+
+class Histogram:
+    """ Count the values falling in each bucket, plus their sum """
+
+    __slots__ = ('bounds', 'counts', 'count', 'sum')
+
+    def __init__(self, bounds=DEFAULT_BOUNDS):
+        self.bounds = bounds
+        # The last bucket is for the values above the last bound
+        self.counts = array('Q', bytes(8 * (len(bounds) + 1)))
+        self.count = 0
+        self.sum = 0.0
+
+    def record(self, value):
+        self.counts[bisect_left(self.bounds, value)] += 1
+        self.count += 1
+        self.sum += value
+
+    def cumulative(self):
+        """ Yield (bound, number of values <= bound), like Prometheus """
+        total = 0
+        for bound, count in zip(self.bounds, self.counts):
+            total += count
+            yield bound, total
+        yield float('inf'), self.count
+
+    def quantile(self, q):
+        """
+        Return the upper bound of the bucket containing the q quantile, q
+        being between 0 and 1, or None if nothing was recorded.
+        """
+        if not self.count:
+            return None
+        rank = q * self.count
+        for bound, total in self.cumulative():
+            if total >= rank:
+                return bound
+
+
+class EndpointMetrics:
+    """ Request counts by status and durations by phase for an endpoint """
+
+    PHASES = ('routing', 'handler', 'render', 'write', 'total')
+
+    __slots__ = ('statuses',) + PHASES
+
+    def __init__(self, bounds=DEFAULT_BOUNDS):
+        self.statuses = {}
+        for phase in self.PHASES:
+            setattr(self, phase, Histogram(bounds))
+
+    def record(self, status, routing, handler, render, write):
+        statuses = self.statuses
+        statuses[status] = statuses.get(status, 0) + 1
+        self.routing.record(routing)
+        self.handler.record(handler)
+        self.render.record(render)
+        self.write.record(write)
+        self.total.record(routing + handler + render + write)
+
+
+def format_bound(bound):
+    if bound == float('inf'):
+        return '+Inf'
+    return repr(bound)
+
+
+class MetricsComponent(Component):
+    """
+    Record the number of requests by endpoint and status, and how long the
+    routing, the handler, the rendering of the response and its writing
+    took.
+
+    Nothing is recorded until expose() is called, which also adds a route
+    serving the metrics in the Prometheus text format. In a multi workers
+    setup, each worker serves its own metrics, labeled with its id.
+
+    The loop lag and slow steps are included if the LoopMonitor is
+    enabled.
+    """
+
+    CONTENT_TYPE = 'text/plain; version=0.0.4'
+
+    def __init__(self, app, bounds=DEFAULT_BOUNDS):
+        super().__init__(app)
+        self.bounds = bounds
+        self.enabled = False
+        # endpoint name => EndpointMetrics
+        self.endpoints = {}
+
+    def expose(self, url='/metrics'):
+        self.enabled = True
+        http = self.app.components['http']
+
+        # Not "<ns>.metrics", which a view of the app could use
+        @http.get(url, inline=True, endpoint='tygs:metrics')
+        def metrics(req, res):
+            return res.bytes(self.render().encode('utf8'),
+                             content_type=self.CONTENT_TYPE)
+
+        return metrics
+
+    def record(self, endpoint, status, routing, handler, render, write):
+        try:
+            metrics = self.endpoints[endpoint]
+        except KeyError:
+            metrics = self.endpoints[endpoint] = EndpointMetrics(self.bounds)
+        metrics.record(status, routing, handler, render, write)
+
+    def get_labels(self, **labels):
+        if self.app.worker_id is not None:
+            labels['worker'] = self.app.worker_id
+        return ','.join('{}="{}"'.format(name, str(value).replace('"', r'\"'))
+                        for name, value in sorted(labels.items()))
+
+    def render(self):
+        lines = [
+            '# HELP tygs_http_requests_total Number of HTTP requests',
+            '# TYPE tygs_http_requests_total counter',
+        ]
+        for endpoint, metrics in sorted(self.endpoints.items()):
+            for status, count in sorted(metrics.statuses.items()):
+                labels = self.get_labels(endpoint=endpoint, status=status)
+                lines.append('tygs_http_requests_total{{{}}} {}'.format(
+                    labels, count))
+
+        name = 'tygs_http_request_duration_seconds'
+        lines.append('# HELP {} Time spent handling HTTP requests, by '
+                     'phase'.format(name))
+        lines.append('# TYPE {} histogram'.format(name))
+        for endpoint, metrics in sorted(self.endpoints.items()):
+            for phase in EndpointMetrics.PHASES:
+                histogram = getattr(metrics, phase)
+                labels = self.get_labels(endpoint=endpoint, phase=phase)
+                for bound, count in histogram.cumulative():
+                    lines.append('{}_bucket{{{},le="{}"}} {}'.format(
+                        name, labels, format_bound(bound), count))
+                lines.append('{}_sum{{{}}} {!r}'.format(name, labels,
+                                                        histogram.sum))
+                lines.append('{}_count{{{}}} {}'.format(name, labels,
+                                                        histogram.count))
+
+        monitor = self.app.components.get('monitor')
+        if monitor is not None and monitor.enabled:
+            lines.extend(monitor.render_metrics(self.get_labels))
+
+        lines.append('')
+        return '\n'.join(lines)
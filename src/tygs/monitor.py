@@ -0,0 +1,213 @@
+import time
+import asyncio
+import inspect
+import logging
+
+from .components import Component
+from .metrics import Histogram
+from .utils import inline
+
+
+log = logging.getLogger(__name__)
+
+
+class WatchedAwaitable:
+    """
+    Await an awaitable, timing each step: each time the task resumes it,
+    until it yields again. This is the time it blocks the loop.
+    """
+
+    __slots__ = ('iterator', 'label', 'monitor')
+
+    def __init__(self, awaitable, label, monitor):
+        self.iterator = awaitable.__await__()
+        self.label = label
+        self.monitor = monitor
+
+    def __await__(self):
+        return self
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        return self.send(None)
+
+    def send(self, value):
+        start = time.perf_counter()
+        try:
+            return self.iterator.send(value)
+        finally:
+            self.monitor.check_step(self.label, time.perf_counter() - start)
+
+    def throw(self, *args):
+        start = time.perf_counter()
+        try:
+            return self.iterator.throw(*args)
+        finally:
+            self.monitor.check_step(self.label, time.perf_counter() - start)
+
+    def close(self):
+        return self.iterator.close()
+
+
+class WatchedHandler:
+    """ Call an event handler, timing the call and the steps it returns """
+
+    __slots__ = ('handler', 'event', 'monitor')
+
+    def __init__(self, handler, event, monitor):
+        self.handler = handler
+        self.event = event
+        self.monitor = monitor
+
+    def __call__(self, *args, **kwargs):
+        start = time.perf_counter()
+        try:
+            result = self.handler(*args, **kwargs)
+        finally:
+            self.monitor.check_step(self.event, time.perf_counter() - start)
+        if inspect.isawaitable(result):
+            return WatchedAwaitable(result, self.event, self.monitor)
+        return result
+
+
+class SlowSteps:
+
+    __slots__ = ('count', 'duration', 'max')
+
+    def __init__(self):
+        self.count = 0
+        self.duration = 0.0
+        self.max = 0.0
+
+
+class LoopMonitor(Component):
+    """
+    Tell how much the loop is late, and which route or event made it late.
+
+    Every "interval" seconds, a heartbeat callback measures how late the
+    loop calls it: the loop lag. Each step of the request handlers and of
+    the event handlers running on the loop is timed, and the ones longer
+    than "threshold" seconds are counted by endpoint ("ns.func_name") or
+    event name, and logged with the details in the "extra" of the log
+    record.
+
+    It's off until enable() is called, or App(monitor=True). Then the cost
+    is two clock reads for each step.
+    """
+
+    def __init__(self, app, interval=1.0, threshold=0.1):
+        super().__init__(app)
+        self.interval = interval
+        self.threshold = threshold
+        self.enabled = False
+        self.lag = Histogram()
+        # label => SlowSteps
+        self.slow_steps = {}
+        # event => (registration counter, watched handlers)
+        self.watched = {}
+        self.heartbeat = None
+
+    @inline
+    def setup(self):
+        self.app.register('ready', self.start, inline=True)
+        self.app.register('stop', self.stop, inline=True)
+
+    def enable(self):
+        self.enabled = True
+        self.app.components['signals'].monitor = self
+
+    def disable(self):
+        self.enabled = False
+        self.app.components['signals'].monitor = None
+        self.stop()
+
+    def start(self):
+        if self.enabled and self.heartbeat is None:
+            self.schedule_beat()
+
+    def stop(self):
+        if self.heartbeat is not None:
+            self.heartbeat.cancel()
+            self.heartbeat = None
+
+    def schedule_beat(self):
+        loop = asyncio.get_event_loop()
+        expected = loop.time() + self.interval
+        self.heartbeat = loop.call_at(expected, self.beat, loop, expected)
+
+    def beat(self, loop, expected):
+        lag = max(loop.time() - expected, 0)
+        self.lag.record(lag)
+        if lag > self.threshold:
+            log.warning('The event loop was blocked for %.3fs', lag,
+                        extra={'loop_lag': lag})
+        self.schedule_beat()
+
+    def check_step(self, label, duration):
+        if duration <= self.threshold:
+            return
+        try:
+            steps = self.slow_steps[label]
+        except KeyError:
+            steps = self.slow_steps[label] = SlowSteps()
+        steps.count += 1
+        steps.duration += duration
+        steps.max = max(steps.max, duration)
+        log.warning('A step of %s blocked the event loop for %.3fs', label,
+                    duration, extra={'slow_step': label,
+                                     'step_duration': duration})
+
+    def watch(self, awaitable, label):
+        """ Time the steps of an awaitable, attributed to label """
+        return WatchedAwaitable(awaitable, label, self)
+
+    def watch_handlers(self, event, handlers, registered):
+        """
+        Return the handlers of this event wrapped to be timed. registered
+        is the registration counter of the dispatcher: the lists of
+        handlers are updated in place, so they can't tell if they changed.
+        """
+        try:
+            cached, watched = self.watched[event]
+            if cached == registered:
+                return watched
+        except KeyError:
+            pass
+        watched = [WatchedHandler(handler, event, self)
+                   for handler in handlers]
+        self.watched[event] = (registered, watched)
+        return watched
+
+    def render_metrics(self, get_labels):
+        """ Lines in the Prometheus text format, see MetricsComponent """
+        name = 'tygs_loop_lag_seconds'
+        labels = get_labels()
+        lines = ['# HELP {} How late the loop runs the callbacks'.format(
+                 name), '# TYPE {} histogram'.format(name)]
+        for bound, count in self.lag.cumulative():
+            if bound == float('inf'):
+                bound = '+Inf'
+            le = 'le="{}"'.format(bound)
+            lines.append('{}_bucket{{{}}} {}'.format(
+                name, ','.join(filter(None, (labels, le))), count))
+        lines.append('{}_sum{{{}}} {!r}'.format(name, labels, self.lag.sum))
+        lines.append('{}_count{{{}}} {}'.format(name, labels,
+                                                self.lag.count))
+
+        name = 'tygs_slow_steps_total'
+        lines.append('# HELP {} Steps blocking the loop longer than the '
+                     'threshold'.format(name))
+        lines.append('# TYPE {} counter'.format(name))
+        for label, steps in sorted(self.slow_steps.items()):
+            lines.append('{}{{{}}} {}'.format(
+                name, get_labels(source=label), steps.count))
+
+        name = 'tygs_slow_steps_seconds_total'
+        lines.append('# HELP {} Time spent in the slow steps'.format(name))
+        lines.append('# TYPE {} counter'.format(name))
+        for label, steps in sorted(self.slow_steps.items()):
+            lines.append('{}{{{}}} {!r}'.format(
+                name, get_labels(source=label), steps.duration))
+        return lines
@@ -0,0 +1,194 @@
+import os
+import re
+import signal
+import cProfile
+import logging
+import pstats
+
+from collections import Counter
+
+from path import Path
+
+from .components import Component
+from .utils import inline
+
+
+log = logging.getLogger(__name__)
+
+
+class ProfiledAwaitable:
+    """ Await an awaitable with the profiler running during each step """
+
+    __slots__ = ('iterator', 'endpoint', 'profiler')
+
+    def __init__(self, awaitable, endpoint, profiler):
+        self.iterator = awaitable.__await__()
+        self.endpoint = endpoint
+        self.profiler = profiler
+
+    def __await__(self):
+        return self
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        return self.send(None)
+
+    def send(self, value):
+        profile = self.profiler.start_step(self.endpoint)
+        try:
+            return self.iterator.send(value)
+        finally:
+            self.profiler.end_step(profile)
+
+    def throw(self, *args):
+        profile = self.profiler.start_step(self.endpoint)
+        try:
+            return self.iterator.throw(*args)
+        finally:
+            self.profiler.end_step(profile)
+
+    def close(self):
+        return self.iterator.close()
+
+
+def collapse_stack(frame):
+    """ Return the stack as "file:function:line;..." from the root """
+    names = []
+    while frame is not None:
+        code = frame.f_code
+        names.append('{}:{}:{}'.format(os.path.basename(code.co_filename),
+                                       code.co_name, code.co_firstlineno))
+        frame = frame.f_back
+    return ';'.join(reversed(names))
+
+
+class RequestProfiler(Component):
+    """
+    Profile one request out of "every" for each endpoint, and aggregate
+    the results by endpoint.
+
+    For the sampled requests, cProfile runs during each step of the handler
+    and of the response writing. A SIGPROF timer also samples the stack
+    every "interval" seconds of CPU time while these steps run. Both are
+    written in "directory" (default: "profiles" in the project dir) when
+    the profiler is disabled, on "stop", or with dump():
+
+    - <endpoint>.pstats, to read with the pstats module or snakeviz;
+    - <endpoint>.collapsed, in the collapsed stack format of flamegraph.pl
+      and speedscope.
+
+    Regular handlers running in the thread pool are not profiled, only what
+    runs on the loop.
+
+    It's off until enable() is called. When the app runs with ready(),
+    SIGUSR2 turns it on and off.
+    """
+
+    def __init__(self, app, every=100, interval=0.001, directory=None):
+        super().__init__(app)
+        self.every = every
+        self.interval = interval
+        self.directory = directory
+        self.enabled = False
+        # endpoint => number of requests seen while enabled
+        self.requests = Counter()
+        # endpoint => cProfile.Profile
+        self.profiles = {}
+        # endpoint => Counter of collapsed stacks
+        self.stacks = {}
+        # The endpoint of the step being profiled, for the stack sampler
+        self.current = None
+        self.sampling = False
+
+    @inline
+    def setup(self):
+        self.app.register('stop', self.disable, inline=True)
+
+    def get_directory(self):
+        if self.directory is not None:
+            return Path(self.directory)
+        return Path(self.app.project_dir or '.') / 'profiles'
+
+    def enable(self):
+        if self.enabled:
+            return
+        self.enabled = True
+        self.start_sampler()
+        log.info('Profiling 1 request out of %s per endpoint', self.every)
+
+    def disable(self):
+        if not self.enabled:
+            return
+        self.enabled = False
+        self.stop_sampler()
+        if self.profiles:
+            log.info('Profiles written in %s', self.dump())
+
+    def toggle(self):
+        if self.enabled:
+            self.disable()
+        else:
+            self.enable()
+
+    def start_sampler(self):
+        try:
+            signal.signal(signal.SIGPROF, self.sample)
+            signal.setitimer(signal.ITIMER_PROF, self.interval,
+                             self.interval)
+        # Not on Windows, or not in the main thread
+        except (AttributeError, ValueError) as e:
+            log.warning('No stack sampling, only cProfile stats: %s', e)
+            return
+        self.sampling = True
+
+    def stop_sampler(self):
+        if self.sampling:
+            signal.setitimer(signal.ITIMER_PROF, 0)
+            signal.signal(signal.SIGPROF, signal.SIG_DFL)
+            self.sampling = False
+
+    def sample(self, signum, frame):
+        endpoint = self.current
+        if endpoint is not None:
+            stacks = self.stacks.get(endpoint)
+            if stacks is None:
+                stacks = self.stacks[endpoint] = Counter()
+            stacks[collapse_stack(frame)] += 1
+
+    def should_profile(self, endpoint):
+        count = self.requests[endpoint]
+        self.requests[endpoint] = count + 1
+        return count % self.every == 0
+
+    def watch(self, awaitable, endpoint):
+        """ Profile the steps of the awaitable as part of this endpoint """
+        return ProfiledAwaitable(awaitable, endpoint, self)
+
+    def start_step(self, endpoint):
+        profile = self.profiles.get(endpoint)
+        if profile is None:
+            profile = self.profiles[endpoint] = cProfile.Profile()
+        self.current = endpoint
+        profile.enable()
+        return profile
+
+    def end_step(self, profile):
+        profile.disable()
+        self.current = None
+
+    def dump(self):
+        """ Write the stats collected so far. Return the directory. """
+        directory = self.get_directory()
+        directory.makedirs_p()
+        for endpoint, profile in self.profiles.items():
+            name = re.sub(r'[^\w.-]', '_', endpoint)
+            pstats.Stats(profile).dump_stats(
+                str(directory / '{}.pstats'.format(name)))
+
+            stacks = self.stacks.get(endpoint, {})
+            with open(directory / '{}.collapsed'.format(name), 'w') as f:
+                for stack, count in sorted(stacks.items()):
+                    f.write('{} {}\n'.format(stack, count))
+        return directory
@@ -0,0 +1,224 @@
+import asyncio
+
+from collections import deque
+
+from .components import Component
+from .events import TopicTrie
+from .utils import inline
+
+
+POLICIES = ('drop_oldest', 'drop_newest', 'disconnect')
+
+
+class SubscriptionClosed(Exception):
+    pass
+
+
+class Subscription:
+    """
+    Receive the messages published on the channels matching some patterns.
+
+    Messages are buffered in a queue of maxsize items until you read them
+    with "await sub.get()" or "async for channel, message in sub". When the
+    queue is full, the policy decides what happens to the new message:
+
+    - "drop_oldest": the oldest message is dropped to make room;
+    - "drop_newest": the new message is dropped;
+    - "disconnect": the subscription is closed, and reading from it raises
+      SubscriptionClosed once the buffered messages are read.
+
+    The messages are never copied, so don't mutate them after publishing.
+    """
+
+    def __init__(self, broker, patterns, maxsize=100, policy='drop_oldest'):
+        if policy not in POLICIES:
+            raise ValueError('policy must be one of {}, not {!r}'.format(
+                ', '.join(POLICIES), policy))
+        if maxsize < 1:
+            raise ValueError('maxsize must be at least 1')
+        self.broker = broker
+        self.patterns = patterns
+        self.maxsize = maxsize
+        self.policy = policy
+        self.queue = deque()
+        # Futures of the readers waiting for a message, first come first
+        # served
+        self.waiters = deque()
+        self.closed = False
+        # Messages lost because we were too slow
+        self.dropped = 0
+
+    def __repr__(self):
+        return "<Subscription {} ({}/{})>".format(
+            ', '.join(self.patterns), len(self.queue), self.maxsize)
+
+    def put(self, channel, message):
+        """ Add a message to the queue. Return False if it's dropped. """
+        if self.closed:
+            return False
+
+        if len(self.queue) >= self.maxsize:
+            self.dropped += 1
+            if self.policy == 'drop_newest':
+                return False
+            if self.policy == 'disconnect':
+                self.close()
+                return False
+            self.queue.popleft()
+
+        self.queue.append((channel, message))
+        self.wakeup_next()
+        return True
+
+    def wakeup_next(self):
+        while self.waiters:
+            waiter = self.waiters.popleft()
+            if not waiter.done():
+                waiter.set_result(None)
+                return
+
+    def get_nowait(self):
+        """ Return (channel, message) or raise IndexError if empty """
+        if not self.queue and self.closed:
+            raise SubscriptionClosed(repr(self))
+        return self.queue.popleft()
+
+    async def get(self):
+        while not self.queue:
+            if self.closed:
+                raise SubscriptionClosed(repr(self))
+            waiter = asyncio.Future()
+            self.waiters.append(waiter)
+            try:
+                await waiter
+            except asyncio.CancelledError:
+                try:
+                    self.waiters.remove(waiter)
+                except ValueError:
+                    # Woken up already: let another reader take the message
+                    if self.queue:
+                        self.wakeup_next()
+                raise
+        return self.queue.popleft()
+
+    def __len__(self):
+        return len(self.queue)
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        try:
+            return await self.get()
+        except SubscriptionClosed:
+            raise StopAsyncIteration
+
+    def close(self):
+        """ Stop receiving messages. The buffered ones can still be read. """
+        if self.closed:
+            return
+        self.closed = True
+        self.broker.unsubscribe(self)
+        while self.waiters:
+            waiter = self.waiters.popleft()
+            if not waiter.done():
+                waiter.set_result(None)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+class PubSubComponent(Component):
+    """
+    In process PUB/SUB.
+
+    Channel names are made of segments separated with dots, and can be
+    subscribed to with the same wildcards as the events: "chat.*" or
+    "chat.**". Publishing puts a reference to the message in the queue of
+    each matching subscription, so it's cheap even with thousands of
+    subscribers, and never waits for them.
+    """
+
+    def __init__(self, app, maxsize=100, policy='drop_oldest'):
+        super().__init__(app)
+        self.maxsize = maxsize
+        self.policy = policy
+        # channel => set of subscriptions, for the patterns without wildcard
+        self.channels = {}
+        # pattern => set of subscriptions, for the ones with wildcards
+        self.patterns = {}
+        self.topics = TopicTrie()
+
+    @inline
+    def setup(self):
+        self.app.register('stop', self.close)
+
+    def subscribe(self, *patterns, maxsize=None, policy=None):
+        if not patterns:
+            raise ValueError('Subscribe to at least one channel')
+        for pattern in patterns:
+            TopicTrie.split(pattern)
+
+        sub = Subscription(self, patterns, maxsize or self.maxsize,
+                           policy or self.policy)
+        for pattern in patterns:
+            if '*' in pattern:
+                if pattern not in self.patterns:
+                    self.topics.add(pattern)
+                self.patterns.setdefault(pattern, set()).add(sub)
+            else:
+                self.channels.setdefault(pattern, set()).add(sub)
+        return sub
+
+    def unsubscribe(self, sub):
+        for pattern in sub.patterns:
+            index = self.patterns if '*' in pattern else self.channels
+            subs = index.get(pattern)
+            if subs is None:
+                continue
+            subs.discard(sub)
+            if not subs:
+                del index[pattern]
+                # We don't remove patterns from the trie, but match() only
+                # returns the patterns, which we skip if they have no
+                # subscriptions anymore.
+
+    def get_subscriptions(self, channel):
+        subs = self.channels.get(channel, ())
+        if not self.patterns:
+            return subs
+
+        matches = [self.patterns[pattern]
+                   for pattern in self.topics.match(channel)
+                   if pattern in self.patterns]
+        if not matches:
+            return subs
+        # A subscription with several matching patterns only gets the
+        # message once
+        subs = set(subs)
+        for pattern_subs in matches:
+            subs.update(pattern_subs)
+        return subs
+
+    def publish(self, channel, message):
+        """ Send the message to all the subscribers. Return how many got it """
+        received = 0
+        # put() may close the subscription, which changes the sets
+        for sub in list(self.get_subscriptions(channel)):
+            received += sub.put(channel, message)
+        return received
+
+    def subscribers_count(self, channel):
+        return len(self.get_subscriptions(channel))
+
+    @inline
+    def close(self):
+        subs = set()
+        for index in (self.channels, self.patterns):
+            for channel_subs in index.values():
+                subs.update(channel_subs)
+        for sub in subs:
+            sub.close()
@@ -0,0 +1,335 @@
+"""
+RPC between the processes of an app, over unix sockets.
+
+Each frame is a 4 bytes big-endian length followed by the message, encoded
+with msgpack if it's installed or JSON otherwise. A message is a list:
+
+- [REQUEST, call id, function name, args, kwargs];
+- [RESPONSE, call id, error, result], error being None or
+  [exception class name, message].
+
+Calls are identified by an id, so many of them can wait for their response
+on the same connection at the same time.
+"""
+
+import os
+import errno
+import struct
+import asyncio
+import inspect
+import logging
+import tempfile
+import itertools
+
+from path import Path
+
+from . import serializers
+from .components import Component
+from .utils import inline
+
+try:
+    import msgpack
+except ImportError:  # pragma: no cover
+    msgpack = None
+
+
+log = logging.getLogger(__name__)
+
+REQUEST = 0
+RESPONSE = 1
+
+HEADER = struct.Struct('!I')
+MAX_FRAME_SIZE = 64 * 1024 * 1024
+
+if msgpack is not None:  # pragma: no cover
+    CODEC = 'msgpack'
+
+    def dumps(data):
+        return msgpack.packb(data, use_bin_type=True)
+
+    def loads(data):
+        return msgpack.unpackb(data, raw=False)
+else:  # pragma: no cover
+    CODEC = 'json'
+    dumps = serializers.dumps
+    loads = serializers.loads
+
+
+class RemoteError(Exception):
+    """ The remote function raised an exception """
+
+    def __init__(self, name, message):
+        super().__init__('{}: {}'.format(name, message))
+        self.name = name
+        self.message = message
+
+
+class ConnectionClosed(ConnectionError):
+    pass
+
+
+def pack(message):
+    payload = dumps(message)
+    return HEADER.pack(len(payload)) + payload
+
+
+async def read_frame(reader):
+    """ Return the next decoded message, or None at the end of the stream """
+    try:
+        header = await reader.readexactly(HEADER.size)
+    except asyncio.IncompleteReadError:
+        return None
+    size, = HEADER.unpack(header)
+    if size > MAX_FRAME_SIZE:
+        raise ValueError('RPC frame too big: {} bytes'.format(size))
+    return loads(await reader.readexactly(size))
+
+
+class RpcConnection:
+    """ A client connection, shared by all the calls to the same server """
+
+    def __init__(self, path):
+        self.path = str(path)
+        self.reader = None
+        self.writer = None
+        self.reading = None
+        self.ids = itertools.count()
+        # call id => future waiting for the result
+        self.pending = {}
+
+    async def connect(self):
+        self.reader, self.writer = await asyncio.open_unix_connection(
+            self.path)
+        self.reading = asyncio.ensure_future(self.read_responses())
+
+    @property
+    def closed(self):
+        return self.reading is None or self.reading.done()
+
+    async def read_responses(self):
+        error = ConnectionClosed('Connection to {} lost'.format(self.path))
+        try:
+            while True:
+                message = await read_frame(self.reader)
+                if message is None:
+                    break
+                kind, call_id, remote_error, result = message
+                future = self.pending.pop(call_id, None)
+                # The call may have timed out already
+                if future is None or future.done():
+                    continue
+                if remote_error is not None:
+                    future.set_exception(RemoteError(*remote_error))
+                else:
+                    future.set_result(result)
+        except asyncio.CancelledError:
+            pass
+        except Exception as e:
+            error = e
+            log.exception('Error while reading RPC responses from %s',
+                          self.path)
+        finally:
+            self.writer.close()
+            for future in self.pending.values():
+                if not future.done():
+                    future.set_exception(error)
+            self.pending.clear()
+
+    async def call(self, name, args, kwargs, timeout=None):
+        if self.closed:
+            raise ConnectionClosed('Connection to {} closed'.format(self.path))
+        call_id = next(self.ids)
+        future = asyncio.Future()
+        self.pending[call_id] = future
+        self.writer.write(pack([REQUEST, call_id, name, args, kwargs]))
+        try:
+            await self.writer.drain()
+            return await asyncio.wait_for(future, timeout)
+        finally:
+            self.pending.pop(call_id, None)
+
+    async def close(self):
+        if self.reading is not None:
+            self.reading.cancel()
+            await asyncio.gather(self.reading, return_exceptions=True)
+
+
+class RpcComponent(Component):
+    """
+    Expose coroutines to the other processes of the app.
+
+    Each process exposing functions listens on "<directory>/<worker
+    id>.sock" (or "main.sock" outside of the workers) between the "ready"
+    and "stop" events. Then,
+    in any process, "await rpc.call(target, 'name', *args, **kwargs)" runs
+    the function registered with @rpc.expose, target being a worker id or
+    a socket path.
+
+    Arguments and results must be serializable with msgpack, or JSON if it
+    isn't installed. Calls time out after "timeout" seconds by default.
+
+    The directory is only accessible by the current user. Starting fails if
+    another process already listens on the socket, like another app with
+    the same namespace on the same host.
+    """
+
+    def __init__(self, app, directory=None, timeout=10):
+        super().__init__(app)
+        if directory is None:
+            directory = Path(tempfile.gettempdir()) / 'tygs-{}-rpc'.format(
+                app.ns)
+        self.directory = Path(directory)
+        self.timeout = timeout
+        self.functions = {}
+        # socket path => RpcConnection
+        self.connections = {}
+        self.connecting = {}
+        self.server = None
+        self.path = None
+        self.handlers = set()
+
+    @inline
+    def setup(self):
+        self.app.register('ready', self.start)
+        self.app.register('stop', self.stop)
+
+    def expose(self, func=None, *, name=None):
+        """ Decorator to make a function callable from other processes """
+        if func is None:
+            return lambda func: self.expose(func, name=name)
+        self.functions[name or func.__name__] = func
+        return func
+
+    def get_path(self, target):
+        if isinstance(target, int):
+            return self.directory / '{}.sock'.format(target)
+        return Path(target)
+
+    async def start(self):
+        if not self.functions:
+            return
+        worker_id = self.app.worker_id
+        if worker_id is None:
+            self.path = self.directory / 'main.sock'
+        else:
+            self.path = self.get_path(worker_id)
+        self.prepare_directory()
+        if self.path.exists():
+            await self.remove_stale_socket()
+        self.server = await asyncio.start_unix_server(self.handle_connection,
+                                                      str(self.path))
+
+    def prepare_directory(self):
+        # Anybody able to write in it could take the sockets over
+        self.directory.makedirs_p(mode=0o700)
+        stat = self.directory.lstat()
+        if stat.st_uid != os.getuid():
+            raise PermissionError('{} belongs to another user'.format(
+                self.directory))
+        if stat.st_mode & 0o077:
+            self.directory.chmod(0o700)
+
+    async def remove_stale_socket(self):
+        """ Remove the socket left by a process that didn't stop cleanly """
+        try:
+            reader, writer = await asyncio.open_unix_connection(
+                str(self.path))
+        except (ConnectionRefusedError, FileNotFoundError):
+            self.path.remove_p()
+            return
+        writer.close()
+        raise OSError(errno.EADDRINUSE, 'Another process listens on the RPC '
+                      'socket', str(self.path))
+
+    async def stop(self):
+        if self.server is not None:
+            self.server.close()
+            for handler in list(self.handlers):
+                handler.cancel()
+            await self.server.wait_closed()
+            self.server = None
+            try:
+                os.remove(str(self.path))
+            except FileNotFoundError:
+                pass
+
+        connections = list(self.connections.values())
+        self.connections.clear()
+        for connection in connections:
+            await connection.close()
+
+    async def handle_connection(self, reader, writer):
+        handler = asyncio.Task.current_task()
+        self.handlers.add(handler)
+        running = set()
+        try:
+            while True:
+                message = await read_frame(reader)
+                if message is None:
+                    break
+                # Run the calls concurrently, the responses are sent in the
+                # order they are ready
+                task = asyncio.ensure_future(self.dispatch(message, writer))
+                running.add(task)
+                task.add_done_callback(running.discard)
+        except asyncio.CancelledError:
+            pass
+        except Exception:
+            log.exception('Invalid RPC request')
+        finally:
+            for task in running:
+                task.cancel()
+            writer.close()
+            self.handlers.discard(handler)
+
+    async def dispatch(self, message, writer):
+        kind, call_id, name, args, kwargs = message
+        error = result = None
+        try:
+            func = self.functions[name]
+        except KeyError:
+            error = ['LookupError', 'Unknown RPC function: {!r}'.format(name)]
+        else:
+            try:
+                result = func(*args, **kwargs)
+                if inspect.isawaitable(result):
+                    result = await result
+            except Exception as e:
+                error = [type(e).__name__, str(e)]
+        try:
+            frame = pack([RESPONSE, call_id, error, result])
+        except Exception as e:
+            # Don't let the caller wait until the timeout
+            message = "Can't serialize the result of {!r}: {}".format(name, e)
+            frame = pack([RESPONSE, call_id, [type(e).__name__, message],
+                          None])
+        writer.write(frame)
+
+    async def get_connection(self, path):
+        path = str(path)
+        connection = self.connections.get(path)
+        if connection is not None and not connection.closed:
+            return connection
+
+        # Only connect once if several calls start at the same time
+        connecting = self.connecting.get(path)
+        if connecting is None:
+            connection = RpcConnection(path)
+            connecting = asyncio.ensure_future(connection.connect())
+            self.connecting[path] = connecting
+            try:
+                await connecting
+            finally:
+                del self.connecting[path]
+            self.connections[path] = connection
+            return connection
+
+        await asyncio.shield(connecting)
+        return self.connections[path]
+
+    async def call(self, target, name, *args, timeout=None, **kwargs):
+        """ Call the function exposed under this name by the target """
+        connection = await self.get_connection(self.get_path(target))
+        if timeout is None:
+            timeout = self.timeout
+        return await connection.call(name, args, kwargs, timeout)
@@ -0,0 +1,50 @@
+"""
+JSON encoding and decoding using the fastest library available.
+
+orjson is used if it's installed, then ujson, then the stdlib json module.
+They are all optional, and dumps() always returns UTF-8 encoded bytes,
+ready to be written to the socket.
+"""
+
+import json
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover
+    orjson = None
+
+try:
+    import ujson
+except ImportError:  # pragma: no cover
+    ujson = None
+
+
+def stdlib_dumps(data):
+    # Pure ASCII output is faster to produce and encode with the stdlib
+    return json.dumps(data, separators=(',', ':')).encode('ascii')
+
+
+def stdlib_loads(data):
+    if isinstance(data, (bytes, bytearray)):
+        data = data.decode('utf8')
+    return json.loads(data)
+
+
+def ujson_dumps(data):
+    return ujson.dumps(data, ensure_ascii=False).encode('utf8')
+
+
+# The name of the library used, then the encoder and the decoder. Each
+# encoder takes Python data and returns bytes.
+if orjson is not None:  # pragma: no cover
+    JSON_BACKEND = 'orjson'
+    dumps = orjson.dumps
+    loads = orjson.loads
+elif ujson is not None:  # pragma: no cover
+    JSON_BACKEND = 'ujson'
+    dumps = ujson_dumps
+    loads = ujson.loads
+else:  # pragma: no cover
+    JSON_BACKEND = 'json'
+    dumps = stdlib_dumps
+    loads = stdlib_loads
@@ -0,0 +1,448 @@
+import os
+import time
+import uuid
+import asyncio
+import inspect
+import logging
+import sqlite3
+
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+from path import Path
+
+from . import serializers
+from .components import Component
+from .utils import inline
+
+
+log = logging.getLogger(__name__)
+
+
+class TaskDefinition:
+
+    def __init__(self, func, name, queue='default', retries=0, backoff=1.0,
+                 max_backoff=300):
+        self.func = func
+        self.name = name
+        self.queue = queue
+        # Number of times we try again after the first failure
+        self.retries = retries
+        # Seconds to wait before the first retry, doubled for each retry
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+
+    def get_delay(self, attempts):
+        return min(self.backoff * 2 ** (attempts - 1), self.max_backoff)
+
+
+class Job:
+
+    __slots__ = ('id', 'task', 'queue', 'args', 'kwargs', 'attempts',
+                 'run_at')
+
+    def __init__(self, task, queue, args=(), kwargs=None, id=None,
+                 attempts=0, run_at=None):
+        self.id = id or uuid.uuid4().hex
+        self.task = task
+        self.queue = queue
+        self.args = list(args)
+        self.kwargs = kwargs or {}
+        # Number of failed attempts so far
+        self.attempts = attempts
+        # time.time() before which the job must not run, for retries
+        self.run_at = run_at or 0
+
+    def __repr__(self):
+        return "<Job {} {} attempts={}>".format(self.task, self.id,
+                                                self.attempts)
+
+
+class MemoryBackend:
+    """ Jobs only live in the process, and are lost when it stops """
+
+    durable = False
+
+    async def open(self):
+        pass
+
+    async def load(self):
+        return []
+
+    async def add(self, job):
+        pass
+
+    async def update(self, job):
+        pass
+
+    async def done(self, job):
+        pass
+
+    async def fail(self, job, error):
+        pass
+
+    async def release(self, jobs):
+        pass
+
+    async def close(self):
+        pass
+
+
+class SQLiteBackend:
+    """
+    Store the jobs in a SQLite file so they survive a restart. The jobs that
+    are not done when the app stops run again on the next start.
+
+    SQLite calls are blocking, so they run in a single thread. Several
+    processes can share the file: each process only loads the jobs nobody
+    else owns, or that belong to dead processes.
+    """
+
+    durable = True
+
+    def __init__(self, path):
+        self.path = Path(path)
+        self.owner = os.getpid()
+        self.executor = None
+        self.connection = None
+
+    def run(self, func, *args):
+        loop = asyncio.get_event_loop()
+        return loop.run_in_executor(self.executor, func, *args)
+
+    async def open(self):
+        if self.executor is None:
+            # One thread, so the calls are serialized
+            self.executor = ThreadPoolExecutor(1)
+            await self.run(self._open)
+
+    def _open(self):
+        self.path.parent.makedirs_p()
+        self.connection = sqlite3.connect(str(self.path), timeout=30,
+                                          check_same_thread=False,
+                                          isolation_level=None)
+        self.connection.execute('PRAGMA journal_mode=WAL')
+        self.connection.execute("""
+            CREATE TABLE IF NOT EXISTS jobs (
+                id TEXT PRIMARY KEY,
+                task TEXT NOT NULL,
+                queue TEXT NOT NULL,
+                payload BLOB NOT NULL,
+                attempts INTEGER NOT NULL DEFAULT 0,
+                run_at REAL NOT NULL DEFAULT 0,
+                status TEXT NOT NULL DEFAULT 'pending',
+                owner INTEGER,
+                error TEXT
+            )
+        """)
+
+    def _is_alive(self, pid):
+        if pid == self.owner:
+            return True
+        try:
+            os.kill(pid, 0)
+        except ProcessLookupError:
+            return False
+        except PermissionError:
+            pass
+        return True
+
+    async def load(self):
+        return await self.run(self._load)
+
+    def _load(self):
+        db = self.connection
+        db.execute('BEGIN IMMEDIATE')
+        try:
+            rows = db.execute("""
+                SELECT id, task, queue, payload, attempts, run_at, owner
+                FROM jobs WHERE status = 'pending'
+            """).fetchall()
+            jobs = []
+            for id, task, queue, payload, attempts, run_at, owner in rows:
+                if owner is not None and self._is_alive(owner):
+                    continue
+                args, kwargs = serializers.loads(payload)
+                jobs.append(Job(task, queue, args, kwargs, id, attempts,
+                                run_at))
+            db.executemany('UPDATE jobs SET owner = ? WHERE id = ?',
+                           [(self.owner, job.id) for job in jobs])
+        except BaseException:
+            db.execute('ROLLBACK')
+            raise
+        db.execute('COMMIT')
+        return jobs
+
+    async def add(self, job):
+        payload = serializers.dumps([job.args, job.kwargs])
+        await self.run(self.connection.execute, """
+            INSERT INTO jobs (id, task, queue, payload, attempts, run_at,
+                              owner)
+            VALUES (?, ?, ?, ?, ?, ?, ?)
+        """, (job.id, job.task, job.queue, payload, job.attempts,
+              job.run_at, self.owner))
+
+    async def update(self, job):
+        await self.run(self.connection.execute,
+                       'UPDATE jobs SET attempts = ?, run_at = ? WHERE id = ?',
+                       (job.attempts, job.run_at, job.id))
+
+    async def done(self, job):
+        await self.run(self.connection.execute,
+                       'DELETE FROM jobs WHERE id = ?', (job.id,))
+
+    async def fail(self, job, error):
+        # Kept for inspection, but never loaded again
+        await self.run(self.connection.execute, """
+            UPDATE jobs SET status = 'failed', attempts = ?, error = ?
+            WHERE id = ?
+        """, (job.attempts, repr(error), job.id))
+
+    async def release(self, jobs):
+        """ Let another process run these jobs """
+        await self.run(self.connection.executemany,
+                       'UPDATE jobs SET owner = NULL WHERE id = ?',
+                       [(job.id,) for job in jobs])
+
+    async def close(self):
+        if self.executor is not None:
+            await self.run(self.connection.close)
+            self.executor.shutdown()
+            self.executor = None
+            self.connection = None
+
+
+class TaskComponent(Component):
+    """
+    Run functions in the background. Like the event handlers, regular
+    functions run in the thread pool of the app unless they are marked with
+    @tygs.utils.inline, and coroutine functions run on the loop.
+
+    Register them with @app.task, then "await app.enqueue(func, *args)" to
+    run them as soon as a consumer is free. There are "consumers" jobs
+    running at the same time at most, and no more than limits[queue] for
+    each queue listed in limits.
+
+    Failed jobs are retried with an exponential backoff if the task has
+    retries. With a durable backend, like SQLiteBackend, the jobs are saved
+    until they are done.
+
+    On "stop", we wait up to stop_timeout seconds for the running jobs to
+    finish. The pending jobs are run too, unless the backend is durable,
+    in which case they are left for the next start.
+    """
+
+    def __init__(self, app, consumers=4, backend=None, limits=None,
+                 stop_timeout=10):
+        super().__init__(app)
+        self.consumers_count = consumers
+        self.backend = backend or MemoryBackend()
+        self.limits = dict(limits or {})
+        self.stop_timeout = stop_timeout
+        self.tasks = {}
+        # queue => jobs ready to run
+        self.pending = {}
+        # queue => number of running jobs
+        self.running = {}
+        # job id => (job, timer handle), for the retries
+        self.delayed = {}
+        self.in_progress = {}
+        self.consumers = []
+        self.available = None
+        # Set on "stop" once the jobs we wait for are done
+        self.drained = None
+        self.state = "pristine"
+        self.stats = {'enqueued': 0, 'done': 0, 'retried': 0, 'failed': 0}
+
+    @inline
+    def setup(self):
+        self.app.register('ready', self.start)
+        self.app.register('stop', self.stop)
+
+    def task(self, func=None, *, name=None, queue='default', retries=0,
+             backoff=1.0, max_backoff=300):
+        """ Decorator to register a function as a task """
+        if func is None:
+            def decorator(func):
+                return self.task(func, name=name, queue=queue,
+                                 retries=retries, backoff=backoff,
+                                 max_backoff=max_backoff)
+            return decorator
+
+        name = name or "{}.{}".format(func.__module__, func.__qualname__)
+        self.tasks[name] = TaskDefinition(func, name, queue, retries,
+                                          backoff, max_backoff)
+        func.task_name = name
+        return func
+
+    def get_task(self, task):
+        name = getattr(task, 'task_name', task)
+        try:
+            return self.tasks[name]
+        except KeyError:
+            raise ValueError('Unknown task: {!r}. Register it with '
+                             '@app.task first.'.format(name))
+
+    async def enqueue(self, task, *args, **kwargs):
+        """ Schedule the task to run with these arguments. Return the id. """
+        if self.state in ('stopping', 'stop'):
+            raise RuntimeError("Can't enqueue a job when the app is stopping")
+
+        definition = self.get_task(task)
+        job = Job(definition.name, definition.queue, args, kwargs)
+        await self.backend.open()
+        await self.backend.add(job)
+        self.stats['enqueued'] += 1
+        self.schedule(job)
+        return job.id
+
+    def schedule(self, job):
+        delay = job.run_at - time.time()
+        if delay > 0:
+            loop = asyncio.get_event_loop()
+            handle = loop.call_later(delay, self.make_ready, job)
+            self.delayed[job.id] = (job, handle)
+        else:
+            self.make_ready(job)
+
+    def make_ready(self, job):
+        self.delayed.pop(job.id, None)
+        self.pending.setdefault(job.queue, deque()).append(job)
+        self.notify()
+
+    def notify(self):
+        if self.available is not None:
+            self.available.set()
+
+    def take(self):
+        """ Return the next job of a queue under its limit, or None """
+        if self.state != "running" and self.backend.durable:
+            return None
+        for queue, jobs in self.pending.items():
+            if not jobs:
+                continue
+            limit = self.limits.get(queue)
+            if limit is not None and self.running.get(queue, 0) >= limit:
+                continue
+            return jobs.popleft()
+        return None
+
+    async def start(self):
+        await self.backend.open()
+        for job in await self.backend.load():
+            self.schedule(job)
+        self.available = asyncio.Event()
+        self.state = "running"
+        self.consumers = [asyncio.ensure_future(self.consume())
+                          for _ in range(self.consumers_count)]
+
+    async def consume(self):
+        while True:
+            job = self.take()
+            if job is None:
+                self.available.clear()
+                await self.available.wait()
+                continue
+
+            self.running[job.queue] = self.running.get(job.queue, 0) + 1
+            self.in_progress[job.id] = job
+            try:
+                await self.run_job(job)
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                # E.G: the backend can't save the job status. Keep the
+                # consumer alive for the next jobs.
+                log.exception('Error while running %r', job)
+            finally:
+                self.running[job.queue] -= 1
+                self.in_progress.pop(job.id, None)
+                # A slot is free in this queue
+                self.notify()
+                self.check_drained()
+
+    async def run_job(self, job):
+        definition = self.tasks.get(job.task)
+        if definition is None:
+            log.error('Unknown task %r for %r', job.task, job)
+            await self.backend.fail(job, 'Unknown task')
+            self.stats['failed'] += 1
+            return
+
+        func = self.app.components['threads'].wrap(definition.func)
+        try:
+            result = func(*job.args, **job.kwargs)
+            if inspect.isawaitable(result):
+                await result
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            await self.on_job_error(job, definition, e)
+        else:
+            await self.backend.done(job)
+            self.stats['done'] += 1
+
+    async def on_job_error(self, job, definition, error):
+        job.attempts += 1
+        if job.attempts > definition.retries:
+            log.exception('%r failed', job)
+            await self.backend.fail(job, error)
+            self.stats['failed'] += 1
+            return
+
+        delay = definition.get_delay(job.attempts)
+        log.warning('%r failed, retrying in %ss: %r', job, delay, error)
+        job.run_at = time.time() + delay
+        await self.backend.update(job)
+        self.stats['retried'] += 1
+        self.schedule(job)
+
+    def is_idle(self):
+        return not self.in_progress and not any(self.pending.values())
+
+    def check_drained(self):
+        # With a durable backend, the consumers don't take new jobs
+        # anymore, we just wait for the running ones. Otherwise we run all
+        # the jobs we have.
+        if self.drained is not None and not self.in_progress and \
+           (self.backend.durable or self.is_idle()):
+            self.drained.set()
+
+    async def stop(self):
+        if self.state != "running":
+            await self.backend.close()
+            return
+        self.state = "stopping"
+
+        self.drained = asyncio.Event()
+        self.check_drained()
+        try:
+            await asyncio.wait_for(self.drained.wait(), self.stop_timeout)
+        except asyncio.TimeoutError:
+            pass
+        self.drained = None
+
+        # The consumers forget the jobs they're cancelled in
+        left = list(self.in_progress.values())
+        for consumer in self.consumers:
+            consumer.cancel()
+        await asyncio.gather(*self.consumers, return_exceptions=True)
+        self.consumers = []
+
+        for jobs in self.pending.values():
+            left.extend(jobs)
+        for job, handle in self.delayed.values():
+            handle.cancel()
+            left.append(job)
+
+        if left:
+            if self.backend.durable:
+                await self.backend.release(left)
+            else:
+                log.warning('%s jobs lost on stop', len(left))
+
+        self.pending.clear()
+        self.delayed.clear()
+        self.in_progress.clear()
+        await self.backend.close()
+        self.state = "stop"
@@ -0,0 +1,106 @@
+import os
+import time
+import asyncio
+
+from functools import partial, wraps
+from concurrent.futures import ThreadPoolExecutor
+
+from .components import Component
+from .utils import is_inline, is_coroutine_function
+
+
+class ThreadPoolComponent(Component):
+    """
+    Run the blocking functions, such as the regular (not async) handlers,
+    in a pool of threads so they don't stop the loop.
+
+    max_workers is the number of threads. max_queued is how many calls can
+    wait for a free thread: beyond that, run() waits on the loop before
+    submitting the call, so the callers slow down instead of queuing
+    forever. None means no limit. Both can be changed until the first call.
+
+    The pool is created on first use, so forked workers don't inherit
+    threads from the master, and shut down by App.async_stop() once the
+    "stop" handlers, some of which may run in it, are done.
+    """
+
+    def __init__(self, app, max_workers=None, max_queued=None):
+        super().__init__(app)
+        self.max_workers = max_workers or min(32, (os.cpu_count() or 1) + 4)
+        self.max_queued = max_queued
+        self.executor = None
+        self.slots = None
+        self.stats = {'calls': 0, 'in_flight': 0, 'max_in_flight': 0,
+                      'waiting': 0, 'queue_time': 0.0, 'run_time': 0.0}
+
+    def get_executor(self):
+        if self.executor is None:
+            self.executor = ThreadPoolExecutor(self.max_workers)
+            if self.max_queued is not None:
+                self.slots = asyncio.Semaphore(self.max_workers +
+                                               self.max_queued)
+        return self.executor
+
+    async def run(self, func, *args, **kwargs):
+        """ Call func in a thread and return its result """
+        executor = self.get_executor()
+        stats = self.stats
+
+        if self.slots is not None:
+            if self.slots.locked():
+                stats['waiting'] += 1
+                try:
+                    await self.slots.acquire()
+                finally:
+                    stats['waiting'] -= 1
+            else:
+                await self.slots.acquire()
+
+        stats['in_flight'] += 1
+        if stats['in_flight'] > stats['max_in_flight']:
+            stats['max_in_flight'] = stats['in_flight']
+        try:
+            loop = asyncio.get_event_loop()
+            call = partial(timed_call, time.perf_counter(), func, args,
+                           kwargs)
+            result, queue_time, run_time = await loop.run_in_executor(
+                executor, call)
+        finally:
+            stats['calls'] += 1
+            stats['in_flight'] -= 1
+            if self.slots is not None:
+                self.slots.release()
+
+        stats['queue_time'] += queue_time
+        stats['run_time'] += run_time
+        return result
+
+    def wrap(self, func):
+        """
+        Return a coroutine function calling func in a thread, or func itself
+        if it's already a coroutine function or marked with @inline.
+        """
+        if is_coroutine_function(func) or is_inline(func):
+            return func
+
+        @wraps(func)
+        async def run_in_thread(*args, **kwargs):
+            return await self.run(func, *args, **kwargs)
+
+        return run_in_thread
+
+    async def shutdown(self):
+        # Let the running calls finish so their results are not lost, but
+        # wait for them in another thread so the loop is not blocked
+        executor = self.executor
+        self.executor = self.slots = None
+        if executor is not None:
+            loop = asyncio.get_event_loop()
+            await loop.run_in_executor(None, executor.shutdown)
+
+
+def timed_call(submitted, func, args, kwargs):
+    """ Run in the thread: return the result and how long it waited/ran """
+    started = time.perf_counter()
+    result = func(*args, **kwargs)
+    return result, started - submitted, time.perf_counter() - started
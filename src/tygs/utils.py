@@ -4,13 +4,41 @@ import asyncio
 import inspect
 import contextlib
 
+from textwrap import dedent
+
 from path import Path
 
+try:
+    import uvloop
+except ImportError:  # pragma: no cover
+    uvloop = None
+
 
 def get_project_dir():
     return (Path(os.getcwd()) / sys.argv[0]).realpath().parent
 
 
+def is_coroutine_function(callable_obj):
+    """ True for coroutine functions and objects with such a __call__ """
+    if asyncio.iscoroutinefunction(callable_obj):
+        return True
+    return hasattr(callable_obj, '__call__') and \
+        asyncio.iscoroutinefunction(callable_obj.__call__)
+
+
+def inline(func):
+    """
+    Mark a regular function as cheap enough to be called on the loop.
+    Otherwise the regular handlers are called in the thread pool.
+    """
+    func.tygs_inline = True
+    return func
+
+
+def is_inline(callable_obj):
+    return getattr(callable_obj, 'tygs_inline', False)
+
+
 def ensure_coroutine(callable_obj):
     if not callable(callable_obj):
         raise TypeError("callable_obj must be an coroutine or a callable. "
@@ -42,8 +70,42 @@ def ensure_awaitable(callable_obj):
     return callable_obj
 
 
-def aioloop():
-    """ Ensure there is an opened event loop available and return it"""
+def get_loop_policy(name):
+    """
+    Return the event loop policy for this loop name:
+
+    - "asyncio": the default asyncio loop;
+    - "uvloop": uvloop, which must be installed;
+    - "auto": uvloop if it's installed, asyncio otherwise.
+    """
+    if name == 'auto':
+        name = 'asyncio' if uvloop is None else 'uvloop'
+
+    if name == 'asyncio':
+        return asyncio.DefaultEventLoopPolicy()
+
+    if name == 'uvloop':
+        if uvloop is None:
+            raise RuntimeError(dedent("""
+                uvloop is not installed. Install it with "pip install
+                uvloop", or use loop="auto" to use it only when it's
+                available.
+            """))
+        return uvloop.EventLoopPolicy()
+
+    raise ValueError('Unknown loop {!r}. Use "asyncio", "uvloop" or '
+                     '"auto"'.format(name))
+
+
+def aioloop(loop=None):
+    """
+    Ensure there is an opened event loop available and return it.
+
+    If loop is "asyncio", "uvloop" or "auto", install the matching event
+    loop policy first. See get_loop_policy().
+    """
+    if loop is not None:
+        asyncio.set_event_loop_policy(get_loop_policy(loop))
     policy = asyncio.get_event_loop_policy()
     loop = policy.new_event_loop()
     policy.set_event_loop(loop)
@@ -81,9 +143,15 @@ class DebugException(BaseException):
         loop = app.loop
         old_factory = loop.get_task_factory() or asyncio.Task
 
+        def on_done(task):
+            if not task.cancelled() and task.exception() is not None:
+                app.break_loop_with_error(task.exception())
+
         def factory(loop, coro):
             task = old_factory(loop=loop, coro=coro)
-            task.set_exception = app.break_loop_with_error
+            # Overriding task.set_exception() doesn't work with the C tasks
+            # of Python 3.6+ or the uvloop ones, which never call it
+            task.add_done_callback(on_done)
             return task
 
         return factory
@@ -91,10 +159,12 @@ class DebugException(BaseException):
 
 @contextlib.contextmanager
 def silence_loop_error_log(loop):
-    old_handler = loop._exception_handler
+    old_handler = loop.get_exception_handler()
     loop.set_exception_handler(lambda loop, context: None)
-    yield
-    loop.set_exception_handler(old_handler)
+    try:
+        yield
+    finally:
+        loop.set_exception_handler(old_handler)
 
 
 HTTP_VERBS = (
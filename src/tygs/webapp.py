@@ -1,4 +1,6 @@
 
+import asyncio
+
 from aiohttp.web import Application
 
 from .app import App
@@ -7,7 +9,12 @@ from .components import (HttpComponent,
                          aiohttp_request_handler_factory_adapter_factory as rh,
                          Jinja2Renderer)
 
-from .http.server import Server
+from .metrics import MetricsComponent
+from .profiler import RequestProfiler
+from .access_log import AccessLogComponent
+from .http.server import Server, remove_unix_sockets
+from .workers import Supervisor
+from .utils import get_loop_policy
 
 # TODO: create a dev mode with debug activated
 
@@ -15,25 +22,73 @@ from .http.server import Server
 class WebApp(App):
 
     def __init__(self, *args, factory_adapter=rh, server_class=Server,
+                 route_cache_size=0, max_body_size=None, host=None,
+                 port=None, backlog=128, reuse_port=False, unix=None,
+                 sock=None, metrics=False, profile_every=100, access_log=None,
                  **kwargs):
         super().__init__(*args, **kwargs)
-        self.components['http'] = HttpComponent(self)
+        self.components['http'] = HttpComponent(
+            self, route_cache_size=route_cache_size,
+            max_body_size=max_body_size)
         self.components['templates'] = Jinja2Renderer(self)
+        self.components['metrics'] = MetricsComponent(self)
+        # Off until SIGUSR2 or profiler.enable()
+        self.components['profiler'] = RequestProfiler(self,
+                                                      every=profile_every)
+        # True to serve the metrics on "/metrics", or another URL
+        if metrics:
+            url = '/metrics' if metrics is True else metrics
+            self.components['metrics'].expose(url)
+        # True for stderr, or a file path
+        self.components['access_log'] = AccessLogComponent(self)
+        if access_log:
+            self.components['access_log'].enable(access_log)
         self.server_class = server_class
         self.http_server = None
+        # Passed to the server_class. See Server for the details.
+        self.server_options = {'host': host, 'port': port,
+                               'backlog': backlog, 'reuse_port': reuse_port,
+                               'unix': unix, 'sock': sock}
 
         self._aiohttp_app = Application(
             handler_factory=factory_adapter(self)
         )
 
     async def async_ready(self, cwd=None):
-        self.http_server = self.server_class(self)
+        self.http_server = self.server_class(self, **self.server_options)
         self.register('ready', self.http_server.start)
         return await super().async_ready(cwd)
         # TODO: start the aiohttp server, for now
         # TODO: implement
         # https://github.com/KeepSafe/aiohttp/blob/master/aiohttp/web_urldispatcher.py#L392
 
+    def ready(self, cwd=None, force_new_loop=False, loop=None, workers=0):
+        """
+        Start the app. If workers is set, fork this number of processes,
+        each running the app and sharing the same listening sockets.
+
+        loop can be "asyncio", "uvloop" or "auto", see App.ready().
+        """
+        if not workers:
+            return super().ready(cwd, force_new_loop, loop)
+
+        # The workers create their loop with this policy
+        if loop is not None:
+            asyncio.set_event_loop_policy(get_loop_policy(loop))
+
+        # Bound in the master so that the workers inherit them, and so that
+        # they keep accepting connections while a worker is restarted.
+        options = self.server_options
+        sockets = self.server_class.bind_sockets(**options)
+        self.server_options = {'sock': sockets, 'backlog': options['backlog']}
+        try:
+            Supervisor(self, workers, cwd).run()
+        finally:
+            self.server_options = options
+            for sock in sockets:
+                sock.close()
+            remove_unix_sockets(options['unix'])
+
     @classmethod
     def quickstart(cls, ns):
         app = cls(ns)
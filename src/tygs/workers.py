@@ -0,0 +1,112 @@
+import os
+import sys
+import time
+import signal
+import logging
+import traceback
+
+
+log = logging.getLogger(__name__)
+
+
+class Supervisor:
+    """
+    Pre-fork model: run the app in several worker processes, each with its
+    own event loop, so we can use more than one core.
+
+    The master process doesn't run any loop. It just restarts the workers
+    that die, sends them SIGTERM when it's asked to stop, and forwards them
+    SIGUSR2, which toggles the profiler. In a worker, the app goes through
+    the usual ready() => stop() lifecycle.
+    """
+
+    def __init__(self, app, workers, cwd=None, restart_delay=1.0):
+        if workers < 1:
+            raise ValueError('You need at least one worker')
+        self.app = app
+        self.workers_count = workers
+        self.cwd = cwd
+        # Wait this long before restarting a worker that died right away, so
+        # we don't fork in a loop if the app can't start
+        self.restart_delay = restart_delay
+        self.workers = {}  # pid => (worker id, start time)
+        self.state = "pristine"
+
+    def run(self):
+        self.state = "running"
+
+        old_handlers = {}
+        for signum in (signal.SIGINT, signal.SIGTERM):
+            old_handlers[signum] = signal.signal(signum, self.stop)
+        old_handlers[signal.SIGUSR2] = signal.signal(signal.SIGUSR2,
+                                                     self.forward_signal)
+
+        try:
+            for worker_id in range(self.workers_count):
+                self.spawn(worker_id)
+
+            while self.workers:
+                try:
+                    pid, status = os.wait()
+                except ChildProcessError:
+                    break
+
+                self.on_worker_exit(pid, status)
+        finally:
+            for signum, handler in old_handlers.items():
+                signal.signal(signum, handler)
+            self.state = "stop"
+
+    def on_worker_exit(self, pid, status):
+        try:
+            worker_id, started = self.workers.pop(pid)
+        except KeyError:
+            return
+
+        if self.state != "running":
+            return
+
+        log.warning('Worker %s (pid %s) exited with status %s, restarting it',
+                    worker_id, pid, status)
+
+        if time.monotonic() - started < self.restart_delay:
+            time.sleep(self.restart_delay)
+
+        self.spawn(worker_id)
+
+    def spawn(self, worker_id):
+        pid = os.fork()
+        if pid:
+            self.workers[pid] = (worker_id, time.monotonic())
+            return pid
+
+        # In the worker from here
+        exit_code = 0
+        try:
+            for signum in (signal.SIGINT, signal.SIGTERM, signal.SIGUSR2):
+                signal.signal(signum, signal.SIG_DFL)
+            self.app.worker_id = worker_id
+            self.run_worker()
+        except BaseException:
+            traceback.print_exc()
+            exit_code = 1
+        finally:
+            sys.stdout.flush()
+            sys.stderr.flush()
+            # Never go back in the master code
+            os._exit(exit_code)
+
+    def run_worker(self):
+        # The master loop must not be shared between processes
+        self.app.ready(self.cwd, force_new_loop=True)
+
+    def stop(self, signum=None, frame=None):
+        self.state = "stopping"
+        self.forward_signal(signal.SIGTERM)
+
+    def forward_signal(self, signum, frame=None):
+        for pid in list(self.workers):
+            try:
+                os.kill(pid, signum)
+            except ProcessLookupError:
+                pass
@@ -0,0 +1,184 @@
+import time
+import asyncio
+
+from unittest.mock import Mock, patch
+
+import pytest
+import aiohttp
+
+from tygs.access_log import AccessLogComponent, format_record
+from tygs.webapp import WebApp
+
+
+def make_record(status=200):
+    return (0, '127.0.0.1', 'GET', '/path?q=1', (1, 1), status, 42, 0.0015,
+            None, 'curl/7.0')
+
+
+def fake_request():
+    transport = Mock()
+    transport.get_extra_info.return_value = ('127.0.0.1', 12345)
+    message = Mock(method='GET', path='/', version=(1, 1),
+                   headers={'USER-AGENT': 'test'})
+    return transport, message
+
+
+def test_format_record():
+    assert format_record(make_record()) == (
+        '127.0.0.1 - - [01/Jan/1970:00:00:00 +0000] "GET /path?q=1 HTTP/1.1" '
+        '200 42 "-" "curl/7.0" 0.001500\n')
+
+
+def test_webapp_access_log_option():
+    app = WebApp('namespace')
+    assert not app.components['access_log'].enabled
+    app = WebApp('namespace', access_log='access.log')
+    assert app.components['access_log'].enabled
+    assert app.components['access_log'].path == 'access.log'
+
+
+def test_buffer_overflow(app, tmpdir):
+    access_log = AccessLogComponent(app, path=str(tmpdir.join('access.log')),
+                                    buffer_size=2)
+    access_log.enable()
+    for _ in range(3):
+        access_log.record(*fake_request(), 200, 10, 0.01)
+    assert len(access_log.buffer) == 2
+    assert access_log.dropped == 1
+
+
+def test_batched_writes(app, tmpdir):
+    path = tmpdir.join('access-{worker}.log')
+    app.worker_id = 3
+    access_log = AccessLogComponent(app, path=str(path), flush_interval=0.01)
+    access_log.enable()
+    access_log.start()
+    try:
+        for _ in range(5):
+            access_log.record(*fake_request(), 200, 10, 0.01)
+        time.sleep(0.05)
+        assert access_log.written == 5
+        access_log.record(*fake_request(), 404, 10, 0.01)
+    finally:
+        access_log.stop()
+
+    lines = tmpdir.join('access-3.log').read().splitlines()
+    assert len(lines) == 6
+    assert '"GET / HTTP/1.1" 404 10 "-" "test"' in lines[-1]
+    assert access_log.thread is None
+
+
+def test_rotation(app, tmpdir):
+    path = tmpdir.join('access.log')
+    line_size = len(format_record(make_record()))
+    access_log = AccessLogComponent(app, path=str(path),
+                                    max_bytes=line_size * 2, backup_count=2)
+    access_log.open()
+    try:
+        for status in range(200, 207):
+            access_log.buffer.append(make_record(status))
+            access_log.flush()
+    finally:
+        access_log.close()
+
+    assert ' 206 ' in path.read()
+    assert ' 204 ' in tmpdir.join('access.log.1').read()
+    assert ' 202 ' in tmpdir.join('access.log.2').read()
+    assert not tmpdir.join('access.log.3').exists()
+
+
+def test_rotation_counts_bytes(app, tmpdir):
+    path = tmpdir.join('access.log')
+    record = make_record()[:-1] + ('é' * 100,)
+    line_size = len(format_record(record).encode('utf8'))
+    access_log = AccessLogComponent(app, path=str(path),
+                                    max_bytes=line_size * 2 - 1)
+    access_log.open()
+    try:
+        for _ in range(2):
+            access_log.buffer.append(record)
+            access_log.flush()
+    finally:
+        access_log.close()
+
+    assert path.size() == line_size
+    assert tmpdir.join('access.log.1').size() == line_size
+
+
+def test_rotation_error(app, tmpdir):
+    path = tmpdir.join('access.log')
+    line_size = len(format_record(make_record()))
+    access_log = AccessLogComponent(app, path=str(path), max_bytes=line_size)
+    access_log.open()
+    try:
+        access_log.buffer.append(make_record(200))
+        access_log.flush()
+        with patch('tygs.access_log.os.replace', side_effect=OSError):
+            with patch('tygs.access_log.log'):
+                access_log.buffer.append(make_record(201))
+                access_log.flush()
+        assert access_log.dropped == 1
+        # The original file is open again
+        access_log.buffer.append(make_record(202))
+        access_log.flush()
+    finally:
+        access_log.close()
+
+    assert ' 200 ' in tmpdir.join('access.log.1').read()
+    assert ' 202 ' in path.read()
+    assert access_log.written == 2
+
+
+@pytest.mark.asyncio
+async def test_requests_access_log(queued_webapp, tmpdir):
+    app = queued_webapp()
+    http = app.components['http']
+    access_log = app.components['access_log']
+    access_log.enable(str(tmpdir.join('access.log')))
+
+    @http.get('/')
+    def index(req, res):
+        return res.text('ok')
+
+    await app.async_ready()
+    try:
+        await app.client.get('/')
+        await app.client.get('/nope')
+        await asyncio.sleep(0)
+    finally:
+        await app.async_stop()
+
+    lines = tmpdir.join('access.log').read().splitlines()
+    assert len(lines) == 2
+    assert '"GET / HTTP/1.1" 200 2' in lines[0]
+    assert '"GET /nope HTTP/1.1" 404' in lines[1]
+
+
+@pytest.mark.asyncio
+async def test_access_log_body_sizes(tmpdir):
+    app = WebApp('namespace', access_log=str(tmpdir.join('access.log')))
+    http = app.components['http']
+    path = tmpdir.join('data.bin')
+    path.write_binary(b'x' * 1000)
+
+    @http.get('/bytes')
+    def data(req, res):
+        return res.bytes(b'x' * 10)
+
+    @http.get('/file')
+    def send_file(req, res):
+        return res.file(str(path))
+
+    await app.async_ready()
+    try:
+        with aiohttp.ClientSession() as session:
+            for url in ('/bytes', '/file'):
+                url = 'http://localhost:8080' + url
+                async with session.get(url) as resp:
+                    await resp.read()
+    finally:
+        await app.async_stop()
+
+    lines = tmpdir.join('access.log').read().splitlines()
+    assert '"GET /bytes HTTP/1.1" 200 10 ' in lines[0]
+    assert '"GET /file HTTP/1.1" 200 1000 ' in lines[1]
@@ -1,3 +1,4 @@
+import asyncio
 import pytest
 import warnings
 import subprocess
@@ -6,6 +7,7 @@ import time
 
 from unittest.mock import patch, MagicMock, Mock
 
+from tygs import utils
 from tygs.components import SignalDispatcher
 from tygs.test_utils import AsyncMock
 from tygs.utils import aioloop as get_loop, DebugException
@@ -52,6 +54,60 @@ def test_ready(aioloop, app):
     beacon.assert_called_once_with()
 
 
+LOOPS = ['asyncio']
+if utils.uvloop is not None:  # pragma: no cover
+    LOOPS.append('uvloop')
+
+
+# Not just "asyncio" as id, which pytest-asyncio takes for its marker
+@pytest.mark.parametrize('loop', LOOPS, ids=lambda name: name + '_loop')
+def test_ready_with_loop(loop, app):
+    beacon = Mock()
+
+    @app.on('running')
+    def stahp():
+        beacon(app.loop.get_task_factory())
+        app.stop()
+
+    app.fail_fast(True)
+    try:
+        app.ready(loop=loop)
+    finally:
+        app.fail_fast(False)
+        asyncio.set_event_loop_policy(asyncio.DefaultEventLoopPolicy())
+    # The fail fast task factory is installed on the new loop
+    factory, = beacon.call_args[0]
+    assert factory is not None
+    assert app.loop.is_closed()
+
+
+@pytest.mark.parametrize('loop', LOOPS, ids=lambda name: name + '_loop')
+def test_fail_fast_with_loop(loop, app):
+
+    def handler(loop, context):  # pragma: no cover
+        pass
+
+    @app.on('setup', inline=True)
+    def set_handler():
+        app.loop.set_exception_handler(handler)
+
+    @app.on('running')
+    async def stahp():
+        raise ValueError('Breaking the loop')
+
+    app.fail_fast(True)
+    try:
+        with pytest.raises(Exception):
+            app.ready(loop=loop)
+        # The loop stopped on the error, and its handler is back
+        assert not app.loop.is_running()
+        assert app.loop.get_exception_handler() is handler
+    finally:
+        app.fail_fast(False)
+        app.loop.close()
+        asyncio.set_event_loop_policy(asyncio.DefaultEventLoopPolicy())
+
+
 def test_ready_with_cwd(aioloop, app):
     beacon = Mock()
 
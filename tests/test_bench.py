@@ -0,0 +1,46 @@
+import json
+
+from tygs import bench
+
+
+def test_percentile():
+    values = list(range(1, 101))
+    assert bench.percentile(values, 0.5) == 51
+    assert bench.percentile(values, 0.99) == 100
+    assert bench.percentile(values, 1) == 100
+    assert bench.percentile([], 0.5) is None
+
+
+def test_compare():
+    baseline = {'scenarios': {
+        'text': {'rps': 1000, 'p99_ms': 10},
+        'json': {'rps': 1000, 'p99_ms': 10},
+        'removed': {'rps': 1000, 'p99_ms': 10},
+    }}
+    results = {'scenarios': {
+        'text': {'rps': 950, 'p99_ms': 10.5},
+        'json': {'rps': 800, 'p99_ms': 10},
+        'new': {'rps': 1000, 'p99_ms': 10},
+    }}
+    comparison = bench.compare(results, baseline, tolerance=0.1)
+    assert [(name, regression) for name, _, _, regression in comparison] == \
+        [('json', True), ('text', False)]
+    assert round(comparison[1][1], 2) == -0.05
+
+
+def test_run_benchmark(tmpdir):
+    output = str(tmpdir.join('run.json'))
+    argv = ['--scenarios', 'text,template,error', '--duration', '0.2',
+            '--concurrency', '2', '--port', '8766', '--output', output]
+    assert bench.main(argv) == 0
+
+    with open(output) as f:
+        results = json.load(f)
+    assert set(results['scenarios']) == {'text', 'template', 'error'}
+    for result in results['scenarios'].values():
+        assert result['requests'] > 0
+        assert result['errors'] == 0
+        assert result['p50_ms'] <= result['p99_ms']
+
+    # Same run, with a huge tolerance
+    assert bench.main(argv + ['--baseline', output, '--tolerance', '100']) == 0
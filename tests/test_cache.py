@@ -0,0 +1,155 @@
+import asyncio
+
+from unittest.mock import patch
+
+import pytest
+
+from tygs.app import App
+from tygs.cache import CacheComponent, sizeof
+
+
+@pytest.fixture
+def cache(app):
+    return CacheComponent(app, max_memory=100)
+
+
+def test_sizeof():
+    assert sizeof(b'x' * 10) == 10
+    assert sizeof(bytearray(5)) == 5
+    assert sizeof(memoryview(b'x' * 10)[2:5]) == 3
+    assert sizeof('fromage') > 0
+
+
+def test_app_has_cache(app):
+    assert isinstance(app.components['cache'], CacheComponent)
+
+
+@pytest.mark.asyncio
+async def test_cache_get_set_delete(cache):
+    assert await cache.get('brie') is None
+    assert await cache.get('brie', 'default') == 'default'
+
+    assert await cache.set('brie', b'x' * 10)
+    assert await cache.get('brie') == b'x' * 10
+    assert 'brie' in cache
+    assert len(cache) == 1
+
+    await cache.set_many({'comte': b'y', 'roquefort': b'z'})
+    assert await cache.get_many(['brie', 'comte', 'nope']) == {
+        'brie': b'x' * 10, 'comte': b'y'}
+
+    assert await cache.delete('brie')
+    assert not await cache.delete('brie')
+    assert await cache.get('brie') is None
+
+    assert cache.stats() == {'hits': 3, 'misses': 4, 'evictions': 0,
+                             'expired': 0, 'keys': 2, 'memory': 2,
+                             'max_memory': 100}
+
+    await cache.clear()
+    assert len(cache) == 0
+    assert cache.memory == 0
+
+
+@pytest.mark.asyncio
+async def test_cache_lru_eviction(cache):
+    await cache.set('a', b'x' * 40)
+    await cache.set('b', b'x' * 40)
+    await cache.get('a')  # "b" is now the least recently used
+    await cache.set('c', b'x' * 40)
+
+    found = await cache.get_many(['a', 'b', 'c'])
+    assert found == {'a': b'x' * 40, 'c': b'x' * 40}
+    assert cache.memory == 80
+    assert cache.stats()['evictions'] == 1
+
+    # Overwriting a key updates the memory used
+    await cache.set('a', b'x' * 10)
+    assert cache.memory == 50
+
+    # Too big for the whole cache
+    assert not await cache.set('huge', b'x' * 101)
+    assert 'huge' not in cache
+    assert await cache.set('huge', 'small', size=1)
+
+
+@pytest.mark.asyncio
+async def test_cache_ttl(cache):
+    with patch('tygs.cache.time.monotonic', return_value=1000):
+        await cache.set('short', b'x', ttl=10)
+        await cache.set('long', b'x', ttl=100)
+        await cache.set('forever', b'x')
+        await cache.set('rewritten', b'x', ttl=10)
+        await cache.set('rewritten', b'x', ttl=100)
+        assert 'short' in cache
+
+    with patch('tygs.cache.time.monotonic', return_value=1050):
+        assert 'short' not in cache
+        assert await cache.get('short') is None
+        assert cache.stats()['expired'] == 1
+        assert await cache.get('long') == b'x'
+
+    with patch('tygs.cache.time.monotonic', return_value=2000):
+        assert cache.sweep() == 2
+        assert list(cache.entries) == ['forever']
+        assert cache.memory == 1
+        assert cache.stats()['expired'] == 3
+
+
+@pytest.mark.asyncio
+async def test_cache_removal_callbacks(cache):
+    removed = []
+    cache.on_remove(lambda key, value: removed.append(key))
+
+    with patch('tygs.cache.time.monotonic', return_value=1000):
+        await cache.set('evicted', b'x' * 40)
+        await cache.set('expired', b'x', ttl=10)
+        await cache.set('kept', b'x' * 40)
+        await cache.set('deleted', b'x')
+        await cache.delete('deleted')
+        await cache.set('big', b'x' * 40)
+    assert removed == ['deleted', 'evicted']
+
+    with patch('tygs.cache.time.monotonic', return_value=2000):
+        cache.sweep()
+    assert removed == ['deleted', 'evicted', 'expired']
+
+    await cache.clear()
+    assert sorted(removed[3:]) == ['big', 'kept']
+
+
+@pytest.mark.asyncio
+async def test_cache_default_ttl(app):
+    cache = CacheComponent(app, default_ttl=10)
+    with patch('tygs.cache.time.monotonic', return_value=1000):
+        await cache.set('brie', b'x')
+        await cache.set('comte', b'x', ttl=100)
+    with patch('tygs.cache.time.monotonic', return_value=1050):
+        assert await cache.get_many(['brie', 'comte']) == {'comte': b'x'}
+
+
+@pytest.mark.asyncio
+async def test_cache_sweeper():
+    app = App('test')
+    cache = app.components['cache']
+    cache.sweep_interval = 0.01
+
+    await app.async_ready()
+    try:
+        await cache.set('brie', b'x', ttl=0.001)
+        await asyncio.sleep(0.05)
+        assert cache.entries == {}
+        assert cache.stats()['expired'] == 1
+    finally:
+        await app.async_stop()
+    assert cache.sweeper is None
+
+
+@pytest.mark.asyncio
+async def test_cache_ttl_keys_of_different_types(cache):
+    with patch('tygs.cache.time.monotonic', return_value=1000):
+        await cache.set('brie', b'x', ttl=10)
+        await cache.set(('http', '/'), b'x', ttl=10)
+        await cache.set(42, b'x', ttl=10)
+    with patch('tygs.cache.time.monotonic', return_value=2000):
+        assert cache.sweep() == 3
@@ -1,5 +1,7 @@
+import asyncio
+
 import pytest
-from unittest.mock import MagicMock
+from unittest.mock import MagicMock, patch
 
 import jinja2
 
@@ -53,6 +55,140 @@ async def test_signal_dispatcher():
     assert handler2.call_count == 0
 
 
+@pytest.mark.asyncio
+async def test_signal_dispatcher_arguments_and_priorities():
+    s = components.SignalDispatcher(App('test'))
+    calls = []
+
+    def sync_handler(value, extra=None):
+        calls.append(('sync', value, extra))
+        return 'sync'
+
+    async def async_handler(value, extra=None):
+        calls.append(('async', value, extra))
+        return 'async'
+
+    s.register('event', sync_handler)
+    s.register('event', async_handler, priority=10)
+    s.register('event', lambda value, extra: 'last', priority=-1)
+
+    assert await s.trigger('event', 1, extra=2) == ['async', 'sync', 'last']
+    assert sorted(calls) == [('async', 1, 2), ('sync', 1, 2)]
+
+    calls.clear()
+    await s.trigger('event', 1, extra=2, mode='sequential')
+    assert calls == [('async', 1, 2), ('sync', 1, 2)]
+
+
+@pytest.mark.asyncio
+async def test_signal_dispatcher_sync_fast_path():
+    s = components.SignalDispatcher(App('test'))
+    handler = MagicMock(return_value='ok')
+    s.register('event', handler, inline=True)
+
+    # Inline functions are called right away, without any task
+    future = s.trigger('event', 'payload')
+    handler.assert_called_once_with('payload')
+    assert future.done()
+    assert await future == ['ok']
+
+    assert await s.trigger('nothing') == []
+
+
+@pytest.mark.asyncio
+async def test_signal_dispatcher_errors():
+    s = components.SignalDispatcher(App('test'))
+    after = MagicMock()
+
+    def fail():
+        raise ValueError('fromage')
+
+    s.register('event', fail, priority=1)
+    s.register('event', after)
+
+    with pytest.raises(ValueError):
+        await s.trigger('event')
+    assert after.call_count == 1
+
+    # An error stops the chain in sequential mode
+    with pytest.raises(ValueError):
+        await s.trigger('event', mode='sequential')
+    assert after.call_count == 1
+
+    with pytest.raises(ValueError):
+        s.trigger('event', mode='wololo')
+
+
+@pytest.mark.asyncio
+async def test_signal_dispatcher_modes():
+    s = components.SignalDispatcher(App('test'))
+    calls = []
+
+    async def slow():
+        calls.append('slow start')
+        await asyncio.sleep(0.01)
+        calls.append('slow end')
+
+    async def fast():
+        calls.append('fast')
+
+    def sync():
+        calls.append('sync')
+
+    s.register('event', slow, priority=2)
+    s.register('event', fast, priority=1)
+    s.register('event', sync, inline=True)
+
+    await s.trigger('event')
+    assert calls == ['sync', 'slow start', 'fast', 'slow end']
+
+    calls.clear()
+    await s.trigger('event', mode='sequential')
+    assert calls == ['slow start', 'slow end', 'fast', 'sync']
+
+    calls.clear()
+    future = s.trigger('event', mode='background')
+    assert calls == []
+    await future
+    assert calls == ['slow start', 'fast', 'sync', 'slow end']
+
+
+@pytest.mark.asyncio
+async def test_signal_dispatcher_wildcards():
+    s = components.SignalDispatcher(App('test'), cache_size=2)
+    calls = []
+
+    def handler(name):
+        return lambda: calls.append(name)
+
+    # Inline, so they are called in priority order on the loop
+    s.register('http.request.done', handler('exact'), inline=True)
+    assert s.get_handlers('http.request.done') is \
+        s.signals['http.request.done']
+
+    s.register('http.*.done', handler('star'), priority=1, inline=True)
+    s.register('http.**', handler('double star'), priority=2, inline=True)
+    s.register('**', handler('all'), inline=True)
+
+    await s.trigger('http.request.done')
+    assert calls == ['double star', 'star', 'exact', 'all']
+    assert 'http.request.done' in s.cache
+
+    calls.clear()
+    await s.trigger('http.request.start')
+    assert calls == ['double star', 'all']
+
+    # The cache is cleared when full, and on registration
+    await s.trigger('app.init')
+    assert list(s.cache) == ['app.init']
+    s.register('app.*', handler('app'), inline=True)
+    assert s.cache == {}
+
+    calls.clear()
+    await s.trigger('app.init')
+    assert calls == ['all', 'app']
+
+
 def test_signal_dispatcher_decorator():
     s = components.SignalDispatcher(App('test'))
     s.register = MagicMock()
@@ -94,6 +230,50 @@ async def test_jinja2_renderer_render(app, fixture_dir):
     assert s == "doh: bar"
 
 
+@pytest.mark.asyncio
+async def test_jinja2_renderer_bytecode_cache(app, fixture_dir, tmpdir):
+
+    app.project_dir = fixture_dir
+    loads = []
+
+    for i in range(2):
+        jinja = components.Jinja2Renderer(app, bytecode_cache=str(tmpdir),
+                                          precompile=True, auto_reload=False)
+        jinja.hooks.append(lambda *args: loads.append(args))
+        await jinja.lazy_init()
+        assert not jinja.env.auto_reload
+
+    names = sorted(name for name, duration, cache_hit in loads[:4])
+    assert names == ['get.html', 'hello.html', 'index.html', 'post.html']
+    assert [cache_hit for name, duration, cache_hit in loads] == \
+        [False] * 4 + [True] * 4
+    assert len(tmpdir.listdir()) == 4
+    assert jinja.stats['loaded'] == 4
+    assert jinja.stats['cache_hits'] == 4
+
+    s = jinja.render_to_string('hello.html', {'foo': 'doh'})
+    assert s == "doh: bar"
+    assert jinja.stats['loaded'] == 4
+
+
+@pytest.mark.asyncio
+async def test_jinja2_renderer_render_to_chunks(app, fixture_dir):
+
+    jinja = components.Jinja2Renderer(app)
+    app.project_dir = fixture_dir
+    await jinja.lazy_init()
+
+    chunks = jinja.render_to_chunks('hello.html', {'foo': 'doh'})
+    assert list(chunks) == [b"doh: bar"]
+
+    chunks = jinja.render_to_chunks('hello.html', {'foo': 'doh'},
+                                    chunk_size=1)
+    assert list(chunks) == [b"doh", b": bar"]
+
+    with pytest.raises(jinja2.TemplateNotFound):
+        jinja.render_to_chunks('nope.html', {})
+
+
 def test_jinja2_renderer_render_to_response_dict(app):
     req = MagicMock()
     req.app.components.get.return_value = \
@@ -373,11 +553,13 @@ async def test_requesthandleradapter_write_response_to_client(handleradapter,
 
     req = HttpRequestController(webapp, aiothttp_req)
     res = req.response
-    res._build_aiohttp_response = MagicMock(return_value=aiohttp_res)
 
     handleradapter.keep_alive = MagicMock()
 
-    await handleradapter._write_response_to_client(req, res)
+    # The controllers have no __dict__, so patch the class
+    with patch.object(HttpResponseController, '_build_aiohttp_response',
+                      return_value=aiohttp_res):
+        await handleradapter._write_response_to_client(req, res)
 
     aiohttp_res.prepare.assert_called_once_with(aiothttp_req)
     aiohttp_res.write_eof.assert_called_once_with()
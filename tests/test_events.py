@@ -0,0 +1,36 @@
+import pytest
+
+from tygs.events import TopicTrie
+
+
+def test_topic_trie():
+    trie = TopicTrie()
+    for pattern in ('http', 'http.request', 'http.*', 'http.*.done',
+                    'http.**', '**', '**.done', 'http.**.done', 'app.init'):
+        trie.add(pattern)
+
+    assert trie.wildcards == 6
+    assert trie.match('http') == {'http', 'http.**', '**'}
+    assert trie.match('http.request') == {
+        'http.request', 'http.*', 'http.**', '**'}
+    assert trie.match('http.request.done') == {
+        'http.*.done', 'http.**', '**', '**.done', 'http.**.done'}
+    assert trie.match('http.a.b.done') == {
+        'http.**', '**', '**.done', 'http.**.done'}
+    assert trie.match('done') == {'**', '**.done'}
+    assert trie.match('app.init') == {'app.init', '**'}
+    assert trie.match('app') == {'**'}
+
+
+def test_topic_trie_no_duplicates():
+    trie = TopicTrie()
+    trie.add('http.*')
+    trie.add('http.*')
+    assert trie.wildcards == 1
+    assert trie.root.children['http'].star.patterns == ['http.*']
+
+
+@pytest.mark.parametrize('pattern', ['http..done', 'http.re*', '', 'a.***'])
+def test_topic_trie_invalid_patterns(pattern):
+    with pytest.raises(ValueError):
+        TopicTrie().add(pattern)
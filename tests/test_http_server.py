@@ -1,14 +1,25 @@
-from unittest.mock import Mock, MagicMock
+import json
+import asyncio
+import socket
+
+from asyncio.streams import FlowControlMixin
+from unittest.mock import Mock, MagicMock, patch
 
 import pytest
 import aiohttp
 from aiohttp.web_reqrep import Response
 
-from tygs.http import server
+from tygs.http import server, responses
+from tygs.http.cache import CachePolicy
+from tygs.webapp import WebApp
 from tygs.exceptions import (
     HttpRequestControllerError, HttpResponseControllerError, RoutingError)
 
 
+class FlowControlProtocol(FlowControlMixin, asyncio.Protocol):
+    pass
+
+
 def test_httprequest_controller(app):
     aiohttp_request = Mock()
     httprequest = server.HttpRequestController(app, aiohttp_request)
@@ -26,6 +37,29 @@ def test_httprequest_controller(app):
     assert repr(httprequest).startswith('<HttpRequestController')
 
 
+def test_controllers_lazy_attributes(app):
+    aiohttp_request = Mock()
+    req = server.HttpRequestController(app, aiohttp_request)
+    res = req.response
+    assert res._context is None
+    assert res._headers is None
+    assert not hasattr(req, '__dict__')
+    assert not hasattr(res, '__dict__')
+
+    assert res.context == {'req': req, 'res': res}
+    assert res._context is res.context
+    res.headers['X-Fromage'] = 'Brie'
+    assert res._headers == {'X-Fromage': 'Brie'}
+
+    req.url_args = {'id': 1}
+    assert req.url_args == {'id': 1}
+
+    # No custom attributes, the context is there for that
+    with pytest.raises(AttributeError):
+        req.user = 'sam'
+    res.context['user'] = 'sam'
+
+
 def test_httpresponse_controller_init(app):
     request = MagicMock()
     request.app = app
@@ -60,6 +94,18 @@ def test_httpresponse_controller_template(webapp):
     assert httpresponse._renderer_data == {'foo2': 'bar2'}
 
 
+def test_httpresponse_controller_json(webapp):
+    req = server.HttpRequestController(webapp, Mock())
+    res = req.response.json({'fromage': 'époisses', 'age': 3})
+    response = res.render_response()
+    assert response['content_type'] == 'application/json'
+    assert json.loads(response['body'].decode('utf8')) == {
+        'fromage': 'époisses', 'age': 3}
+
+    res.json([1, 2], dumps=lambda data: b'custom')
+    assert res.render_response()['body'] == b'custom'
+
+
 def test_httpresponse_controller_render_response(webapp):
     request = MagicMock()
     request.app = webapp
@@ -74,13 +120,16 @@ def test_httpresponse_build_aiohttp_reponse(webapp):
     request = MagicMock()
     request.app = webapp
     httpresponse = server.HttpResponseController(request)
-    httpresponse.render_response = Mock(return_value={
+    rendered = {
         "body": b"toto",
         "content_type": "text/html",
         "status": 418
-    })
+    }
 
-    aiohttpres = httpresponse._build_aiohttp_response()
+    # The controllers have no __dict__, so patch the class
+    with patch.object(server.HttpResponseController, 'render_response',
+                      return_value=rendered):
+        aiohttpres = httpresponse._build_aiohttp_response()
 
     assert isinstance(aiohttpres, Response)
     assert aiohttpres.body == b"toto"
@@ -146,6 +195,156 @@ async def test_request_body(queued_webapp):
     await app.async_stop()
 
 
+@pytest.mark.asyncio
+async def test_request_iter_body(queued_webapp):
+
+    app = queued_webapp()
+    http = app.components['http']
+    chunks = []
+
+    @http.post('/', lazy_body=True)
+    async def index_controller(req, res):
+        async for chunk in req.iter_body(chunk_size=1000):
+            chunks.append(chunk)
+        return res.text('')
+
+    try:
+        await app.async_ready()
+        await app.client.post('/', data=b'x' * 2500)
+        assert [len(chunk) for chunk in chunks] == [1000, 1000, 500]
+    finally:
+        await app.async_stop()
+
+
+@pytest.mark.asyncio
+async def test_request_multipart(queued_webapp):
+
+    app = queued_webapp()
+    http = app.components['http']
+    parts = []
+
+    @http.post('/', lazy_body=True)
+    async def index_controller(req, res):
+        reader = req.multipart()
+        while True:
+            part = await reader.next()
+            if part is None:
+                break
+            parts.append((part.filename, await part.read()))
+        return res.text('')
+
+    try:
+        await app.async_ready()
+        data = aiohttp.FormData()
+        data.add_field('name', 'reblochon')
+        data.add_field('file', b'\x00' * 5000, filename='fromage.bin')
+        await app.client.post('/', data=data)
+        assert parts == [(None, b'reblochon'),
+                         ('fromage.bin', b'\x00' * 5000)]
+    finally:
+        await app.async_stop()
+
+
+@pytest.mark.asyncio
+async def test_request_max_body_size(queued_webapp):
+
+    app = queued_webapp()
+    http = app.components['http']
+    http.max_body_size = 100
+
+    @http.post('/')
+    def index_controller(req, res):
+        return res.text('ok')
+
+    @http.post('/big', max_body_size=1000)
+    def big_controller(req, res):
+        return res.text('ok')
+
+    @http.post('/lazy', lazy_body=True)
+    async def lazy_controller(req, res):
+        async for chunk in req.iter_body():
+            pass
+        return res.text('ok')
+
+    try:
+        await app.async_ready()
+
+        response = await app.client.post('/', data=b'x' * 101)
+        assert response.status_code == 413
+        response = await app.client.post('/', data=b'x' * 100)
+        assert response.status_code == 200
+
+        response = await app.client.post('/big', data=b'x' * 1000)
+        assert response.status_code == 200
+
+        # No content-length, so the limit is checked while reading
+        def body():
+            yield b'x' * 60
+            yield b'x' * 60
+        response = await app.client.post('/lazy', data=body(),
+                                         chunked=True)
+        assert response.status_code == 413
+    finally:
+        await app.async_stop()
+
+
+@pytest.mark.asyncio
+async def test_request_max_body_size_in_middleware(queued_webapp):
+
+    app = queued_webapp()
+    http = app.components['http']
+    http.max_body_size = 100
+
+    @http.middleware
+    async def signature(req, res, handler):
+        await req.read_body()
+        await handler(req, res)
+
+    @http.post('/')
+    def index_controller(req, res):
+        return res.text('ok')
+
+    @http.post('/big', max_body_size=1000)
+    def big_controller(req, res):
+        return res.text('ok')
+
+    try:
+        await app.async_ready()
+
+        response = await app.client.post('/', data=b'x' * 101)
+        assert response.status_code == 413
+        response = await app.client.post('/big', data=b'x' * 1001)
+        assert response.status_code == 413
+        response = await app.client.post('/big', data=b'x' * 1000)
+        assert response.status_code == 200
+    finally:
+        await app.async_stop()
+
+
+@pytest.mark.asyncio
+async def test_request_json(queued_webapp):
+
+    app = queued_webapp()
+    http = app.components['http']
+    bodies = []
+
+    @http.post('/')
+    async def index_controller(req, res):
+        bodies.append(await req.json())
+        return res.json({'status': 'ok'})
+
+    try:
+        await app.async_ready()
+        response = await app.client.post('/', data=b'{"fromage": ["brie"]}')
+        assert bodies == [{'fromage': ['brie']}]
+        assert response.status_code == 200
+
+        response = await app.client.post('/', data=b'{"fromage"')
+        assert response.status_code == 400
+    finally:
+        await app.async_stop()
+
+
 @pytest.mark.asyncio
 async def test_request_cookies(queued_webapp):
 
@@ -321,3 +520,474 @@ async def test_invalid_error_handler(webapp):
         @http.on_error('200')
         async def not_error_handler(req, res):
             return res.text('Everything is awesome!')  # noqa
+
+
+@pytest.mark.asyncio
+async def test_stream_template(fixture_dir):
+    app = WebApp('namespace')
+    http = app.components['http']
+
+    @http.get('/')
+    def index(req, res):
+        return res.template('hello.html', {'foo': 'doh'}, stream=True)
+
+    try:
+        await app.async_ready(fixture_dir)
+
+        with aiohttp.ClientSession() as session:
+            async with session.get('http://localhost:8080/') as resp:
+                assert resp.status == 200
+                assert resp.headers['Transfer-Encoding'] == 'chunked'
+                assert resp.headers['Content-Type'] == \
+                    'text/html; charset=utf-8'
+                assert await resp.text() == 'doh: bar'
+
+            async with session.head('http://localhost:8080/') as resp:
+                assert resp.status == 200
+    finally:
+        await app.async_stop()
+
+
+class AsyncChunks:
+
+    def __init__(self, *chunks):
+        self.chunks = list(chunks)
+
+    async def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        await asyncio.sleep(0)
+        if not self.chunks:
+            raise StopAsyncIteration
+        return self.chunks.pop(0)
+
+
+@pytest.mark.asyncio
+async def test_stream_and_bytes_responses():
+    app = WebApp('namespace')
+    http = app.components['http']
+
+    @http.get('/stream')
+    def stream(req, res):
+        return res.stream(AsyncChunks(b'foo', b'bar'), 'text/plain')
+
+    @http.get('/bytes')
+    def data(req, res):
+        return res.bytes(memoryview(b'xxfooxx')[2:5])
+
+    try:
+        await app.async_ready()
+
+        with aiohttp.ClientSession() as session:
+            async with session.get('http://localhost:8080/stream') as resp:
+                assert resp.status == 200
+                assert resp.headers['Transfer-Encoding'] == 'chunked'
+                assert resp.headers['Content-Type'].startswith('text/plain')
+                assert await resp.read() == b'foobar'
+
+            async with session.get('http://localhost:8080/bytes') as resp:
+                assert resp.status == 200
+                assert resp.headers['Content-Length'] == '3'
+                assert resp.headers['Content-Type'] == \
+                    'application/octet-stream'
+                assert await resp.read() == b'foo'
+    finally:
+        await app.async_stop()
+
+
+@pytest.mark.asyncio
+async def test_file_response(tmpdir):
+    app = WebApp('namespace')
+    http = app.components['http']
+    content = bytes(range(256)) * 1000
+    path = tmpdir.join('data.bin')
+    path.write_binary(content)
+
+    @http.get('/file')
+    def send_file(req, res):
+        return res.file(str(path))
+
+    @http.get('/missing')
+    def missing(req, res):
+        return res.file(str(tmpdir.join('nope')))
+
+    url = 'http://localhost:8080/file'
+
+    try:
+        await app.async_ready()
+
+        with aiohttp.ClientSession() as session:
+            async with session.get(url) as resp:
+                assert resp.status == 200
+                assert resp.headers['Content-Length'] == str(len(content))
+                assert resp.headers['Accept-Ranges'] == 'bytes'
+                assert await resp.read() == content
+                etag = resp.headers['ETag']
+
+            headers = {'If-None-Match': etag}
+            async with session.get(url, headers=headers) as resp:
+                assert resp.status == 304
+                assert await resp.read() == b''
+
+            headers = {'Range': 'bytes=10-19'}
+            async with session.get(url, headers=headers) as resp:
+                assert resp.status == 206
+                assert resp.headers['Content-Range'] == \
+                    'bytes 10-19/{}'.format(len(content))
+                assert await resp.read() == content[10:20]
+
+            headers = {'Range': 'bytes=-5'}
+            async with session.get(url, headers=headers) as resp:
+                assert resp.status == 206
+                assert await resp.read() == content[-5:]
+
+            headers = {'Range': 'bytes=10-19', 'If-Range': '"outdated"'}
+            async with session.get(url, headers=headers) as resp:
+                assert resp.status == 200
+                assert await resp.read() == content
+
+            headers = {'Range': 'bytes={}-'.format(len(content))}
+            async with session.get(url, headers=headers) as resp:
+                assert resp.status == 416
+                assert resp.headers['Content-Range'] == \
+                    'bytes */{}'.format(len(content))
+
+            async with session.get('http://localhost:8080/missing') as resp:
+                assert resp.status == 404
+    finally:
+        await app.async_stop()
+
+
+@pytest.mark.asyncio
+async def test_file_response_flush():
+    loop = asyncio.get_event_loop()
+    client, peer = socket.socketpair()
+    peer.setblocking(False)
+    transport, protocol = await loop.create_connection(
+        lambda: FlowControlProtocol(loop=loop), sock=client)
+    writer = asyncio.StreamWriter(transport, protocol, None, loop)
+
+    response = Mock(spec=responses.FileResponse)
+    response.drain = writer.drain
+    data = b'x' * 4 * 1024 * 1024
+
+    async def read():
+        received = 0
+        while received < len(data):
+            await asyncio.sleep(0.001)
+            received += len(await loop.sock_recv(peer, 64 * 1024))
+
+    try:
+        # Below the high-water mark, drain() alone wouldn't wait
+        transport.set_write_buffer_limits(high=2 * len(data))
+        limits = transport.get_write_buffer_limits()
+        transport.write(data)
+        assert transport.get_write_buffer_size()
+        reading = asyncio.ensure_future(read())
+        await responses.FileResponse.flush(response, transport)
+        assert transport.get_write_buffer_size() == 0
+        assert transport.get_write_buffer_limits() == limits
+        await reading
+    finally:
+        transport.close()
+        peer.close()
+
+
+@pytest.mark.asyncio
+async def test_middlewares():
+    app = WebApp('namespace')
+    http = app.components['http']
+    calls = []
+
+    @http.middleware
+    async def outer(req, res, handler):
+        calls.append('outer')
+        await handler(req, res)
+        res.headers['X-Outer'] = 'yes'
+
+    @http.middleware(name='auth')
+    def check_auth(req, res, handler):
+        calls.append('auth')
+        if 'token' not in req.url_query:
+            return res.text('denied')
+        return handler(req, res)
+
+    @http.get('/')
+    def index(req, res):
+        calls.append('index')
+        return res.text('ok')
+
+    @http.get('/health', skip_middlewares=['auth'])
+    def health(req, res):
+        calls.append('health')
+        return res.text('ok')
+
+    @http.get('/static', skip_middlewares=True)
+    def static(req, res):
+        calls.append('static')
+        return res.text('ok')
+
+    async def get(session, path):
+        async with session.get('http://localhost:8080' + path) as resp:
+            return resp.headers.get('X-Outer'), await resp.text()
+
+    try:
+        await app.async_ready()
+
+        # The chains are composed once
+        assert http.compiled
+        assert http.router.handlers['namespace.static'] is \
+            http.routes['namespace.static'][0]
+
+        with aiohttp.ClientSession() as session:
+            assert await get(session, '/?token=1') == ('yes', 'ok')
+            assert calls == ['outer', 'auth', 'index']
+
+            calls.clear()
+            assert await get(session, '/') == ('yes', 'denied')
+            assert calls == ['outer', 'auth']
+
+            calls.clear()
+            assert await get(session, '/health') == ('yes', 'ok')
+            assert calls == ['outer', 'health']
+
+            calls.clear()
+            assert await get(session, '/static') == (None, 'ok')
+            assert calls == ['static']
+
+            # Adding a middleware after "ready" compiles the chains again
+            @http.middleware
+            async def late(req, res, handler):
+                calls.append('late')
+                await handler(req, res)
+
+            calls.clear()
+            assert await get(session, '/health') == ('yes', 'ok')
+            assert calls == ['outer', 'late', 'health']
+    finally:
+        await app.async_stop()
+
+
+@pytest.mark.asyncio
+async def test_response_cache():
+    app = WebApp('namespace')
+    http = app.components['http']
+    calls = []
+
+    @http.get('/', cache=60)
+    def index(req, res):
+        calls.append(dict(req.url_query))
+        return res.text('call {}'.format(len(calls)))
+
+    @http.get('/lang', cache=CachePolicy(60, query=['page'],
+                                         vary=['Accept-Language']))
+    def lang(req, res):
+        calls.append(req.headers.get('Accept-Language'))
+        return res.text(req.headers.get('Accept-Language'))
+
+    @http.get('/cookie', cache=60)
+    def cookie(req, res):
+        calls.append('cookie')
+        res.headers['Set-Cookie'] = 'fromage=brie'
+        return res.text('cookie')
+
+    async def get(session, path, **kwargs):
+        url = 'http://localhost:8080' + path
+        async with session.get(url, **kwargs) as resp:
+            assert resp.status == 200
+            return await resp.text()
+
+    try:
+        await app.async_ready()
+
+        with aiohttp.ClientSession() as session:
+            assert await get(session, '/') == 'call 1'
+            assert await get(session, '/') == 'call 1'
+            assert await get(session, '/?a=1') == 'call 2'
+            assert await get(session, '/?a=1') == 'call 2'
+            assert len(calls) == 2
+
+            assert await http.purge('/') == 2
+            assert await get(session, '/') == 'call 3'
+
+            calls.clear()
+            fr = {'Accept-Language': 'fr'}
+            en = {'Accept-Language': 'en'}
+            assert await get(session, '/lang?page=1', headers=fr) == 'fr'
+            assert await get(session, '/lang?page=1&x=2', headers=fr) == 'fr'
+            assert await get(session, '/lang?page=1', headers=en) == 'en'
+            assert await get(session, '/lang?page=2', headers=en) == 'en'
+            assert calls == ['fr', 'en', 'en']
+
+            # Responses setting cookies are never cached
+            calls.clear()
+            await get(session, '/cookie')
+            await get(session, '/cookie')
+            assert calls == ['cookie', 'cookie']
+
+            assert await http.purge_all() == 4
+            assert http.response_cache.keys_by_path == {}
+    finally:
+        await app.async_stop()
+
+
+@pytest.mark.asyncio
+async def test_response_cache_forgets_removed_keys():
+    app = WebApp('namespace')
+    http = app.components['http']
+    cache = app.components['cache']
+
+    @http.get('/', cache=60)
+    def index(req, res):
+        return res.text('index')
+
+    async def get(session, path):
+        async with session.get('http://localhost:8080' + path) as resp:
+            return await resp.text()
+
+    try:
+        await app.async_ready()
+
+        with aiohttp.ClientSession() as session:
+            for i in range(10):
+                await get(session, '/?x={}'.format(i))
+            assert len(http.response_cache.keys_by_path['/']) == 10
+
+            # Evicted
+            cache.max_memory = cache.memory // 2
+            await cache.set('other', b'x')
+            assert len(http.response_cache.keys_by_path['/']) == len(cache) - 1
+
+            # Expired
+            with patch('tygs.cache.time.monotonic', return_value=10 ** 9):
+                cache.sweep()
+            assert http.response_cache.keys_by_path == {}
+    finally:
+        await app.async_stop()
+
+
+@pytest.mark.asyncio
+async def test_response_cache_middleware_headers():
+    app = WebApp('namespace')
+    http = app.components['http']
+
+    @http.middleware
+    async def login(req, res, handler):
+        await handler(req, res)
+        res.headers['Set-Cookie'] = 'session=' + req.url_query['user']
+
+    @http.get('/', cache=CachePolicy(60, query=()))
+    def index(req, res):
+        return res.text('index')
+
+    @http.get('/headers', cache=CachePolicy(60, query=()))
+    def headers(req, res):
+        res.headers['X-Handler'] = 'yes'
+        return res.text('headers')
+
+    async def get(session, path):
+        async with session.get('http://localhost:8080' + path) as resp:
+            return resp.headers.get('X-Handler'), resp.headers['Set-Cookie']
+
+    try:
+        await app.async_ready()
+
+        with aiohttp.ClientSession() as session:
+            for path, handler_header in (('/', None), ('/headers', 'yes')):
+                # Set after the response is cached, but never stored in it
+                first = await get(session, path + '?user=1')
+                assert first == (handler_header, 'session=1')
+                second = await get(session, path + '?user=2')
+                assert second == (handler_header, 'session=2')
+    finally:
+        await app.async_stop()
+
+
+@pytest.mark.asyncio
+async def test_response_cache_stale_while_revalidate():
+    app = WebApp('namespace')
+    http = app.components['http']
+    calls = []
+
+    @http.get('/', cache=CachePolicy(0.05, stale=60))
+    def index(req, res):
+        calls.append(1)
+        return res.text('call {}'.format(len(calls)))
+
+    async def get(session):
+        async with session.get('http://localhost:8080/') as resp:
+            return await resp.text()
+
+    try:
+        await app.async_ready()
+
+        with aiohttp.ClientSession() as session:
+            assert await get(session) == 'call 1'
+            await asyncio.sleep(0.1)
+            # Stale: sent right away, and rendered again in the background
+            assert await get(session) == 'call 1'
+            await asyncio.sleep(0.01)
+            assert len(calls) == 2
+            assert await get(session) == 'call 2'
+    finally:
+        await app.async_stop()
+
+
+def test_server_bind_sockets(tmpdir):
+    sockets = server.Server.bind_sockets()
+    assert [s.getsockname() for s in sockets] == [('0.0.0.0', 8080)]
+    for sock in sockets:
+        sock.close()
+
+    unix = str(tmpdir / 'tygs.sock')
+    prebound = socket.socket()
+    sockets = server.Server.bind_sockets(unix=unix, sock=prebound)
+    assert sockets[0] is prebound
+    assert sockets[1].getsockname() == unix
+    for sock in sockets:
+        sock.close()
+
+
+async def raw_get(reader, writer):
+    writer.write(b'GET / HTTP/1.0\r\n\r\n')
+    response = await reader.read()
+    writer.close()
+    return response
+
+
+@pytest.mark.asyncio
+async def test_server_several_sockets(tmpdir):
+    unix = str(tmpdir / 'tygs.sock')
+    prebound = socket.socket()
+    prebound.bind(('127.0.0.1', 0))
+    prebound_port = prebound.getsockname()[1]
+
+    app = WebApp('namespace', host=['127.0.0.1', '127.0.0.2'], port=8081,
+                 backlog=10, unix=unix, sock=prebound)
+    http = app.components['http']
+
+    @http.get('/')
+    def index(req, res):
+        return res.text('Hello')
+
+    try:
+        await app.async_ready()
+        assert len(app.http_server.servers) == 4
+
+        streams = await asyncio.open_connection('127.0.0.1', 8081)
+        assert (await raw_get(*streams)).endswith(b'Hello')
+
+        streams = await asyncio.open_connection('127.0.0.2', 8081)
+        assert (await raw_get(*streams)).endswith(b'Hello')
+
+        streams = await asyncio.open_unix_connection(unix)
+        assert (await raw_get(*streams)).endswith(b'Hello')
+
+        streams = await asyncio.open_connection('127.0.0.1', prebound_port)
+        assert (await raw_get(*streams)).endswith(b'Hello')
+
+    finally:
+        await app.async_stop()
+
+    assert not (tmpdir / 'tygs.sock').exists()
@@ -0,0 +1,104 @@
+import pytest
+
+from tygs.metrics import (Histogram, MetricsComponent, EndpointMetrics,
+                          log_linear_bounds)
+from tygs.webapp import WebApp
+
+
+def test_log_linear_bounds():
+    assert log_linear_bounds(-1, 0, (1, 5)) == (0.1, 0.5, 1, 5)
+    assert log_linear_bounds()[:11] == (
+        0.0001, 0.0002, 0.0003, 0.0004, 0.0005, 0.0006, 0.0007, 0.0008,
+        0.0009, 0.001, 0.002)
+
+
+def test_histogram():
+    histogram = Histogram((0.1, 0.5, 1))
+    assert histogram.quantile(0.5) is None
+
+    for value in (0.05, 0.1, 0.3, 0.3, 2):
+        histogram.record(value)
+
+    assert list(histogram.counts) == [2, 2, 0, 1]
+    assert list(histogram.cumulative()) == [
+        (0.1, 2), (0.5, 4), (1, 4), (float('inf'), 5)]
+    assert histogram.count == 5
+    assert round(histogram.sum, 6) == 2.75
+    assert histogram.quantile(0.5) == 0.5
+    assert histogram.quantile(0.99) == float('inf')
+
+
+def test_webapp_metrics_option():
+    app = WebApp('namespace')
+    assert not app.components['metrics'].enabled
+    app = WebApp('namespace', metrics='/stats')
+    assert app.components['metrics'].enabled
+    assert 'tygs:metrics' in app.components['http'].routes
+
+
+def test_render(app):
+    metrics = MetricsComponent(app, bounds=(0.1, 1))
+    metrics.record('ns.index', 200, 0.01, 0.2, 0.01, 0.01)
+    metrics.record('ns.index', 404, 0.01, 0.01, 0.01, 0.01)
+    app.worker_id = 2
+
+    text = metrics.render()
+    assert ('tygs_http_requests_total{endpoint="ns.index",status="200",'
+            'worker="2"} 1') in text
+    assert ('tygs_http_request_duration_seconds_bucket{endpoint="ns.index",'
+            'phase="handler",worker="2",le="0.1"} 1') in text
+    assert ('tygs_http_request_duration_seconds_bucket{endpoint="ns.index",'
+            'phase="total",worker="2",le="+Inf"} 2') in text
+    assert ('tygs_http_request_duration_seconds_count{endpoint="ns.index",'
+            'phase="routing",worker="2"} 2') in text
+    assert text.count('# TYPE') == 2
+
+
+@pytest.mark.asyncio
+async def test_request_metrics(queued_webapp):
+    app = queued_webapp()
+    http = app.components['http']
+    metrics = app.components['metrics']
+    metrics.expose()
+
+    @http.get('/')
+    def index(req, res):
+        return res.text('ok')
+
+    await app.async_ready()
+    try:
+        await app.client.get('/')
+        await app.client.get('/')
+        await app.client.get('/nope')
+
+        index_metrics = metrics.endpoints['namespace.index']
+        assert index_metrics.statuses == {200: 2}
+        for phase in EndpointMetrics.PHASES:
+            assert getattr(index_metrics, phase).count == 2
+        assert metrics.endpoints['none'].statuses == {404: 1}
+
+        response = await app.client.get('/metrics')
+        body = response._renderer_data.decode('utf8')
+        assert 'endpoint="namespace.index",status="200"} 2' in body
+    finally:
+        await app.async_stop()
+
+
+@pytest.mark.asyncio
+async def test_metrics_route_and_user_metrics_view(queued_webapp):
+    app = queued_webapp()
+    http = app.components['http']
+    app.components['metrics'].expose()
+
+    @http.get('/app/metrics')
+    def metrics(req, res):
+        return res.text('app metrics')
+
+    await app.async_ready()
+    try:
+        response = await app.client.get('/app/metrics')
+        assert response._renderer_data == 'app metrics'
+        response = await app.client.get('/metrics')
+        assert b'tygs_http_requests_total' in response._renderer_data
+    finally:
+        await app.async_stop()
@@ -0,0 +1,134 @@
+import time
+import asyncio
+
+from unittest.mock import patch
+
+import pytest
+
+from tygs.app import App
+from tygs.monitor import LoopMonitor
+
+
+def blocking_coroutine(duration, result=None):
+    async def coroutine():
+        await asyncio.sleep(0)
+        time.sleep(duration)
+        await asyncio.sleep(0)
+        return result
+    return coroutine
+
+
+def test_app_monitor_option():
+    app = App('namespace')
+    assert not app.components['monitor'].enabled
+    assert app.components['signals'].monitor is None
+
+    app = App('namespace', monitor=True)
+    assert app.components['monitor'].enabled
+    assert app.components['signals'].monitor is app.components['monitor']
+
+
+@pytest.mark.asyncio
+async def test_watch(app):
+    monitor = LoopMonitor(app, threshold=0.01)
+
+    assert await monitor.watch(blocking_coroutine(0)(), 'fast') is None
+    assert not monitor.slow_steps
+
+    with patch('tygs.monitor.log') as log:
+        coroutine = blocking_coroutine(0.02, 'result')()
+        assert await monitor.watch(coroutine, 'slow') == 'result'
+    steps = monitor.slow_steps['slow']
+    assert steps.count == 1
+    assert steps.max >= 0.02
+    assert log.warning.call_args[1]['extra']['slow_step'] == 'slow'
+
+    async def fail():
+        await asyncio.sleep(0)
+        raise ValueError('Nope')
+
+    with pytest.raises(ValueError):
+        await monitor.watch(fail(), 'fail')
+
+
+@pytest.mark.asyncio
+async def test_slow_event_handlers():
+    app = App('namespace', monitor=True)
+    monitor = app.components['monitor']
+    monitor.threshold = 0.01
+
+    @app.on('sync', inline=True)
+    def sync():
+        time.sleep(0.02)
+
+    app.on('async')(blocking_coroutine(0.02))
+
+    with patch('tygs.monitor.log'):
+        await app.trigger('sync')
+        await app.trigger('async')
+        await app.trigger('async', mode='background')
+
+    assert monitor.slow_steps['sync'].count == 1
+    assert monitor.slow_steps['async'].count == 2
+
+
+@pytest.mark.asyncio
+async def test_handlers_registered_after_trigger():
+    app = App('namespace', monitor=True)
+    calls = []
+
+    app.on('event', inline=True)(lambda: calls.append('first'))
+    await app.trigger('event')
+
+    app.on('event', inline=True)(lambda: calls.append('second'))
+    await app.trigger('event')
+
+    assert calls == ['first', 'first', 'second']
+
+
+@pytest.mark.asyncio
+async def test_loop_lag():
+    app = App('namespace', monitor=True)
+    monitor = app.components['monitor']
+    monitor.interval = 0.001
+    monitor.threshold = 0.01
+
+    await app.async_ready()
+    try:
+        with patch('tygs.monitor.log') as log:
+            await asyncio.sleep(0.005)
+            time.sleep(0.02)
+            await asyncio.sleep(0.005)
+        assert monitor.lag.count >= 2
+        assert log.warning.call_args[1]['extra']['loop_lag'] > 0.01
+    finally:
+        await app.async_stop()
+    assert monitor.heartbeat is None
+
+
+@pytest.mark.asyncio
+async def test_slow_requests_and_metrics(queued_webapp):
+    app = queued_webapp()
+    http = app.components['http']
+    monitor = app.components['monitor']
+    monitor.threshold = 0.01
+    monitor.enable()
+    app.components['metrics'].expose()
+
+    @http.get('/', inline=True)
+    def index(req, res):
+        time.sleep(0.02)
+        return res.text('ok')
+
+    await app.async_ready()
+    try:
+        with patch('tygs.monitor.log'):
+            await app.client.get('/')
+        assert monitor.slow_steps['namespace.index'].count == 1
+
+        response = await app.client.get('/metrics')
+        body = response._renderer_data.decode('utf8')
+        assert 'tygs_slow_steps_total{source="namespace.index"} 1' in body
+        assert 'tygs_loop_lag_seconds_count{}' in body
+    finally:
+        await app.async_stop()
@@ -0,0 +1,108 @@
+import os
+import sys
+import time
+import pstats
+import signal
+import asyncio
+
+import pytest
+
+from tygs.profiler import RequestProfiler, collapse_stack
+
+
+def burn_cpu(duration):
+    end = time.process_time() + duration
+    while time.process_time() < end:
+        pass
+
+
+def test_should_profile(app):
+    profiler = RequestProfiler(app, every=2)
+    assert [profiler.should_profile('a') for _ in range(3)] == \
+        [True, False, True]
+    assert profiler.should_profile('b')
+
+
+def test_collapse_stack():
+    def inner():
+        return collapse_stack(sys._getframe())
+
+    line = inner.__code__.co_firstlineno
+    assert inner().endswith(
+        ';test_profiler.py:test_collapse_stack:{};'
+        'test_profiler.py:inner:{}'.format(line - 1, line))
+
+
+@pytest.mark.asyncio
+async def test_profile_awaitable(app, tmpdir):
+    profiler = RequestProfiler(app, directory=str(tmpdir))
+    profiler.enable()
+    assert profiler.sampling
+
+    async def work():
+        burn_cpu(0.05)
+        await asyncio.sleep(0)
+        burn_cpu(0.05)
+        return 'done'
+
+    try:
+        assert await profiler.watch(work(), 'ns.work') == 'done'
+    finally:
+        profiler.disable()
+    assert not profiler.sampling
+
+    stats = pstats.Stats(str(tmpdir.join('ns.work.pstats')))
+    assert any(name == 'burn_cpu' for _, _, name in stats.stats)
+
+    collapsed = tmpdir.join('ns.work.collapsed').read()
+    assert 'burn_cpu' in collapsed
+    stack, count = collapsed.splitlines()[0].rsplit(' ', 1)
+    assert int(count) > 0
+
+
+@pytest.mark.asyncio
+async def test_profile_requests(queued_webapp, tmpdir):
+    app = queued_webapp()
+    http = app.components['http']
+    profiler = app.components['profiler']
+    profiler.directory = str(tmpdir)
+    profiler.every = 2
+
+    @http.get('/', inline=True)
+    def index(req, res):
+        burn_cpu(0.01)
+        return res.text('ok')
+
+    await app.async_ready()
+    try:
+        await app.client.get('/')
+        profiler.enable()
+        for _ in range(3):
+            await app.client.get('/')
+    finally:
+        await app.async_stop()
+
+    assert not profiler.enabled
+    assert profiler.requests['namespace.index'] == 3
+    stats = pstats.Stats(str(tmpdir.join('namespace.index.pstats')))
+    # 2 requests out of 3 were profiled
+    calls = [stat[1] for (_, _, name), stat in stats.stats.items()
+             if name == 'burn_cpu']
+    assert calls == [2]
+
+
+def test_toggle_with_sigusr2(aioloop, app, tmpdir):
+    profiler = app.components['profiler'] = RequestProfiler(
+        app, directory=str(tmpdir))
+    states = []
+
+    @app.on('running')
+    async def toggle():
+        for _ in range(2):
+            os.kill(os.getpid(), signal.SIGUSR2)
+            await asyncio.sleep(0.01)
+            states.append(profiler.enabled)
+        app.stop()
+
+    app.ready()
+    assert states == [True, False]
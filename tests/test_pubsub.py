@@ -0,0 +1,109 @@
+import asyncio
+
+import pytest
+
+from tygs.pubsub import PubSubComponent, SubscriptionClosed
+
+
+@pytest.fixture
+def pubsub(app):
+    return PubSubComponent(app, maxsize=2)
+
+
+def test_app_has_pubsub(app):
+    assert isinstance(app.components['pubsub'], PubSubComponent)
+
+
+def test_invalid_subscriptions(pubsub):
+    with pytest.raises(ValueError):
+        pubsub.subscribe()
+    with pytest.raises(ValueError):
+        pubsub.subscribe('chat.')
+    with pytest.raises(ValueError):
+        pubsub.subscribe('chat', policy='nope')
+
+
+@pytest.mark.asyncio
+async def test_publish_subscribe(pubsub):
+    message = {'text': 'hello'}
+    chat = pubsub.subscribe('chat.room1')
+    everything = pubsub.subscribe('chat.**', 'chat.*')
+    other = pubsub.subscribe('news')
+
+    assert pubsub.publish('chat.room1', message) == 2
+    assert pubsub.subscribers_count('chat.room2') == 1
+
+    channel, received = await chat.get()
+    assert channel == 'chat.room1'
+    # No copy
+    assert received is message
+    assert len(everything) == 1
+    assert everything.get_nowait() == ('chat.room1', message)
+    assert not len(other)
+
+    other.close()
+    assert pubsub.publish('news', 'nope') == 0
+    with pytest.raises(SubscriptionClosed):
+        await other.get()
+
+
+@pytest.mark.asyncio
+async def test_async_iteration(pubsub):
+    sub = pubsub.subscribe('chat')
+
+    async def publish():
+        for i in range(3):
+            pubsub.publish('chat', i)
+            await asyncio.sleep(0)
+        sub.close()
+
+    asyncio.ensure_future(publish())
+    received = []
+    async for channel, message in sub:
+        received.append(message)
+    assert received == [0, 1, 2]
+
+
+@pytest.mark.asyncio
+async def test_concurrent_readers(pubsub):
+    sub = pubsub.subscribe('chat')
+    readers = [asyncio.ensure_future(sub.get()) for _ in range(3)]
+    await asyncio.sleep(0)
+
+    # A cancelled reader doesn't lose the message it was woken up for
+    pubsub.publish('chat', 0)
+    readers[0].cancel()
+    pubsub.publish('chat', 1)
+    received = await asyncio.wait_for(asyncio.gather(*readers[1:]), 1)
+    assert sorted(received) == [('chat', 0), ('chat', 1)]
+
+    # All the readers are woken up on close
+    readers = [asyncio.ensure_future(sub.get()) for _ in range(2)]
+    await asyncio.sleep(0)
+    sub.close()
+    for reader in readers:
+        with pytest.raises(SubscriptionClosed):
+            await asyncio.wait_for(reader, 1)
+
+
+def test_slow_subscriber_policies(pubsub):
+    oldest = pubsub.subscribe('chat')
+    newest = pubsub.subscribe('chat', policy='drop_newest')
+    with pubsub.subscribe('chat', policy='disconnect') as disconnect:
+        for i in range(3):
+            pubsub.publish('chat', i)
+
+        assert [oldest.get_nowait()[1] for _ in range(2)] == [1, 2]
+        assert [newest.get_nowait()[1] for _ in range(2)] == [0, 1]
+        assert oldest.dropped == newest.dropped == 1
+
+        assert disconnect.closed
+        # The buffered messages can still be read
+        assert [disconnect.get_nowait()[1] for _ in range(2)] == [0, 1]
+        with pytest.raises(SubscriptionClosed):
+            disconnect.get_nowait()
+
+    assert pubsub.subscribers_count('chat') == 2
+    pubsub.close()
+    assert pubsub.subscribers_count('chat') == 0
+    assert oldest.closed and newest.closed
@@ -4,9 +4,10 @@ import pytest
 from unittest.mock import Mock
 
 from tygs.http.server import Router, HttpRequestController
+from tygs.http.routing import CompiledRouteMatcher
 
-from werkzeug.routing import Map
-from werkzeug.exceptions import NotFound
+from werkzeug.routing import Map, Rule, RequestRedirect
+from werkzeug.exceptions import NotFound, MethodNotAllowed
 
 
 def test_create_router():
@@ -74,6 +75,117 @@ async def test_get_handler_404(app, aiohttp_request):
     assert res.render_response()['body'] == "Unknown Error".encode('utf8')
 
 
+def test_compiled_matcher_same_as_werkzeug():
+    url_map = Map([
+        Rule('/', endpoint='index'),
+        Rule('/users/', endpoint='users'),
+        Rule('/users/<int:id>', endpoint='user', methods=['GET']),
+        Rule('/users/<int:id>', endpoint='update_user', methods=['POST']),
+        Rule('/users/<name>', endpoint='user_by_name'),
+        Rule('/users/me', endpoint='me'),
+        Rule('/<any(about, help):page>', endpoint='page'),
+        Rule('/files/<path:path>', endpoint='file'),
+        Rule('/<a>/<b>', endpoint='pair', strict_slashes=False),
+    ])
+    matcher = CompiledRouteMatcher(url_map)
+
+    assert len(matcher.fallback_rules) == 1
+
+    for path, method in (('/', 'GET'), ('/users/', 'GET'),
+                         ('/users/1', 'GET'), ('/users/1', 'POST'),
+                         ('/users/1', 'HEAD'), ('/users/bob', 'PUT'),
+                         ('/users/me', 'GET'), ('/about', 'GET'),
+                         ('/x/y', 'GET'), ('/x/y/', 'GET')):
+        expected = url_map.bind('test.local').match(path, method)
+        assert matcher.match(path, method) == expected
+
+    # werkzeug has the final word on redirects and rules we can't compile
+    assert matcher.match('/users', 'GET') is None
+    assert matcher.match('/files/a/b', 'GET') is None
+    assert matcher.match('/nope/nope/nope', 'GET') is None
+
+
+def test_compiled_matcher_errors():
+    url_map = Map([
+        Rule('/toto', endpoint='toto', methods=['POST']),
+        Rule('/tata/<int:id>', endpoint='tata'),
+    ])
+    matcher = CompiledRouteMatcher(url_map)
+
+    assert matcher.match('/tata/1', 'GET') == ('tata', {'id': 1})
+
+    with pytest.raises(NotFound):
+        matcher.match('/tata/foo', 'GET')
+
+    with pytest.raises(MethodNotAllowed) as e:
+        matcher.match('/toto', 'GET')
+    assert e.value.valid_methods == ['POST']
+
+
+@pytest.mark.asyncio
+async def test_get_handler_recompile(app, aiohttp_request):
+    router = Router()
+
+    def toto():
+        pass
+
+    def tata():
+        pass
+
+    router.add_route('/toto/<name>', 'toto_url', toto)
+    matcher = router.matcher
+    assert router.matcher is matcher
+
+    router.add_route('/tata/', 'tata_url', tata)
+    assert router.matcher is not matcher
+
+    req = aiohttp_request('GET', "/toto/foo")
+    handler, arguments = await router.get_handler(
+        HttpRequestController(app, req))
+    assert handler is toto
+    assert arguments == {'name': 'foo'}
+
+    req = aiohttp_request('GET', "/tata")
+    with pytest.raises(RequestRedirect):
+        await router.get_handler(HttpRequestController(app, req))
+
+
+@pytest.mark.asyncio
+async def test_get_handler_cache(app, aiohttp_request):
+    router = Router(cache_size=2)
+
+    def toto():
+        pass
+
+    router.add_route('/toto/<int:id>', 'toto_url', toto)
+
+    for path in ('/toto/1', '/toto/1', '/toto/2', '/toto/3', '/toto/1'):
+        req = HttpRequestController(app, aiohttp_request('GET', path))
+        handler, arguments = await router.get_handler(req)
+        assert handler is toto
+        assert arguments == {'id': int(path[-1])}
+
+    stats = {'hits': 1, 'misses': 4, 'evictions': 2, 'size': 2, 'max_size': 2}
+    assert router.cache.stats() == stats
+
+    # Cached arguments can't be modified from the outside
+    arguments['id'] = 'foo'
+    handler, arguments = await router.get_handler(req)
+    assert arguments == {'id': 1}
+
+    router.add_error_handler(404, toto)
+    assert len(router.cache) == 0
+
+    await router.get_handler(req)
+    router.add_route('/tata', 'tata_url', toto)
+    assert len(router.cache) == 0
+
+    with pytest.raises(NotFound):
+        req = HttpRequestController(app, aiohttp_request('GET', '/nope'))
+        await router.get_handler(req)
+    assert len(router.cache) == 0
+
+
 @pytest.mark.asyncio
 async def test_queued_webapp_and_client(queued_webapp):
 
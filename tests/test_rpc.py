@@ -0,0 +1,121 @@
+import os
+import socket
+import asyncio
+
+from unittest.mock import patch
+
+import pytest
+
+from tygs.rpc import RpcComponent, RemoteError, pack, read_frame
+
+
+@pytest.yield_fixture
+def rpc(app, tmpdir, event_loop):
+    rpc = RpcComponent(app, directory=str(tmpdir), timeout=1)
+
+    @rpc.expose
+    async def add(a, b=0):
+        await asyncio.sleep(0.01)
+        return a + b
+
+    @rpc.expose(name='fail')
+    def fail():
+        raise ValueError('Nope')
+
+    @rpc.expose
+    async def slow():
+        await asyncio.sleep(1)
+
+    @rpc.expose
+    def unserializable():
+        return object()
+
+    yield rpc
+    event_loop.run_until_complete(rpc.stop())
+
+
+def test_app_has_rpc(app):
+    assert isinstance(app.components['rpc'], RpcComponent)
+
+
+@pytest.mark.asyncio
+async def test_framing():
+    reader = asyncio.StreamReader()
+    reader.feed_data(pack([1, 2, None, 'result']))
+    reader.feed_eof()
+    assert await read_frame(reader) == [1, 2, None, 'result']
+    assert await read_frame(reader) is None
+
+
+@pytest.mark.asyncio
+async def test_rpc_calls(rpc):
+    await rpc.start()
+    assert rpc.path.exists()
+
+    assert await rpc.call(str(rpc.path), 'add', 1, b=2) == 3
+
+    # Concurrent calls share the same connection
+    results = await asyncio.gather(*[rpc.call(rpc.path, 'add', i, i)
+                                     for i in range(100)])
+    assert results == [i * 2 for i in range(100)]
+    assert len(rpc.connections) == 1
+
+    with pytest.raises(RemoteError) as error:
+        await rpc.call(rpc.path, 'fail')
+    assert error.value.name == 'ValueError'
+
+    with pytest.raises(RemoteError) as error:
+        await rpc.call(rpc.path, 'nope')
+    assert error.value.name == 'LookupError'
+
+    with pytest.raises(asyncio.TimeoutError):
+        await rpc.call(rpc.path, 'slow', timeout=0.01)
+
+    with pytest.raises(RemoteError) as error:
+        await rpc.call(rpc.path, 'unserializable', timeout=0.5)
+    assert error.value.name == 'TypeError'
+
+    # The connection is still usable after errors
+    assert await rpc.call(rpc.path, 'add', 1) == 1
+
+    path = rpc.path
+    await rpc.stop()
+    assert not path.exists()
+    assert not rpc.connections
+
+
+@pytest.mark.asyncio
+async def test_rpc_worker_path(rpc, app):
+    app.worker_id = 1
+    await rpc.start()
+    assert rpc.path == rpc.directory / '1.sock'
+    assert await rpc.call(1, 'add', 2, 2) == 4
+
+
+@pytest.mark.asyncio
+async def test_rpc_socket_in_use(rpc, app):
+    rpc.directory = rpc.directory / 'sockets'
+    await rpc.start()
+    assert rpc.directory.stat().st_mode & 0o777 == 0o700
+
+    other = RpcComponent(app, directory=rpc.directory)
+    other.expose(len)
+    with pytest.raises(OSError):
+        await other.start()
+    assert await rpc.call(rpc.path, 'add', 1) == 1
+
+    # Left by a process that didn't stop cleanly
+    await rpc.stop()
+    stale = socket.socket(socket.AF_UNIX)
+    stale.bind(str(rpc.path))
+    stale.close()
+    await other.start()
+    assert await other.call(other.path, 'len', 'abc') == 3
+    await other.stop()
+
+
+@pytest.mark.asyncio
+async def test_rpc_directory_of_another_user(rpc):
+    with patch('tygs.rpc.os.getuid', return_value=os.getuid() + 1):
+        with pytest.raises(PermissionError):
+            await rpc.start()
@@ -0,0 +1,19 @@
+import pytest
+
+from tygs import serializers
+
+
+@pytest.mark.parametrize('dumps,loads', [
+    (serializers.dumps, serializers.loads),
+    (serializers.stdlib_dumps, serializers.stdlib_loads),
+])
+def test_json_roundtrip(dumps, loads):
+    data = {'fromage': ['brie', 'comté'], 'age': 3, 'bio': True}
+    encoded = dumps(data)
+    assert isinstance(encoded, bytes)
+    assert loads(encoded) == data
+
+
+def test_json_invalid():
+    with pytest.raises(ValueError):
+        serializers.loads(b'{"fromage"')
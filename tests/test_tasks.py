@@ -0,0 +1,237 @@
+import time
+import asyncio
+import threading
+
+from unittest.mock import patch
+
+import pytest
+
+from tygs.tasks import TaskComponent, SQLiteBackend, TaskDefinition
+from tygs.utils import inline
+
+
+def test_app_has_tasks(app):
+    assert isinstance(app.components['tasks'], TaskComponent)
+
+
+def test_backoff():
+    definition = TaskDefinition(None, 'test', backoff=1, max_backoff=5)
+    assert [definition.get_delay(i) for i in range(1, 5)] == [1, 2, 4, 5]
+
+
+def test_unknown_task(app):
+    tasks = TaskComponent(app)
+    with pytest.raises(ValueError):
+        asyncio.get_event_loop().run_until_complete(tasks.enqueue('nope'))
+
+
+@pytest.mark.asyncio
+async def test_enqueue_and_run(app):
+    tasks = app.components['tasks']
+    results = []
+
+    @app.task
+    async def add(a, b):
+        results.append(a + b)
+
+    @app.task(name='mul')
+    def mul(a, b):
+        results.append(a * b)
+
+    await tasks.start()
+    try:
+        await app.enqueue(add, 1, b=2)
+        await app.enqueue('mul', 3, 4)
+        await asyncio.sleep(0.01)
+        assert sorted(results) == [3, 12]
+        assert tasks.stats['done'] == 2
+    finally:
+        await tasks.stop()
+
+
+@pytest.mark.asyncio
+async def test_sync_tasks_run_in_threads(app):
+    tasks = app.components['tasks']
+    threads = {}
+
+    @app.task
+    def blocking():
+        threads['blocking'] = threading.get_ident()
+
+    @app.task
+    @inline
+    def cheap():
+        threads['cheap'] = threading.get_ident()
+
+    await tasks.start()
+    try:
+        await app.enqueue(blocking)
+        await app.enqueue(cheap)
+        await asyncio.sleep(0.05)
+        assert threads['blocking'] != threading.get_ident()
+        assert threads['cheap'] == threading.get_ident()
+    finally:
+        await tasks.stop()
+        await app.components['threads'].shutdown()
+
+
+@pytest.mark.asyncio
+async def test_backend_errors_keep_consumers(app):
+    tasks = TaskComponent(app, consumers=1)
+    done = []
+
+    @tasks.task
+    async def job(i):
+        done.append(i)
+
+    await tasks.start()
+    try:
+        with patch.object(tasks.backend, 'done',
+                          side_effect=OSError('database is locked')):
+            with patch('tygs.tasks.log') as log:
+                await tasks.enqueue(job, 1)
+                await asyncio.sleep(0.01)
+        assert log.exception.called
+        await tasks.enqueue(job, 2)
+        await asyncio.sleep(0.01)
+        assert done == [1, 2]
+        assert tasks.stats['done'] == 1
+    finally:
+        await tasks.stop()
+
+
+@pytest.mark.asyncio
+async def test_queue_limits(app):
+    tasks = TaskComponent(app, consumers=4, limits={'slow': 1})
+    running = []
+    max_running = []
+
+    @tasks.task(queue='slow')
+    async def slow():
+        running.append(1)
+        max_running.append(len(running))
+        await asyncio.sleep(0.01)
+        running.pop()
+
+    done = []
+
+    @tasks.task
+    def fast():
+        done.append(1)
+
+    await tasks.start()
+    try:
+        for _ in range(3):
+            await tasks.enqueue(slow)
+        await tasks.enqueue(fast)
+        await asyncio.sleep(0.005)
+        # The slow queue doesn't block the other ones
+        assert done == [1]
+        await asyncio.sleep(0.05)
+        assert max_running == [1, 1, 1]
+    finally:
+        await tasks.stop()
+
+
+@pytest.mark.asyncio
+async def test_retries(app):
+    tasks = TaskComponent(app)
+    calls = []
+
+    @tasks.task(retries=2, backoff=0.001)
+    def flaky():
+        calls.append(1)
+        if len(calls) < 3:
+            raise ValueError('Not yet')
+
+    @tasks.task(retries=1, backoff=0.001)
+    def broken():
+        raise ValueError('Never')
+
+    await tasks.start()
+    try:
+        await tasks.enqueue(flaky)
+        await tasks.enqueue(broken)
+        await asyncio.sleep(0.05)
+        assert len(calls) == 3
+        assert tasks.stats == {'enqueued': 2, 'done': 1, 'retried': 3,
+                               'failed': 1}
+    finally:
+        await tasks.stop()
+
+
+@pytest.mark.asyncio
+async def test_stop_drains_jobs(app):
+    tasks = TaskComponent(app, consumers=1)
+    done = []
+
+    @tasks.task
+    async def job(i):
+        await asyncio.sleep(0.001)
+        done.append(i)
+
+    await tasks.start()
+    for i in range(5):
+        await tasks.enqueue(job, i)
+    await tasks.stop()
+    assert done == [0, 1, 2, 3, 4]
+
+    with pytest.raises(RuntimeError):
+        await tasks.enqueue(job, 5)
+
+
+@pytest.mark.asyncio
+async def test_stop_timeout(app):
+    tasks = TaskComponent(app, consumers=1, stop_timeout=0.05)
+
+    @tasks.task
+    async def job():
+        await asyncio.sleep(1)
+
+    await tasks.start()
+    await tasks.enqueue(job)
+    await asyncio.sleep(0)
+    started = time.monotonic()
+    with patch('tygs.tasks.log') as log:
+        await tasks.stop()
+    assert time.monotonic() - started < 0.5
+    log.warning.assert_called_once_with('%s jobs lost on stop', 1)
+
+
+@pytest.mark.asyncio
+async def test_sqlite_backend_persists_jobs(app, tmpdir):
+    path = str(tmpdir.join('tasks.db'))
+    done = []
+
+    def make_component():
+        tasks = TaskComponent(app, consumers=1,
+                              backend=SQLiteBackend(path), stop_timeout=0.05)
+
+        @tasks.task(name='job')
+        async def job(i):
+            if i == 0:
+                await asyncio.sleep(1)
+            done.append(i)
+
+        return tasks
+
+    tasks = make_component()
+    await tasks.start()
+    for i in range(3):
+        await tasks.enqueue('job', i)
+    # The first job is too long: it's cancelled and kept for next time,
+    # with the ones that didn't start
+    await tasks.stop()
+    assert done == []
+
+    tasks = make_component()
+    tasks.tasks['job'].func = lambda i: done.append(i)
+    await tasks.start()
+    await asyncio.sleep(0.05)
+    await tasks.stop()
+    assert sorted(done) == [0, 1, 2]
+
+    tasks = make_component()
+    await tasks.start()
+    await tasks.stop()
+    assert tasks.stats['done'] == 0
@@ -0,0 +1,152 @@
+import time
+import asyncio
+import threading
+
+import pytest
+
+from tygs.components import Component
+from tygs.threads import ThreadPoolComponent
+from tygs.utils import inline
+
+
+def test_app_has_threads(app):
+    assert isinstance(app.components['threads'], ThreadPoolComponent)
+
+
+def test_wrap(app):
+    threads = app.components['threads']
+
+    async def coroutine():
+        pass
+
+    @inline
+    def cheap():
+        pass
+
+    def blocking():
+        pass
+
+    assert threads.wrap(coroutine) is coroutine
+    assert threads.wrap(cheap) is cheap
+    assert asyncio.iscoroutinefunction(threads.wrap(blocking))
+
+
+@pytest.mark.asyncio
+async def test_run_in_thread(app):
+    threads = ThreadPoolComponent(app, max_workers=2)
+    main_thread = threading.get_ident()
+
+    assert await threads.run(threading.get_ident) != main_thread
+    with pytest.raises(ValueError):
+        await threads.run(int, 'nope')
+
+    assert threads.stats['calls'] == 2
+    assert threads.stats['in_flight'] == 0
+    await threads.shutdown()
+    assert threads.executor is None
+
+
+@pytest.mark.asyncio
+async def test_max_queued(app):
+    threads = ThreadPoolComponent(app, max_workers=1, max_queued=1)
+    event = threading.Event()
+
+    calls = [asyncio.ensure_future(threads.run(event.wait, 1))
+             for _ in range(4)]
+    await asyncio.sleep(0.01)
+    # One running, one in the executor queue, the others wait on the loop
+    assert threads.stats['in_flight'] == 2
+    assert threads.stats['waiting'] == 2
+
+    event.set()
+    assert await asyncio.gather(*calls) == [True] * 4
+    assert threads.stats['max_in_flight'] == 2
+    await threads.shutdown()
+
+
+@pytest.mark.asyncio
+async def test_sync_handlers_run_in_threads(app):
+    main_thread = threading.get_ident()
+    threads = {}
+
+    @app.on('event')
+    def blocking():
+        threads['blocking'] = threading.get_ident()
+
+    @app.on('event', inline=True)
+    def cheap():
+        threads['cheap'] = threading.get_ident()
+
+    await app.trigger('event')
+    assert threads['blocking'] != main_thread
+    assert threads['cheap'] == main_thread
+
+
+@pytest.mark.asyncio
+async def test_sync_route_handlers_run_in_threads(queued_webapp):
+    app = queued_webapp()
+    http = app.components['http']
+    main_thread = threading.get_ident()
+
+    @http.get('/')
+    def blocking(req, res):
+        return res.text(threading.get_ident() != main_thread)
+
+    @http.get('/inline', inline=True)
+    def cheap(req, res):
+        return res.text(threading.get_ident() == main_thread)
+
+    await app.async_ready()
+
+    response = await app.client.get('/')
+    assert response._renderer_data == 'True'
+    response = await app.client.get('/inline')
+    assert response._renderer_data == 'True'
+    assert app.components['threads'].stats['calls'] == 1
+
+    await app.async_stop()
+
+
+@pytest.mark.asyncio
+async def test_shutdown_after_stop_handlers(app):
+    threads = app.components['threads']
+    calls = []
+
+    @app.on('stop')
+    def blocking():
+        calls.append(threading.get_ident())
+
+    await app.async_ready()
+    await app.async_stop()
+
+    assert calls and calls[0] != threading.get_ident()
+    assert threads.executor is None
+
+
+@pytest.mark.asyncio
+async def test_threaded_setups_run_one_at_a_time(app):
+    running = []
+    overlaps = []
+
+    class Blocking(Component):
+        def setup(self):
+            running.append(self)
+            overlaps.append(len(running))
+            for priority in range(20):
+                self.app.register('event', lambda: None, priority=priority,
+                                  inline=True)
+                time.sleep(0.001)
+            running.remove(self)
+
+    for i in range(3):
+        app.components['blocking{}'.format(i)] = Blocking(app)
+
+    await app.async_ready()
+    try:
+        assert overlaps == [1, 1, 1]
+        signals = app.components['signals']
+        assert len(signals.signals['event']) == 60
+        assert signals.sort_keys['event'] == sorted(
+            signals.sort_keys['event'])
+    finally:
+        await app.async_stop()
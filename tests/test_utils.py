@@ -1,4 +1,5 @@
 
+import asyncio
 import inspect
 from unittest.mock import patch, Mock
 
@@ -70,13 +71,14 @@ async def test_ensure_awaitable():
 
 
 def test_silence_loop_error_log(aioloop):
-    assert aioloop._exception_handler is None
+    assert aioloop.get_exception_handler() is None
     with utils.silence_loop_error_log(aioloop):
-        assert aioloop._exception_handler.__name__ == '<lambda>'
-        assert aioloop._exception_handler(None, None) is None
-        assert aioloop._exception_handler(1, {}) is None
+        handler = aioloop.get_exception_handler()
+        assert handler.__name__ == '<lambda>'
+        assert handler(None, None) is None
+        assert handler(1, {}) is None
 
-    assert aioloop._exception_handler is None
+    assert aioloop.get_exception_handler() is None
 
 
 def test_removable_property():
@@ -129,3 +131,32 @@ def test_aiorun():
 
     assert utils.aiorun(foo) == 1
     beacon.assert_called_once_with()
+
+
+def test_get_loop_policy():
+    assert isinstance(utils.get_loop_policy('asyncio'),
+                      asyncio.DefaultEventLoopPolicy)
+    with pytest.raises(ValueError):
+        utils.get_loop_policy('wololo')
+
+    with patch('tygs.utils.uvloop', None):
+        # Fall back on asyncio if uvloop is not installed
+        assert isinstance(utils.get_loop_policy('auto'),
+                          asyncio.DefaultEventLoopPolicy)
+        with pytest.raises(RuntimeError):
+            utils.get_loop_policy('uvloop')
+
+    uvloop = Mock()
+    with patch('tygs.utils.uvloop', uvloop):
+        assert utils.get_loop_policy('auto') is \
+            uvloop.EventLoopPolicy.return_value
+
+
+def test_aioloop_with_policy():
+    loop = utils.aioloop('asyncio')
+    try:
+        assert isinstance(asyncio.get_event_loop_policy(),
+                          asyncio.DefaultEventLoopPolicy)
+        assert asyncio.get_event_loop() is loop
+    finally:
+        loop.close()
@@ -0,0 +1,85 @@
+import os
+import signal
+
+from multiprocessing import Process, Queue
+from time import sleep
+from unittest.mock import patch, call
+
+import pytest
+import requests
+
+import tygs
+
+from tygs.workers import Supervisor
+
+
+def run_workers(queue):  # noqa
+    tygs.utils.aioloop()
+    app, http = tygs.webapp.WebApp.quickstart("namespace")
+
+    @http.get('/')
+    def index(req, res):
+        return res.text(os.getpid())
+
+    @app.on('stop')
+    def stop():
+        queue.put(os.getpid())
+        # Workers exit with os._exit(), so flush the queue now
+        queue.close()
+        queue.join_thread()
+
+    app.ready(workers=2)
+
+
+@pytest.yield_fixture
+def workers():
+    queue = Queue()
+    master = Process(target=run_workers, args=(queue,))
+    master.start()
+    sleep(1)
+    yield master, queue
+    if master.is_alive():  # pragma: no cover
+        master.terminate()
+    master.join()
+
+
+def get_worker_pid():
+    return int(requests.get('http://localhost:8080').text)
+
+
+def test_workers(workers):
+    master, queue = workers
+
+    pid = get_worker_pid()
+    assert pid != master.pid
+
+    # Crashed workers are replaced
+    os.kill(pid, signal.SIGKILL)
+    sleep(0.5)
+    assert get_worker_pid() != pid
+
+    # Workers stop cleanly with the master
+    master.terminate()
+    master.join(5)
+    assert master.exitcode == 0
+    stopped = {queue.get(timeout=1), queue.get(timeout=1)}
+    assert pid not in stopped
+    for pid in stopped:
+        with pytest.raises(ProcessLookupError):
+            os.kill(pid, 0)
+
+
+def test_supervisor_invalid_workers(app):
+    with pytest.raises(ValueError):
+        Supervisor(app, 0)
+
+
+def test_supervisor_forwards_sigusr2(app):
+    supervisor = Supervisor(app, 2)
+    supervisor.workers = {1001: (0, 0), 1002: (1, 0)}
+    with patch('tygs.workers.os.kill') as kill:
+        kill.side_effect = [None, ProcessLookupError]
+        supervisor.forward_signal(signal.SIGUSR2)
+    assert sorted(kill.call_args_list) == [call(1001, signal.SIGUSR2),
+                                           call(1002, signal.SIGUSR2)]
+    assert supervisor.state == "pristine"